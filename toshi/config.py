@@ -74,6 +74,9 @@ def setup_config():
 
     config.set_from_os_environ('database', 'max_size', 'MAX_DATABASE_CONNECTIONS')
     config.set_from_os_environ('database', 'min_size', 'MIN_DATABASE_CONNECTIONS')
+    config.set_from_os_environ('database', 'replica_urls', 'DATABASE_REPLICA_URLS')
+    config.set_from_os_environ('database', 'replica_selection', 'DATABASE_REPLICA_SELECTION')
+    config.set_from_os_environ('database', 'replica_max_lag', 'DATABASE_REPLICA_MAX_LAG')
     config.set_from_os_environ('redis', 'url', 'REDIS_URL')
 
     config.set_from_os_environ('s3', 'aws_access_key_id', 'AWS_ACCESS_KEY_ID')
@@ -3,7 +3,9 @@ import asyncpg
 import os
 import sys
 import ssl
-from collections import ItemsView
+import time
+from collections import ItemsView, OrderedDict
+from collections.abc import Mapping
 from toshi.config import config
 from toshi.errors import DatabaseError
 from toshi.log import log
@@ -69,6 +71,8 @@ def create_pool(dsn=None, *,
         max_size = int(max_size)
     if min_size > max_size:
         min_size = max_size
+    if isinstance(connect_kwargs.get('statement_cache_size'), str):
+        connect_kwargs['statement_cache_size'] = int(connect_kwargs['statement_cache_size'])
     if ssl:
         if ssl is True:
             ssl = SSL_CTX
@@ -88,13 +92,320 @@ def set_database_pool(connection):
 
 _global_database_pool = None
 
+# number of rows sent in each COPY by the bulk helpers
+BULK_CHUNK_SIZE = 10000
+
+async def _iter_chunks(rows, chunk_size):
+    """yields lists of up to `chunk_size` rows from an iterable or async
+    iterable"""
+    chunk = []
+    if hasattr(rows, '__aiter__'):
+        async for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    else:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+def _chunk_to_tuples(chunk, columns):
+    # dict rows are converted to tuples in the order of `columns`
+    if isinstance(chunk[0], Mapping):
+        if columns is None:
+            raise DatabaseError("columns must be given for dict rows")
+        return [tuple(row[column] for column in columns) for row in chunk]
+    return chunk
+
+def _row_count(status):
+    # e.g. "INSERT 0 10"
+    try:
+        return int(status.rsplit(' ', 1)[-1])
+    except (AttributeError, ValueError):
+        return 0
+
+# upper bounds (in seconds) of the buckets in the statement latency histograms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class StatementMetrics:
+    """call count, errors and latency histogram for a statement. The last
+    value in `histogram` counts the calls slower than the last bucket"""
+
+    __slots__ = ('calls', 'errors', 'total_time', 'max_time', 'histogram')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, duration, error=False):
+        self.calls += 1
+        if error:
+            self.errors += 1
+        self.total_time += duration
+        if duration > self.max_time:
+            self.max_time = duration
+        for idx, bucket in enumerate(LATENCY_BUCKETS):
+            if duration <= bucket:
+                break
+        else:
+            idx = len(LATENCY_BUCKETS)
+        self.histogram[idx] += 1
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_time': self.total_time,
+            'mean_time': self.total_time / self.calls if self.calls else 0.0,
+            'max_time': self.max_time,
+            'histogram': dict(zip([str(b) for b in LATENCY_BUCKETS] + ['inf'], self.histogram))
+        }
+
+class Statement:
+    """A named query from a StatementRegistry. Can be passed to the query
+    methods of HandlerDatabasePoolContext in place of the query string, in
+    which case its metrics are recorded. The query text never changes, so
+    after the first use on a connection it's served from asyncpg's per
+    connection statement cache (see `StatementRegistry.statement_cache_size`)"""
+
+    __slots__ = ('name', 'query', 'registry', 'metrics')
+
+    def __init__(self, name, query, registry):
+        self.name = name
+        self.query = query
+        self.registry = registry
+        self.metrics = StatementMetrics()
+
+    def __repr__(self):
+        return "<Statement {}>".format(self.name)
+
+    async def _run(self, connection, method, *args, **kwargs):
+        start = time.time()
+        error = True
+        try:
+            rval = await getattr(connection, method)(self.query, *args, **kwargs)
+            error = False
+            return rval
+        finally:
+            self.metrics.record(time.time() - start, error)
+
+    def execute(self, connection, *args, timeout=None):
+        return self._run(connection, 'execute', *args, timeout=timeout)
+
+    def executemany(self, connection, args, *, timeout=None):
+        return self._run(connection, 'executemany', args, timeout=timeout)
+
+    def fetch(self, connection, *args, timeout=None):
+        return self._run(connection, 'fetch', *args, timeout=timeout)
+
+    def fetchval(self, connection, *args, column=0, timeout=None):
+        return self._run(connection, 'fetchval', *args, column=column, timeout=timeout)
+
+    def fetchrow(self, connection, *args, timeout=None):
+        return self._run(connection, 'fetchrow', *args, timeout=timeout)
+
+class StatementRegistry:
+    """Named queries that are declared once and reused, with metrics
+    recorded for each of them.
+
+    Statements aren't prepared in the pool's `init` hook: asyncpg doesn't
+    allow a PreparedStatement to be used once its connection has been
+    released back to the pool, and `Connection.prepare` doesn't add to the
+    statement cache. Instead the cache of each connection of the global
+    pool is made large enough to hold all the registered statements as
+    well as the ad hoc queries, so they aren't evicted by them. Statements
+    should be registered (e.g. at import time) before the pool is created"""
+
+    # asyncpg's default statement_cache_size
+    AD_HOC_CACHE_SIZE = 100
+
+    def __init__(self):
+        self.statements = OrderedDict()
+
+    def register(self, name, query):
+        """returns the Statement for `query`. Registering the same name again
+        returns the existing Statement if the query is the same"""
+        statement = self.statements.get(name)
+        if statement is not None:
+            if statement.query != query:
+                raise ValueError("Statement {} is already registered with a different query".format(name))
+            return statement
+        statement = Statement(name, query, self)
+        self.statements[name] = statement
+        return statement
+
+    def __getitem__(self, name):
+        return self.statements[name]
+
+    def statement_cache_size(self, ad_hoc=None):
+        """the statement_cache_size needed for connections to hold all the
+        registered statements along with `ad_hoc` other queries"""
+        if ad_hoc is None:
+            ad_hoc = self.AD_HOC_CACHE_SIZE
+        return ad_hoc + len(self.statements)
+
+    def metrics(self):
+        """returns the metrics for each statement, ordered by the total time
+        spent running them"""
+        return OrderedDict(
+            (statement.name, statement.metrics.to_dict())
+            for statement in sorted(self.statements.values(),
+                                    key=lambda statement: statement.metrics.total_time, reverse=True))
+
+    def reset_metrics(self):
+        for statement in self.statements.values():
+            statement.metrics.reset()
+
+_global_statement_registry = StatementRegistry()
+
+def get_statement_registry():
+    return _global_statement_registry
+
+def register_statement(name, query):
+    """registers a named query with the global statement registry"""
+    return _global_statement_registry.register(name, query)
+
+# replication lag of a replica in seconds. 0 if the replica has replayed
+# everything it has received, as the last replay timestamp only changes when
+# there are writes on the primary
+REPLICA_LAG_QUERY = """
+SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END
+"""
+
+class ReplicaRouter:
+    """Chooses which of a set of read replica pools to use for read only
+    contexts, using either "round_robin" or "least_busy" `selection`.
+
+    If `max_lag` (in seconds) is given the replication lag of each replica
+    is checked in the background at most every `lag_check_interval`
+    seconds, and replicas that are too far behind (or that couldn't be
+    checked) are skipped. `get_pool` returns None if there are no replicas
+    that can be used, in which case the primary should be used.
+
+    Connections should be acquired and released using `acquire` and
+    `release` so the number in use from each replica can be tracked"""
+
+    def __init__(self, pools, *, selection="round_robin", max_lag=None, lag_check_interval=5.0):
+        if selection not in ("round_robin", "least_busy"):
+            raise ValueError("Unknown replica selection: {}".format(selection))
+        self.pools = list(pools)
+        self.selection = selection
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.lags = [None] * len(self.pools)
+        self.in_use = {pool: 0 for pool in self.pools}
+        self._next = 0
+        self._last_lag_check = 0
+        self._lag_check = None
+
+    def get_pool(self):
+        if self.max_lag is not None:
+            self._maybe_check_lag()
+            pools = [pool for pool, lag in zip(self.pools, self.lags) if lag is not None and lag <= self.max_lag]
+        else:
+            pools = self.pools
+        if not pools:
+            return None
+        if self.selection == "least_busy":
+            return min(pools, key=self.in_use.__getitem__)
+        pool = pools[self._next % len(pools)]
+        self._next = (self._next + 1) % len(pools)
+        return pool
+
+    async def acquire(self, pool, timeout=None):
+        self.in_use[pool] += 1
+        try:
+            return await pool.acquire(timeout=timeout)
+        except BaseException:
+            self.in_use[pool] -= 1
+            raise
+
+    async def release(self, pool, connection):
+        self.in_use[pool] -= 1
+        await pool.release(connection)
+
+    def _maybe_check_lag(self):
+        if (self._lag_check is None or self._lag_check.done()) and \
+           time.time() - self._last_lag_check >= self.lag_check_interval:
+            self._last_lag_check = time.time()
+            self._lag_check = asyncio.ensure_future(self.check_lag())
+
+    async def check_lag(self):
+        """updates the replication lag of each replica"""
+        self.lags = await asyncio.gather(*[self._get_lag(pool) for pool in self.pools])
+
+    async def _get_lag(self, pool):
+        try:
+            async with pool.acquire(timeout=self.lag_check_interval) as con:
+                return float(await con.fetchval(REPLICA_LAG_QUERY))
+        except Exception as e:
+            log.warning("Unable to get replication lag: {}".format(e))
+            return None
+
+    async def close(self):
+        if self._lag_check is not None and not self._lag_check.done():
+            self._lag_check.cancel()
+        await asyncio.gather(*[pool.close() for pool in self.pools])
+
+def get_replica_router():
+    """returns the ReplicaRouter for the global pool, or None if there are
+    no replicas configured"""
+    return _global_replica_router
+
+def set_replica_router(router):
+    global _global_replica_router
+    _global_replica_router = router
+
+_global_replica_router = None
+
+# options in the database config used to set up replicas, rather than
+# being passed to create_pool
+REPLICA_CONFIG_KEYS = ('replica_urls', 'replica_selection', 'replica_max_lag', 'replica_lag_check_interval')
+# options from the primary config that are also used for the replicas
+REPLICA_POOL_KEYS = ('min_size', 'max_size', 'max_queries', 'max_inactive_connection_lifetime',
+                     'statement_cache_size')
+
+async def _prepare_replica_router(dbconfig, replica_config, ssl):
+    urls = [url.strip() for url in replica_config['replica_urls'].split(',') if url.strip()]
+    if not urls:
+        return None
+    pool_config = {k: dbconfig[k] for k in REPLICA_POOL_KEYS if k in dbconfig}
+    if 'max_inactive_connection_lifetime' in pool_config:
+        pool_config['max_inactive_connection_lifetime'] = float(pool_config['max_inactive_connection_lifetime'])
+    pools = [await create_pool(url, ssl=ssl, **pool_config) for url in urls]
+    max_lag = replica_config.get('replica_max_lag')
+    router = ReplicaRouter(
+        pools, selection=replica_config.get('replica_selection', 'round_robin'),
+        max_lag=float(max_lag) if max_lag else None,
+        lag_check_interval=float(replica_config.get('replica_lag_check_interval', 5.0)))
+    if router.max_lag is not None:
+        await router.check_lag()
+    return router
+
 async def _prepare_global_pool():
-    global _global_database_pool
+    global _global_database_pool, _global_replica_router
     if _global_database_pool is None:
         dbconfig = dict(config['database'])
         dbconfig.pop('ssl', None)
+        replica_config = {k: dbconfig.pop(k) for k in REPLICA_CONFIG_KEYS if k in dbconfig}
         ssl = config['database'].getboolean('ssl')
+        # make room for the registered statements in the statement cache
+        dbconfig.setdefault('statement_cache_size', get_statement_registry().statement_cache_size())
         _global_database_pool = await create_pool(ssl=ssl, **dbconfig)
+        if _global_replica_router is None and replica_config.get('replica_urls'):
+            _global_replica_router = await _prepare_replica_router(dbconfig, replica_config, ssl)
     return _global_database_pool
 
 async def prepare_database(config=None, handle_migration=None):
@@ -213,27 +524,86 @@ async def wait_for_migration(con, poll_frequency=1):
     return
 
 class HandlerDatabasePoolContext():
-
-    __slots__ = ('timeout', 'connection', 'transaction', 'autocommit', 'pool', 'done', 'callbacks')
-
-    def __init__(self, pool, autocommit=False, timeout=None):
+    """Context for running queries on a connection from `pool`.
+
+    The connection is only acquired (and the transaction started) when the
+    first query is run, so code paths that exit the context without using
+    the database (e.g. returning cached data or validation errors) don't
+    hold on to a connection from the pool. This means `connection` and
+    `transaction` are None until then: code that uses the connection
+    directly (e.g. for `prepare` or cursors) should get it using
+    `acquire_connection`. A transaction is rolled back on exit unless
+    `commit` is called (or `autocommit` is set).
+
+    If `readonly` is set no transaction is started, saving the BEGIN and
+    ROLLBACK round trips for handlers that only read data, and only the
+    `fetch*` methods can be used. If a consistent view across multiple
+    queries is needed `readonly_transaction` can also be set to run them
+    in a READ ONLY transaction instead. Read only contexts use a connection
+    from one of the `replicas` (a ReplicaRouter) if given"""
+
+    __slots__ = ('timeout', 'connection', 'transaction', 'autocommit', 'pool', 'done', 'callbacks',
+                 'readonly', 'readonly_transaction', 'active', 'replicas', 'connection_pool', '_acquire_lock')
+
+    def __init__(self, pool, autocommit=False, timeout=None, readonly=False, readonly_transaction=False,
+                 replicas=None):
         self.pool = pool
         self.timeout = timeout
         self.autocommit = autocommit
+        self.readonly = readonly
+        self.readonly_transaction = readonly_transaction
+        self.replicas = replicas
         self.connection = None
+        self.connection_pool = None
         self.transaction = None
         self.done = False
+        self.active = False
         self.callbacks = []
+        self._acquire_lock = None
 
-    def acquire(self, autocommit=None):
+    def acquire(self, autocommit=None, readonly=None, readonly_transaction=None):
         """creates a new context with the values of this one"""
         if autocommit is None:
             autocommit = self.autocommit
-        return HandlerDatabasePoolContext(self.pool, autocommit, self.timeout)
+        if readonly is None:
+            readonly = self.readonly
+        if readonly_transaction is None:
+            readonly_transaction = self.readonly_transaction
+        return HandlerDatabasePoolContext(self.pool, autocommit, self.timeout,
+                                          readonly=readonly, readonly_transaction=readonly_transaction,
+                                          replicas=self.replicas)
 
     async def __aenter__(self):
-        if self.connection is not None:
+        if self.active:
             raise DatabaseError("Connection already in progress")
+        self.active = True
+        self.done = False
+        if self._acquire_lock is None:
+            self._acquire_lock = asyncio.Lock()
+        return self
+
+    async def _acquire_connection(self):
+        if self.readonly and self.replicas is not None:
+            pool = self.replicas.get_pool()
+            if pool is not None:
+                try:
+                    self.connection = await self.replicas.acquire(pool, timeout=self.timeout)
+                    self.connection_pool = pool
+                except (asyncpg.exceptions.PostgresConnectionError, asyncpg.exceptions.ConnectionDoesNotExistError,
+                        OSError, asyncio.TimeoutError):
+                    log.exception("Error acquiring replica connection, using the primary")
+        if self.connection is None:
+            await self._acquire_primary_connection()
+        if not self.readonly or self.readonly_transaction:
+            try:
+                await self._start_transaction()
+            except BaseException:
+                con, pool = self.connection, self.connection_pool
+                self.connection = self.connection_pool = self.transaction = None
+                await self._release(con, pool)
+                raise
+
+    async def _acquire_primary_connection(self):
         try:
             self.connection = await self.pool.acquire(timeout=self.timeout)
         except asyncpg.exceptions.ConnectionDoesNotExistError:
@@ -251,79 +621,114 @@ class HandlerDatabasePoolContext():
                     sys.exit(1)
             else:
                 raise
-        self.transaction = self.connection.transaction()
+        self.connection_pool = self.pool
+
+    async def _start_transaction(self):
+        self.transaction = self.connection.transaction(readonly=self.readonly)
         await self.transaction.start()
-        return self
+
+    async def _get_connection(self, write=True):
+        if not self.active or self.done:
+            raise DatabaseError("No transaction in progress")
+        if write and self.readonly and not self.readonly_transaction:
+            raise DatabaseError("Context is read only")
+        # the lock stops concurrent first queries from each acquiring a
+        # connection, and from running before the transaction has started
+        if self.connection is None or self._acquire_lock.locked():
+            async with self._acquire_lock:
+                if self.connection is None:
+                    await self._acquire_connection()
+        return self.connection
+
+    async def acquire_connection(self):
+        """returns the context's connection, acquiring it (and starting the
+        transaction) if no queries have been run yet"""
+        return await self._get_connection(write=False)
 
     async def __aexit__(self, extype, ex, tb):
         try:
             if self.transaction:
-                if extype is not None or self.autocommit is False:
+                if extype is not None or self.autocommit is False or self.readonly:
                     await self.transaction.rollback()
                 elif self.autocommit:
                     await self.commit()
+            elif self.callbacks and extype is None and self.autocommit and not self.done:
+                # nothing was run, but there may be callbacks waiting
+                await self.commit()
         finally:
             con = self.connection
+            pool = self.connection_pool
             self.transaction = None
             self.connection = None
+            self.connection_pool = None
+            self.active = False
             self.done = True
-            await self.pool.release(con)
+            if con is not None:
+                await self._release(con, pool)
 
-    async def commit(self, create_new_transaction=False):
-        if self.transaction:
-            try:
-                callbacks = self.callbacks[:]
-                self.callbacks.clear()
-                rval = await self.transaction.commit()
-                for callback in callbacks:
-                    f = callback()
-                    if asyncio.iscoroutine(f):
-                        await f
-                return rval
-            finally:
-                if create_new_transaction:
-                    self.transaction = self.connection.transaction()
-                    await self.transaction.start()
-                else:
-                    self.done = True
-                    self.transaction = None
+    async def _release(self, con, pool):
+        if pool is not self.pool and self.replicas is not None:
+            await self.replicas.release(pool, con)
         else:
+            await pool.release(con)
+
+    async def commit(self, create_new_transaction=False):
+        if not self.active or self.done or (self.readonly and not self.readonly_transaction):
             raise DatabaseError("No transaction to commit")
+        try:
+            callbacks = self.callbacks[:]
+            self.callbacks.clear()
+            # if the connection hasn't been used there's nothing to commit
+            rval = None
+            if self.transaction:
+                rval = await self.transaction.commit()
+            for callback in callbacks:
+                f = callback()
+                if asyncio.iscoroutine(f):
+                    await f
+            return rval
+        finally:
+            self.transaction = None
+            if create_new_transaction:
+                if self.connection is not None:
+                    await self._start_transaction()
+            else:
+                self.done = True
 
     def on_commit(self, callback):
         """used to trigger functions on commit"""
         if callback not in self.callbacks:
             self.callbacks.append(callback)
 
-    def execute(self, query: str, *args, timeout: float=None) -> str:
-        if self.transaction:
-            return self.connection.execute(query, *args, timeout=timeout)
-        else:
-            raise DatabaseError("No transaction in progress")
-
-    def executemany(self, command: str, args, *, timeout: float=None):
-        if self.transaction:
-            return self.connection.executemany(command, args, timeout=timeout)
-        else:
-            raise DatabaseError("No transaction in progress")
-
-    def fetch(self, query, *args, timeout=None):
-        if self.transaction:
-            return self.connection.fetch(query, *args, timeout=timeout)
-        else:
-            raise DatabaseError("No transaction in progress")
-
-    def fetchval(self, query, *args, column=0, timeout=None):
-        if self.transaction:
-            return self.connection.fetchval(query, *args, column=column, timeout=timeout)
-        else:
-            raise DatabaseError("No transaction in progress")
-
-    def fetchrow(self, query, *args, timeout=None):
-        if self.transaction:
-            return self.connection.fetchrow(query, *args, timeout=timeout)
-        else:
-            raise DatabaseError("No transaction in progress")
+    async def execute(self, query: str, *args, timeout: float=None) -> str:
+        connection = await self._get_connection()
+        if isinstance(query, Statement):
+            return await query.execute(connection, *args, timeout=timeout)
+        return await connection.execute(query, *args, timeout=timeout)
+
+    async def executemany(self, command: str, args, *, timeout: float=None):
+        connection = await self._get_connection()
+        if isinstance(command, Statement):
+            return await command.executemany(connection, args, timeout=timeout)
+        return await connection.executemany(command, args, timeout=timeout)
+
+    async def fetch(self, query, *args, timeout=None):
+        connection = await self._get_connection(write=False)
+        if isinstance(query, Statement):
+            return await query.fetch(connection, *args, timeout=timeout)
+        return await connection.fetch(query, *args, timeout=timeout)
+
+    async def fetchval(self, query, *args, column=0, timeout=None):
+        connection = await self._get_connection(write=False)
+        if isinstance(query, Statement):
+            return await query.fetchval(connection, *args, column=column, timeout=timeout)
+        return await connection.fetchval(query, *args, column=column, timeout=timeout)
+
+    async def fetchrow(self, query, *args, timeout=None):
+        connection = await self._get_connection(write=False)
+        if isinstance(query, Statement):
+            return await query.fetchrow(connection, *args, timeout=timeout)
+        return await connection.fetchrow(query, *args, timeout=timeout)
 
     async def update(self, tablename, update_args, query_args=None):
         """Very simple "generic" update helper.
@@ -334,8 +739,7 @@ class HandlerDatabasePoolContext():
         other types will be left as their python representation.
         """
 
-        if not self.transaction:
-            raise DatabaseError("No transaction in progress")
+        connection = await self._get_connection()
 
         query = "UPDATE {} SET ".format(tablename)
         arglist = []
@@ -343,8 +747,10 @@ class HandlerDatabasePoolContext():
         if isinstance(update_args, dict):
             update_args = update_args.items()
         if isinstance(update_args, (list, tuple, ItemsView)):
+            # the columns are sorted so updates of the same columns always
+            # generate the same query, and hit asyncpg's statement cache
             setstmts = []
-            for k, v in update_args:
+            for k, v in sorted(update_args, key=lambda arg: arg[0]):
                 setstmts.append("{} = ${}".format(k, qnum))
                 qnum += 1
                 arglist.append(v)
@@ -357,7 +763,7 @@ class HandlerDatabasePoolContext():
             query += " WHERE "
             wherestmts = []
             # TODO: support OR somehow?
-            for k, v in query_args:
+            for k, v in sorted(query_args, key=lambda arg: arg[0]):
                 wherestmts.append("{} = ${}".format(k, qnum))
                 qnum += 1
                 arglist.append(v)
@@ -365,24 +771,115 @@ class HandlerDatabasePoolContext():
         elif query_args is not None:
             raise DatabaseError("expected dict or list or None for query_args")
 
-        resp = await self.connection.execute(query, *arglist)
+        resp = await connection.execute(query, *arglist)
 
         if resp and resp[0].startswith("ERROR:"):
             raise DatabaseError(resp)
         return resp
 
-def with_database(fn):
-    async def wrapper(self, *args, **kwargs):
-        async with self.db:
-            r = fn(self, *args, **kwargs)
-            if asyncio.iscoroutine(r):
-                r = await r
-            return r
-    return wrapper
+    async def copy_records(self, tablename, records, *, columns=None, schema_name=None,
+                           chunk_size=BULK_CHUNK_SIZE, timeout=None):
+        """copies `records` (an iterable or async iterable of tuples, or of
+        dicts if `columns` is given) into the table using COPY, sending at
+        most `chunk_size` records at a time so large iterators aren't read
+        into memory. Returns the number of records copied"""
+
+        connection = await self._get_connection()
+        count = 0
+        async for chunk in _iter_chunks(records, chunk_size):
+            await connection.copy_records_to_table(tablename, records=_chunk_to_tuples(chunk, columns),
+                                                   columns=columns, schema_name=schema_name, timeout=timeout)
+            count += len(chunk)
+        return count
+
+    async def bulk_insert(self, tablename, columns, rows, *, chunk_size=BULK_CHUNK_SIZE, timeout=None):
+        """inserts `rows` (tuples in the order of `columns`, or dicts) using
+        COPY. Returns the number of rows inserted"""
+
+        return await self.copy_records(tablename, rows, columns=list(columns),
+                                       chunk_size=chunk_size, timeout=timeout)
+
+    async def bulk_upsert(self, tablename, rows, conflict_keys, update_columns=None, *, columns=None,
+                          chunk_size=BULK_CHUNK_SIZE, timeout=None):
+        """inserts or updates `rows`, which are dicts or tuples in the order
+        of `columns` (by default the keys of the first dict).
+
+        Each chunk of rows is copied into a temporary table and merged using
+        INSERT ... ON CONFLICT (`conflict_keys`) DO UPDATE, setting the
+        `update_columns` (by default all the columns not in `conflict_keys`),
+        or DO NOTHING if `update_columns` is empty. If a chunk contains the
+        same key more than once the last row is used. Returns the number of
+        rows inserted or updated"""
+
+        connection = await self._get_connection()
+        conflict_keys = list(conflict_keys)
+        count = 0
+        temp_table = None
+        async for chunk in _iter_chunks(rows, chunk_size):
+            if temp_table is None:
+                if columns is None:
+                    if not isinstance(chunk[0], Mapping):
+                        raise DatabaseError("columns must be given for tuple rows")
+                    columns = list(chunk[0].keys())
+                columns = list(columns)
+                if update_columns is None:
+                    update_columns = [column for column in columns if column not in conflict_keys]
+                temp_table = "bulk_upsert_{}".format(tablename.replace('.', '_'))
+                await connection.execute(
+                    "CREATE TEMPORARY TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA".format(
+                        temp_table, ", ".join(columns), tablename), timeout=timeout)
+                if update_columns:
+                    action = "DO UPDATE SET {}".format(
+                        ", ".join("{0} = EXCLUDED.{0}".format(column) for column in update_columns))
+                else:
+                    action = "DO NOTHING"
+                keys = ", ".join(conflict_keys)
+                # rows are appended to the (truncated) temporary table in
+                # order, so the highest ctid is the last row for each key
+                merge = ("INSERT INTO {table} ({columns}) "
+                         "SELECT DISTINCT ON ({keys}) {columns} FROM {temp_table} ORDER BY {keys}, ctid DESC "
+                         "ON CONFLICT ({keys}) {action}").format(
+                             table=tablename, columns=", ".join(columns), keys=keys,
+                             temp_table=temp_table, action=action)
+
+            await connection.copy_records_to_table(temp_table, records=_chunk_to_tuples(chunk, columns),
+                                                   columns=columns, timeout=timeout)
+            count += _row_count(await connection.execute(merge, timeout=timeout))
+            await connection.execute("TRUNCATE {}".format(temp_table), timeout=timeout)
+
+        if temp_table is not None:
+            await connection.execute("DROP TABLE {}".format(temp_table), timeout=timeout)
+        return count
+
+def with_database(fn=None, *, readonly=False, readonly_transaction=False):
+    """wraps the handler method in `async with self.db`. Can be used as
+    `@with_database` or `@with_database(readonly=True)` for handlers that
+    only read from the database (see `HandlerDatabasePoolContext`)"""
+    def wrap(fn):
+        async def wrapper(self, *args, **kwargs):
+            db = self.db
+            previous = db.readonly, db.readonly_transaction
+            if readonly:
+                db.readonly = True
+                db.readonly_transaction = readonly_transaction
+            try:
+                async with db:
+                    r = fn(self, *args, **kwargs)
+                    if asyncio.iscoroutine(r):
+                        r = await r
+                    return r
+            finally:
+                db.readonly, db.readonly_transaction = previous
+        return wrapper
+
+    if fn is not None:
+        return wrap(fn)
+    else:
+        return wrap
 
 class DatabaseMixin:
     @property
     def db(self):
         if not hasattr(self, '_dbcontext'):
-            self._dbcontext = HandlerDatabasePoolContext(get_database_pool())
+            self._dbcontext = HandlerDatabasePoolContext(get_database_pool(), replicas=get_replica_router())
         return self._dbcontext
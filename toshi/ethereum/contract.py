@@ -1,11 +1,13 @@
 import asyncio
 import binascii
+import hashlib
 import subprocess
 import os
 import rlp
 import json
 import ethereum.abi
 import time
+from collections import OrderedDict
 from tornado.escape import json_decode
 from ethereum.transactions import Transaction
 
@@ -23,6 +25,30 @@ class ContractTranslator(ethereum.abi.ContractTranslator):
     def __init__(self, contract_interface):
         super().__init__(contract_interface)
 
+# number of translators kept by get_contract_translator
+TRANSLATOR_CACHE_SIZE = 256
+_translators = OrderedDict()
+
+def abi_hash(abi):
+    if not isinstance(abi, str):
+        abi = json.dumps(abi, sort_keys=True)
+    return hashlib.sha256(abi.encode('utf-8')).hexdigest()
+
+def get_contract_translator(abi):
+    """returns a ContractTranslator for the abi, sharing translators between
+    contracts with the same abi so the function and event ids are only
+    calculated once"""
+    key = abi_hash(abi)
+    translator = _translators.get(key)
+    if translator is None:
+        translator = ContractTranslator(abi)
+        _translators[key] = translator
+        while len(_translators) > TRANSLATOR_CACHE_SIZE:
+            _translators.popitem(last=False)
+    else:
+        _translators.move_to_end(key)
+    return translator
+
 class ContractMethod:
 
     def __init__(self, name, contract, *, from_key=None, constant=None, return_raw_tx=False):
@@ -147,7 +173,7 @@ class Contract:
     def __init__(self, *, abi, address, translator=None, creation_tx_hash=None):
         self.abi = abi
         self.valid_funcs = [part['name'] for part in abi if part['type'] == 'function']
-        self.translator = translator or ContractTranslator(abi)
+        self.translator = translator or get_contract_translator(abi)
         self.address = address
         self.creation_tx_hash = creation_tx_hash
 
@@ -208,7 +234,7 @@ class Contract:
         abi = json_decode(contract['abi'])
 
         # deploy contract
-        translator = ContractTranslator(abi)
+        translator = get_contract_translator(abi)
         # fix things that don't have a constructor
 
         if not deploy:
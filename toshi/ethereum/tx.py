@@ -1,7 +1,8 @@
 import rlp
-from ethereum.transactions import Transaction, UnsignedTransaction
+from rlp.sedes import big_endian_int
+from ethereum.transactions import Transaction, UnsignedTransaction, InvalidTransaction, secpk1n, null_address
 from ethereum.utils import (
-    big_endian_to_int, int_to_big_endian, safe_ord, sha3
+    big_endian_to_int, int_to_big_endian, safe_ord, sha3, ecrecover_to_pub, TT256
 )
 
 from .utils import data_decoder, data_encoder
@@ -10,6 +11,122 @@ from .utils import data_decoder, data_encoder
 DEFAULT_STARTGAS = 21000
 DEFAULT_GASPRICE = 4000000000
 
+class RawTransaction:
+    """Lightweight transaction decoded straight from its rlp encoding,
+    avoiding the rlp sedes and pyethereum objects.
+
+    Signed and unsigned transactions are told apart by the number of
+    elements in the rlp list. The encoded bytes, hash and sender are only
+    calculated once. Instances should be treated as immutable"""
+
+    __slots__ = ('nonce', 'gasprice', 'startgas', 'to', 'value', 'data', 'v', 'r', 's',
+                 '_encoded', '_hash', '_sender')
+
+    def __init__(self, nonce, gasprice, startgas, to, value, data, v=0, r=0, s=0, *, encoded=None):
+        self.nonce = nonce
+        self.gasprice = gasprice
+        self.startgas = startgas
+        self.to = to
+        self.value = value
+        self.data = data
+        self.v = v
+        self.r = r
+        self.s = s
+        self._encoded = encoded
+        self._hash = None
+        self._sender = None
+
+    @classmethod
+    def decode(cls, raw):
+        if isinstance(raw, str):
+            raw = data_decoder(raw)
+        try:
+            fields = rlp.decode(raw)
+        except rlp.exceptions.DecodingError as e:
+            raise InvalidTransaction("Invalid rlp: {}".format(e))
+        if not isinstance(fields, list) or len(fields) not in (6, 9) or \
+           not all(isinstance(f, bytes) for f in fields):
+            raise InvalidTransaction("Expected a list of 6 or 9 values")
+        try:
+            ints = [big_endian_int.deserialize(fields[i]) for i in (0, 1, 2, 4)]
+            vrs = [big_endian_int.deserialize(f) for f in fields[6:]] or [0, 0, 0]
+        except rlp.exceptions.DeserializationError as e:
+            raise InvalidTransaction(str(e))
+        to = fields[3]
+        if len(to) not in (0, 20):
+            raise InvalidTransaction("Addresses must be 20 or 0 bytes long")
+        if any(i >= TT256 for i in ints):
+            raise InvalidTransaction("Values way too high!")
+        nonce, gasprice, startgas, value = ints
+        v, r, s = vrs
+        # only keep the input if it's the same as what `encode` would produce
+        encoded = raw if len(fields) == 6 or v or r or s else None
+        return cls(nonce, gasprice, startgas, to, value, fields[5], v, r, s, encoded=encoded)
+
+    @property
+    def is_signed(self):
+        # NOTE: v can be non zero if a network id is present
+        return not (self.r == 0 and self.s == 0)
+
+    @property
+    def network_id(self):
+        if self.r == 0 and self.s == 0:
+            return self.v
+        elif self.v in (27, 28):
+            return None
+        else:
+            return ((self.v - 1) // 2) - 17
+
+    def _fields(self):
+        return [big_endian_int.serialize(self.nonce), big_endian_int.serialize(self.gasprice),
+                big_endian_int.serialize(self.startgas), self.to, big_endian_int.serialize(self.value),
+                self.data]
+
+    def encode(self):
+        """returns the rlp encoded bytes, in the same form as `encode_transaction`"""
+        if self._encoded is None:
+            fields = self._fields()
+            if self.v or self.r or self.s:
+                fields += [big_endian_int.serialize(self.v), big_endian_int.serialize(self.r),
+                           big_endian_int.serialize(self.s)]
+            self._encoded = rlp.encode(fields)
+        return self._encoded
+
+    @property
+    def hash(self):
+        if self._hash is None:
+            self._hash = sha3(self.encode())
+        return self._hash
+
+    @property
+    def sender(self):
+        if self._sender is None:
+            if self.r == 0 and self.s == 0:
+                self._sender = null_address
+                return self._sender
+            if self.v in (27, 28):
+                vee = self.v
+                sighash = sha3(rlp.encode(self._fields()))
+            elif self.v >= 37:
+                network_id = self.network_id
+                vee = self.v - network_id * 2 - 8
+                if vee not in (27, 28):
+                    raise InvalidTransaction("Invalid V value")
+                sighash = sha3(rlp.encode(self._fields() + [big_endian_int.serialize(network_id), b'', b'']))
+            else:
+                raise InvalidTransaction("Invalid V value")
+            if self.r >= secpk1n or self.s >= secpk1n or self.r == 0 or self.s == 0:
+                raise InvalidTransaction("Invalid signature values!")
+            pub = ecrecover_to_pub(sighash, vee, self.r, self.s)
+            if pub == b'\x00' * 64:
+                raise InvalidTransaction("Invalid signature (zero privkey cannot sign)")
+            self._sender = sha3(pub)[-20:]
+        return self._sender
+
+def decode_raw_transactions(txs):
+    """decodes a list of raw transactions into RawTransaction objects"""
+    return [RawTransaction.decode(tx) for tx in txs]
+
 def address_decoder(data):
     """Decode an address from hex with 0x prefix to 20 bytes."""
     addr = data_decoder(data)
@@ -56,10 +173,12 @@ def decode_transaction(tx):
     if isinstance(tx, str):
         tx = data_decoder(tx)
 
-    try:
-        tx = rlp.decode(tx, Transaction)
-    except rlp.exceptions.ObjectDeserializationError:
-        tx = rlp.decode(tx, UnsignedTransaction)
+    # decode the rlp once, and pick the type from the number of fields
+    fields = rlp.decode(tx)
+    if isinstance(fields, list) and len(fields) == len(UnsignedTransaction.fields):
+        tx = UnsignedTransaction.deserialize(fields)
+    else:
+        tx = Transaction.deserialize(fields)
 
     tx.make_mutable()
 
@@ -163,13 +282,20 @@ def calculate_transaction_hash(tx):
 def transaction_to_json(tx):
     """returns json for the given transaction in the same format as the JSONRPC responses"""
 
-    if isinstance(tx, str):
-        tx = decode_transaction(tx)
+    if isinstance(tx, (str, bytes)):
+        tx = RawTransaction.decode(tx)
+
+    if isinstance(tx, RawTransaction):
+        tx_hash = data_encoder(tx.hash)
+        raw = data_encoder(tx.encode())
+    else:
+        raw = encode_transaction(tx)
+        tx_hash = data_encoder(sha3(data_decoder(raw)))
 
     return {
         "blockHash": None,
         "creates": None,  # TODO
-        "hash": calculate_transaction_hash(tx),
+        "hash": tx_hash,
         "nonce": hex(tx.nonce),
         "gas": hex(tx.startgas),
         "transactionIndex": None,
@@ -178,7 +304,7 @@ def transaction_to_json(tx):
         "networkId": None,
         "to": data_encoder(tx.to),
         "condition": None,
-        "raw": encode_transaction(tx),
+        "raw": raw,
         "s": hex(tx.s),
         "standardV": "0x1",  # TODO
         "r": hex(tx.r),
@@ -1,11 +1,28 @@
+import asyncio
 import binascii
+import functools
 import regex
 from toshi.jsonrpc.client import JsonRPCClient
+from toshi.utils import validate_address
 from ethereum.utils import (
     privtoaddr, bytearray_to_bytestr, sha3, safe_ord,
     big_endian_to_int, int_to_32bytearray, zpad,
     ecrecover_to_pub, ecsign)
-from ethereum.abi import event_id, process_type, _canonical_type, decode_abi, decode_single
+from ethereum.abi import event_id, method_id, process_type, _canonical_type, decode_abi, decode_single
+
+try:
+    import coincurve
+except ImportError:
+    coincurve = None
+
+try:
+    # pysha3 has much less per call overhead than pycryptodome
+    from sha3 import keccak_256
+except ImportError:
+    from Crypto.Hash import keccak as _keccak
+
+    def keccak_256(data=None):
+        return _keccak.new(digest_bits=256, data=data)
 
 def data_decoder(data):
     """Decode `data` representing unformatted data."""
@@ -40,7 +57,11 @@ def private_key_to_address(private_key):
 
 
 def prepare_ethereum_jsonrpc_client(config):
-    if 'url' in config:
+    """`urls` can be used to give a comma separated list of nodes to
+    use instead of a single `url`"""
+    if 'urls' in config:
+        url = [u.strip() for u in config['urls'].split(',') if u.strip()]
+    elif 'url' in config:
         url = config['url']
     elif 'host' in config:
         ssl = config.get('ssl', 'false')
@@ -57,6 +78,23 @@ def prepare_ethereum_jsonrpc_client(config):
         url = "{}{}:{}{}".format(protocol, host, port, path)
     return JsonRPCClient(url)
 
+def _recover_public_key(rawhash, v, signature):
+    if coincurve is not None:
+        # use the r and s bytes from the signature directly
+        recid = v - 27
+        if not 0 <= recid < 256:
+            return b"\x00" * 64
+        try:
+            pk = coincurve.PublicKey.from_signature_and_message(
+                signature[0:64] + bytes([recid]), rawhash, hasher=None)
+        except Exception:
+            # same as what pyethereum does with coincurve
+            return b"\x00" * 64
+        return pk.format(compressed=False)[1:]
+    r = big_endian_to_int(signature[0:32])
+    s = big_endian_to_int(signature[32:64])
+    return ecrecover_to_pub(rawhash, v, r, s)
+
 def ecrecover(msg, signature, address=None):
     """
     Returns None on failure, returns the recovered address on success.
@@ -70,8 +108,6 @@ def ecrecover(msg, signature, address=None):
 
     if len(signature) >= 65:
         v = safe_ord(signature[64])
-        r = big_endian_to_int(signature[0:32])
-        s = big_endian_to_int(signature[32:64])
     else:
         if address:
             return False
@@ -81,7 +117,7 @@ def ecrecover(msg, signature, address=None):
     if v == 0 or v == 1:
         v += 27
 
-    pub = ecrecover_to_pub(rawhash, v, r, s)
+    pub = _recover_public_key(rawhash, v, signature)
 
     recaddr = data_encoder(sha3(pub)[-20:])
     if address:
@@ -92,6 +128,24 @@ def ecrecover(msg, signature, address=None):
 
     return recaddr
 
+def ecrecover_many(pairs):
+    """returns the recovered address (or None) for each (msg, signature) pair"""
+    return [ecrecover(msg, signature) for msg, signature in pairs]
+
+async def ecrecover_batch(pairs, *, executor=None, chunk_size=32):
+    """runs ecrecover_many for the (msg, signature) pairs in `executor` (or
+    the loop's default executor), split into chunks so that they can be run
+    by multiple workers. coincurve releases the GIL while recovering, so a
+    ThreadPoolExecutor can be used as well as a ProcessPoolExecutor"""
+    pairs = list(pairs)
+    if not pairs:
+        return []
+    loop = asyncio.get_event_loop()
+    results = await asyncio.gather(*[
+        loop.run_in_executor(executor, ecrecover_many, pairs[i:i + chunk_size])
+        for i in range(0, len(pairs), chunk_size)])
+    return [address for chunk in results for address in chunk]
+
 def sign_payload(private_key, payload):
 
     if isinstance(private_key, str):
@@ -124,28 +178,57 @@ def personal_ecrecover(msg, signature, address=None):
     return ecrecover("\x19Ethereum Signed Message:\n{}{}".format(len(msg), msg),
                      signature, address)
 
-def checksum_encode_address(addr):
-    """https://github.com/ethereum/EIPs/blob/master/EIPS/eip-55.md"""
+# number of addresses whose checksum encoding is kept
+ADDRESS_CACHE_SIZE = 4096
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def _checksum_encode(hexaddr):
+    # each character is upper cased if the matching nibble of the hash of
+    # the lowercase hex address is 8 or more. digits are unaffected by upper
+    hexhash = keccak_256(hexaddr.encode('ascii')).hexdigest()
+    return '0x' + ''.join([c.upper() if h >= '8' else c for c, h in zip(hexaddr, hexhash)])
+
+def _address_hex(addr):
     if isinstance(addr, str):
         addr = data_decoder(addr)
+    return addr.hex()
 
-    o = ''
-    v = big_endian_to_int(sha3(addr.hex()))
-    for i, c in enumerate(addr.hex()):
-        if c in '0123456789':
-            o += c
-        else:
-            o += c.upper() if (v & (2 ** (255 - 4 * i))) else c.lower()
-    return '0x' + o
+def checksum_encode_address(addr):
+    """https://github.com/ethereum/EIPs/blob/master/EIPS/eip-55.md"""
+    return _checksum_encode(_address_hex(addr))
 
 def checksum_validate_address(addr):
     if not isinstance(addr, str):
         raise ValueError("expected string input")
 
-    expected_encoding = checksum_encode_address(data_decoder(addr))
+    expected_encoding = checksum_encode_address(addr)
     return expected_encoding == addr
 
+def checksum_encode_addresses(addrs):
+    """checksum encodes a list of addresses (hex strings or bytes)"""
+    return [_checksum_encode(_address_hex(addr)) for addr in addrs]
+
+def validate_addresses(addrs):
+    """returns a list with True for each address that is a valid checksum
+    encoded address, and False for those that aren't, including any that
+    aren't addresses at all"""
+    results = []
+    for addr in addrs:
+        if not validate_address(addr):
+            results.append(False)
+        else:
+            results.append(_checksum_encode(addr[2:].lower()) == addr)
+    return results
+
+# number of signatures whose parsed form, event id and selector are kept
+SIGNATURE_CACHE_SIZE = 1024
+
 def _process_topic(topic):
+    name, args = _parse_signature(topic)
+    return name, list(args)
+
+@functools.lru_cache(maxsize=SIGNATURE_CACHE_SIZE)
+def _parse_signature(topic):
     start_args = topic.find("(")
     end_args = topic.find(")")
     if start_args == -1 or end_args == -1 or start_args > end_args or end_args != len(topic) - 1:
@@ -154,7 +237,7 @@ def _process_topic(topic):
     if not regex.match("^[a-zA-Z][a-zA-Z0-9]*$", name):
         raise ValueError("Invalid event name")
     args = [arg.strip() for arg in topic[start_args + 1:end_args].split(',')]
-    args = [_canonical_type(arg.split(' ')[0]) for arg in args if arg != '']
+    args = tuple(_canonical_type(arg.split(' ')[0]) for arg in args if arg != '')
     return name, args
 
 TYPES_RE = regex.compile("^([a-z]+\d*)((?:\[\d*\])*)?$")
@@ -173,31 +256,138 @@ def _convert_array(typ, depth, array):
     else:
         return [_convert_type(typ, v) for v in array]
 
-def encode_topic(topic):
-    name, types = _process_topic(topic)
+def _validate_types(types):
     for arg in types:
         try:
             process_type(arg)
         except AssertionError:
             raise ValueError("Invalid argument type")
+
+@functools.lru_cache(maxsize=SIGNATURE_CACHE_SIZE)
+def encode_topic(topic):
+    name, types = _parse_signature(topic)
+    _validate_types(types)
     return hex(event_id(name, types)), "{}({})".format(name, ",".join(types))
 
-def decode_event_data(topic, data):
-    if isinstance(data, str):
-        data = data_decoder(data)
-    name, types = _process_topic(topic)
-    decoded = decode_abi(types, data)
-    arguments = []
-    for typ, val in zip(types, decoded):
-        m = TYPES_RE.match(typ)
-        if m is None:
-            continue
-        atyp, arr = m.groups()
-        if arr is None or arr == '':
-            arguments.append(_convert_type(atyp, val))
+@functools.lru_cache(maxsize=SIGNATURE_CACHE_SIZE)
+def function_selector(signature):
+    """returns the 4 byte selector for a function signature, e.g.
+    `transfer(address,uint256)` -> `0xa9059cbb`"""
+    name, types = _parse_signature(signature)
+    _validate_types(types)
+    return data_encoder(method_id(name, types).to_bytes(4, 'big'))
+
+def _static_converter(base, sub):
+    """returns a function converting a 32 byte word to the same value that
+    `_convert_type(decode_single(...))` would, or None if the type has to be
+    decoded using decode_abi"""
+    if base == 'uint':
+        bits = int(sub)
+        if bits == 256:
+            return lambda word: hex(int.from_bytes(word, 'big'))
+        mod = 2 ** bits
+        return lambda word: hex(int.from_bytes(word, 'big') % mod)
+    if base == 'int':
+        bits = int(sub)
+        mod = 2 ** bits
+        half = 2 ** (bits - 1)
+
+        def convert_int(word):
+            o = int.from_bytes(word, 'big') % mod
+            return hex(o - mod if o >= half else o)
+        return convert_int
+    if base == 'address':
+        return lambda word: '0x' + word[12:].hex()
+    if base == 'bool':
+        return lambda word: bool(int.from_bytes(word, 'big'))
+    if base == 'bytes' and sub:
+        length = int(sub)
+        return lambda word: data_encoder(word[:length])
+    return None
+
+class EventDecoder:
+    """Decodes the data of logs for a single event signature.
+
+    The signature is parsed once, and if all the arguments are static
+    values that fit in a single word the data for a batch of logs is
+    converted into a single buffer and decoded column by column using
+    slices of a memoryview, avoiding decode_abi entirely"""
+
+    __slots__ = ('name', 'types', '_fields', '_converters', '_size')
+
+    def __init__(self, topic):
+        self.name, self.types = _process_topic(topic)
+        # the (type, array dimensions) for each argument that is returned
+        self._fields = []
+        converters = []
+        for idx, typ in enumerate(self.types):
+            m = TYPES_RE.match(typ)
+            if m is not None:
+                atyp, arr = m.groups()
+                self._fields.append((idx, atyp, arr))
+            if converters is not None:
+                base, sub, arrlist = process_type(typ)
+                converter = None if arrlist else _static_converter(base, sub)
+                if converter is None:
+                    converters = None
+                elif m is not None:
+                    converters.append((idx * 32, converter))
+        self._converters = converters
+        self._size = len(self.types) * 32
+
+    def _convert(self, decoded):
+        arguments = []
+        for idx, atyp, arr in self._fields:
+            val = decoded[idx]
+            if arr is None or arr == '':
+                arguments.append(_convert_type(atyp, val))
+            else:
+                arguments.append(_convert_array(atyp, arr[1:-1].split(']['), val))
+        return arguments
+
+    def decode(self, data):
+        return self.decode_many([data])[0]
+
+    def decode_many(self, datas):
+        """decodes a list of log data, given as either bytes or hex strings"""
+        if self._converters is None:
+            return self._decode_abi(datas)
+
+        size = self._size
+        if all(isinstance(data, str) for data in datas):
+            hexdata = [data[2:] if data.startswith('0x') else data for data in datas]
+            if any(len(data) != size * 2 for data in hexdata):
+                return self._decode_abi(datas)
+            buf = memoryview(binascii.unhexlify("".join(hexdata)))
         else:
-            arguments.append(_convert_array(atyp, arr[1:-1].split(']['), val))
-    return arguments
+            datas = [data_decoder(data) if isinstance(data, str) else data for data in datas]
+            if any(len(data) != size for data in datas):
+                return self._decode_abi(datas)
+            buf = memoryview(b"".join(datas))
+
+        total = len(buf)
+        columns = [[convert(buf[pos:pos + 32]) for pos in range(offset, total, size)]
+                   for offset, convert in self._converters]
+        if not columns:
+            return [[] for _ in datas]
+        return [list(row) for row in zip(*columns)]
+
+    def _decode_abi(self, datas):
+        # used for dynamic types, and for data that isn't exactly the
+        # expected size so the behaviour (and errors) of decode_abi are kept
+        return [self._convert(decode_abi(self.types, data_decoder(data) if isinstance(data, str) else data))
+                for data in datas]
+
+@functools.lru_cache(maxsize=SIGNATURE_CACHE_SIZE)
+def get_event_decoder(topic):
+    return EventDecoder(topic)
+
+def decode_event_data(topic, data):
+    return get_event_decoder(topic).decode(data)
+
+def decode_events_data(topic, datas):
+    """decodes the data from a list of logs for the same event"""
+    return get_event_decoder(topic).decode_many(datas)
 
 def decode_single_address(address):
     """decodes address data from 32 byte logs"""
@@ -12,8 +12,8 @@ import email.utils
 from toshi.config import config
 from toshi.utils import validate_signature, validate_address, parse_int
 try:
-    from toshi.request import generate_request_signature_data_string
-    from toshi.ethereum.utils import data_decoder, ecrecover
+    from toshi.request import generate_request_signature_data_string, generate_request_signature_data_string_from_hash
+    from toshi.ethereum.utils import data_decoder, ecrecover, keccak_256
     ETHEREUM_SUPPORTED = True
 except ModuleNotFoundError as ex:
     if ex.name == 'ethereum':
@@ -22,6 +22,7 @@ except ModuleNotFoundError as ex:
         raise
 
 from toshi.errors import JSONHTTPError
+from toshi.signature_cache import signature_cache_key
 from toshi.log import log
 from json import JSONDecodeError
 
@@ -51,13 +52,31 @@ TOSHI_ID_ADDRESS_QUERY_ARG = "toshiIdAddress"
 
 CACHE_MAX_AGE_SECONDS = 1209600
 
+def verify_request_signature(method, path, timestamp, body, signature, expected_address):
+    """returns True if `signature` is a valid signature of the request by
+    `expected_address`. A plain function so it can be run in a process pool"""
+    data_string = generate_request_signature_data_string(method, path, timestamp, body or "")
+    return ecrecover(data_string, signature, expected_address)
+
+def verify_request_signature_from_hash(method, path, timestamp, body_hash, signature, expected_address):
+    """same as `verify_request_signature` but takes the keccak digest of the
+    body, or None if the body was empty"""
+    data_string = generate_request_signature_data_string_from_hash(method, path, timestamp, body_hash)
+    return ecrecover(data_string, signature, expected_address)
 
 class RequestVerificationMixin:
 
+    # a SignatureCache or RedisSignatureCache used to skip verifying requests
+    # that have already been seen. If not set on the handler the
+    # application's `signature_cache` attribute is used if present. Async
+    # caches (RedisSignatureCache) can only be used with verify_request_async
+    signature_cache = None
+
     if ETHEREUM_SUPPORTED:
-        def verify_request(self):
-            """Verifies that the signature and the payload match the expected address
-            raising a JSONHTTPError (400) if something is wrong with the request"""
+        def _get_verification_arguments(self):
+            """Gets the address, signature and timestamp from the request and
+            does the checks that don't require any crypto, raising a
+            JSONHTTPError (400) if something is wrong with the request"""
 
             if TOSHI_ID_ADDRESS_HEADER in self.request.headers:
                 expected_address = self.request.headers[TOSHI_ID_ADDRESS_HEADER]
@@ -108,22 +127,96 @@ class RequestVerificationMixin:
             except Exception:
                 raise JSONHTTPError(400, body={'errors': [{'id': 'invalid_signature', 'message': 'Invalid Toshi-Signature'}]})
 
-            verb = self.request.method
-            uri = self.request.path
+            return expected_address, signature, timestamp
+
+        def _check_timestamp(self, timestamp):
+            if abs(int(time.time()) - timestamp) > TIMESTAMP_EXPIRY:
+                raise JSONHTTPError(400, body={'errors': [{'id': 'invalid_timestamp',
+                                                           'message': 'The difference between the timestamp and the current time is too large'}]})
+
+        def _get_signature_cache(self):
+            if self.signature_cache is not None:
+                return self.signature_cache
+            return getattr(self.application, 'signature_cache', None)
+
+        def _get_signed_body(self):
+            """returns the function used to check the signature and the body
+            argument it's called with"""
+            return verify_request_signature, self.request.body
+
+        def _raise_replayed_request(self):
+            raise JSONHTTPError(400, body={'errors': [{'id': 'replayed_request', 'message': 'Request has already been used'}]})
+
+        def verify_request(self):
+            """Verifies that the signature and the payload match the expected address
+            raising a JSONHTTPError (400) if something is wrong with the request"""
 
-            if self.request.body:
-                datahash = self.request.body
+            expected_address, signature, timestamp = self._get_verification_arguments()
+            verify, body = self._get_signed_body()
+
+            cache = self._get_signature_cache()
+            if cache is not None and cache.is_async:
+                # can't be used without blocking, and ignoring it would
+                # silently turn off replay protection
+                raise Exception("{} can only be used with verify_request_async".format(type(cache).__name__))
+            if cache is not None:
+                key = signature_cache_key(self.request.method, self.request.path, timestamp,
+                                          body, signature, expected_address)
+                verified = cache.get(key)
+                if verified and cache.reject_replays:
+                    self._raise_replayed_request()
             else:
-                datahash = ""
+                verified = False
 
-            data_string = generate_request_signature_data_string(verb, uri, timestamp, datahash)
+            if not verified:
+                if not verify(self.request.method, self.request.path, timestamp,
+                              body, signature, expected_address):
+                    raise JSONHTTPError(400, body={'errors': [{'id': 'invalid_signature', 'message': 'Invalid Toshi-Signature'}]})
 
-            if not ecrecover(data_string, signature, expected_address):
+            self._check_timestamp(timestamp)
+
+            if cache is not None and not verified:
+                if not cache.add(key, timestamp) and cache.reject_replays:
+                    self._raise_replayed_request()
+
+            return expected_address
+
+        async def verify_request_async(self):
+            """Same as `verify_request` but hashes the body and recovers the
+            signature in the application's verification executor (see
+            `Application`), so the IOLoop isn't blocked. The timestamp is checked
+            before the signature so expired requests don't cost any crypto work"""
+
+            expected_address, signature, timestamp = self._get_verification_arguments()
+            self._check_timestamp(timestamp)
+            verify, body = self._get_signed_body()
+
+            cache = self._get_signature_cache()
+            if cache is not None:
+                key = signature_cache_key(self.request.method, self.request.path, timestamp,
+                                          body, signature, expected_address)
+                verified = cache.get(key)
+                if cache.is_async:
+                    verified = await verified
+                if verified:
+                    if cache.reject_replays:
+                        self._raise_replayed_request()
+                    return expected_address
+
+            executor = getattr(self.application, 'verification_executor', None) or \
+                getattr(self.application, 'executor', None)
+            valid = await asyncio.get_event_loop().run_in_executor(
+                executor, verify, self.request.method, self.request.path,
+                timestamp, body, signature, expected_address)
+            if not valid:
                 raise JSONHTTPError(400, body={'errors': [{'id': 'invalid_signature', 'message': 'Invalid Toshi-Signature'}]})
 
-            if abs(int(time.time()) - timestamp) > TIMESTAMP_EXPIRY:
-                raise JSONHTTPError(400, body={'errors': [{'id': 'invalid_timestamp',
-                                                           'message': 'The difference between the timestamp and the current time is too large'}]})
+            if cache is not None:
+                added = cache.add(key, timestamp)
+                if cache.is_async:
+                    added = await added
+                if not added and cache.reject_replays:
+                    self._raise_replayed_request()
 
             return expected_address
 
@@ -148,6 +241,9 @@ class RequestVerificationMixin:
         def verify_request(self):
             raise Exception("Missing optional ethereum module, install with pip install toshi-services[ethereum]")
 
+        async def verify_request_async(self):
+            raise Exception("Missing optional ethereum module, install with pip install toshi-services[ethereum]")
+
         def is_request_signed(self, raise_if_partial=True):
             raise Exception("Missing optional ethereum module, install with pip install toshi-services[ethereum]")
 
@@ -222,6 +318,53 @@ class BaseHandler(JsonBodyMixin, tornado.web.RequestHandler):
     def run_in_executor(self, func, *args):
         return asyncio.get_event_loop().run_in_executor(self.application.executor, func, *args)
 
+@tornado.web.stream_request_body
+class SignedStreamingRequestHandler(RequestVerificationMixin, BaseHandler):
+    """Base for handlers of signed requests with large bodies. The body is
+    never buffered: each chunk is fed into an incremental keccak hash as it
+    arrives and passed on to `body_chunk_received`, and `verify_request`
+    (or `verify_request_async`) checks the signature against the final hash
+    once the body has been received.
+
+    If the request is signed the headers and timestamp are checked in
+    `prepare`, so bad requests are rejected before the body is read"""
+
+    # if set, overrides the server's max_body_size for this handler
+    max_body_size = None
+
+    def prepare(self):
+        super().prepare()
+        if self._finished:
+            return
+
+        if self.max_body_size is not None:
+            self.request.connection.set_max_body_size(self.max_body_size)
+
+        self.body_length = 0
+        # without the ethereum module requests can't be verified, so the
+        # body isn't hashed
+        self._body_hash = None
+        if ETHEREUM_SUPPORTED:
+            self._body_hash = keccak_256()
+            if self.is_request_signed():
+                self._check_timestamp(self._get_verification_arguments()[2])
+
+    def data_received(self, chunk):
+        if self._body_hash is not None:
+            self._body_hash.update(chunk)
+        self.body_length += len(chunk)
+        return self.body_chunk_received(chunk)
+
+    def body_chunk_received(self, chunk):
+        """called with each chunk of the body. May return a Future (e.g. if
+        implemented as a coroutine) to stop reading until it's done"""
+        pass
+
+    if ETHEREUM_SUPPORTED:
+        def _get_signed_body(self):
+            body_hash = self._body_hash.digest() if self.body_length > 0 else None
+            return verify_request_signature_from_hash, body_hash
+
 class GenerateTimestamp(BaseHandler):
 
     def get(self):
@@ -55,6 +55,21 @@ class HTTPClient:
         # outside of the except block to avoid rethrow error message
         raise HTTPError(599, message=str(error))
 
+    async def stream(self, url, *, method="GET", headers=None, body=None, request_timeout=None,
+                     chunk_size=65536):
+        """async generator yielding the response body in chunks as it's received"""
+        resp = await self.fetch(url, method=method, headers=headers, body=body, request_timeout=request_timeout)
+        error = None
+        try:
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                yield chunk
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = e
+        finally:
+            resp.release()
+        if error is not None:
+            raise HTTPError(599, message=str(error))
+
     async def close(self):
         await self._session.close()
         if self._instance_cache is not None:
@@ -0,0 +1,152 @@
+import json
+import time
+
+from collections import OrderedDict
+from toshi.utils import parse_int
+
+# index of the block parameter for methods that take one
+BLOCK_PARAM_INDEX = {
+    "eth_getBalance": 1,
+    "eth_getTransactionCount": 1,
+    "eth_getCode": 1,
+    "eth_call": 1,
+    "eth_getBlockByNumber": 0
+}
+
+CACHEABLE_METHODS = frozenset([
+    "eth_getTransactionReceipt",
+    "eth_getTransactionByHash"
+]) | frozenset(BLOCK_PARAM_INDEX.keys())
+
+# how long a result can be cached for
+IMMUTABLE = 1
+UNTIL_NEXT_BLOCK = 2
+
+def _normalize_params(params):
+    """lower cases hex strings so requests that differ only by the case of
+    their hex values are considered the same"""
+    if isinstance(params, str):
+        if params.startswith('0x'):
+            return params.lower()
+        return params
+    if isinstance(params, (list, tuple)):
+        return [_normalize_params(p) for p in params]
+    if isinstance(params, dict):
+        return {k: _normalize_params(v) for k, v in params.items()}
+    return params
+
+def _copy_result(result):
+    """copies the lists and dicts of a decoded json result"""
+    if isinstance(result, dict):
+        return {k: _copy_result(v) for k, v in result.items()}
+    if isinstance(result, list):
+        return [_copy_result(v) for v in result]
+    return result
+
+def request_key(method, params):
+    return (method, json.dumps(_normalize_params(params), sort_keys=True))
+
+class JsonRPCResponseCache:
+    """Size bounded LRU cache for jsonrpc results that cannot change.
+
+    Results for blocks that are at least `confirmations` blocks below the
+    highest block number seen are stored until evicted. Results for the
+    "latest" block (or blocks that aren't confirmed yet) are only returned
+    until a higher block number is seen, or until they are older than
+    `latest_max_age` seconds, which stops them going stale if the head
+    block isn't being tracked.
+
+    Results are copied when they're stored and returned, so callers can
+    modify them without changing the cached values"""
+
+    def __init__(self, max_size=10000, confirmations=12, latest_max_age=15.0):
+        self.max_size = max_size
+        self.confirmations = confirmations
+        self.latest_max_age = latest_max_age
+        self.hits = 0
+        self.misses = 0
+        self.head = None
+        self._generation = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    def set_head(self, block_number):
+        """updates the head block number, invalidating results for the
+        latest block if it's higher than the previous head"""
+        if block_number is not None and (self.head is None or block_number > self.head):
+            self.head = block_number
+            self._generation += 1
+
+    def _is_confirmed(self, block_number):
+        return self.head is not None and block_number is not None and \
+            block_number <= self.head - self.confirmations
+
+    def _block_lifetime(self, block):
+        if block == "earliest":
+            return IMMUTABLE
+        if block == "pending":
+            return None
+        if block == "latest":
+            return UNTIL_NEXT_BLOCK
+        if self._is_confirmed(parse_int(block)):
+            return IMMUTABLE
+        return UNTIL_NEXT_BLOCK
+
+    def _lifetime(self, method, params, result):
+        if result is None:
+            return None
+        if method in ("eth_getTransactionReceipt", "eth_getTransactionByHash"):
+            block_number = parse_int(result.get('blockNumber'))
+            if block_number is None:
+                # not mined yet
+                return None
+            if self._is_confirmed(block_number):
+                return IMMUTABLE
+            # could still be removed by a reorg
+            return UNTIL_NEXT_BLOCK
+        if method not in BLOCK_PARAM_INDEX:
+            return None
+        idx = BLOCK_PARAM_INDEX[method]
+        block = params[idx] if len(params) > idx else "latest"
+        return self._block_lifetime(block)
+
+    def get(self, method, params):
+        """returns a tuple of (found, result)"""
+        if method not in CACHEABLE_METHODS:
+            return False, None
+        key = request_key(method, params)
+        entry = self._entries.get(key)
+        if entry is not None:
+            result, generation, stored = entry
+            if generation is None or (
+                    generation == self._generation and
+                    (self.latest_max_age is None or time.time() - stored < self.latest_max_age)):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, _copy_result(result)
+            del self._entries[key]
+        self.misses += 1
+        return False, None
+
+    def put(self, method, params, result):
+        if method == "eth_blockNumber":
+            self.set_head(parse_int(result))
+            return
+        if method == "eth_getBlockByNumber" and result and params and params[0] == "latest":
+            self.set_head(parse_int(result.get('number')))
+        if method not in CACHEABLE_METHODS:
+            return
+        lifetime = self._lifetime(method, params, result)
+        if lifetime is None:
+            return
+        key = request_key(method, params)
+        generation = None if lifetime == IMMUTABLE else self._generation
+        self._entries[key] = (_copy_result(result), generation, time.time())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
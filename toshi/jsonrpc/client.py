@@ -1,11 +1,17 @@
 import asyncio
 import binascii
-import random
+import itertools
 import regex
 import logging
 import time
 
-from toshi.jsonrpc.errors import JsonRPCError, HTTPError
+from toshi.jsonrpc.cache import JsonRPCResponseCache, request_key
+from toshi.jsonrpc.endpoints import JsonRPCEndpointPool
+from toshi.jsonrpc.log_scanner import LogScanner
+from toshi.jsonrpc.errors import JsonRPCError, HTTPError, CircuitOpenError
+from toshi.jsonrpc.retry import DEFAULT_RETRY_POLICY
+from toshi.jsonrpc.streaming import JsonRPCStreamParser
+from toshi.jsonrpc.websocket_client import WebSocketClient, IPCClient
 from toshi.utils import parse_int
 
 JSONRPC_LOG = logging.getLogger("toshi.jsonrpc.client")
@@ -27,6 +33,29 @@ JSON_RPC_VERSION = "2.0"
 
 HEX_RE = regex.compile("(0x)?([0-9a-fA-F]+)")
 
+# methods that only read from the node, and are therefore safe to share
+# the response of between concurrent callers
+READ_ONLY_METHODS = frozenset([
+    "eth_blockNumber",
+    "eth_getBalance",
+    "eth_getTransactionCount",
+    "eth_estimateGas",
+    "eth_getTransactionReceipt",
+    "eth_getTransactionByHash",
+    "eth_getBlockByNumber",
+    "eth_getFilterLogs",
+    "eth_getCode",
+    "eth_getLogs",
+    "eth_call",
+    "eth_gasPrice",
+    "trace_transaction",
+    "trace_get",
+    "trace_replayTransaction",
+    "debug_traceTransaction",
+    "web3_clientVersion",
+    "net_version"
+])
+
 def validate_hex(value, length=None):
     if isinstance(value, int):
         if value < 0:
@@ -52,14 +81,80 @@ def validate_block_param(param):
         return validate_hex(param)
     return param
 
+class _RetryState:
+    """tracks the retries made for a single request"""
+
+    __slots__ = ('deadline', 'attempts', 'rounds', 'tried')
+
+    def __init__(self, timeout):
+        self.deadline = time.time() + timeout
+        self.attempts = 0
+        self.rounds = 0
+        self.tried = set()
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.time())
+
+def _persistent_client_cls(url):
+    """returns the persistent connection client to use for websocket or ipc
+    urls, or None for http urls"""
+    if isinstance(url, JsonRPCEndpointPool):
+        urls = [e.url for e in url.endpoints]
+    elif isinstance(url, str):
+        urls = [url]
+    else:
+        urls = url
+    if urls and all(u.startswith(("ws://", "wss://")) for u in urls):
+        return WebSocketClient
+    if urls and all(u.startswith("ipc://") or u.endswith(".ipc") for u in urls):
+        return IPCClient
+    return None
+
+def _set_futures_exception(futures, exception):
+    for future, result_processor in futures:
+        if not future.done():
+            future.set_exception(exception)
+
 class JsonRPCClient:
 
     def __init__(self, url, should_retry=True, log=None, max_clients=500, bulk_mode=False,
-                 connect_timeout=5.0, request_timeout=30.0, client_cls=None, **kwargs):
-        self._url = url
+                 connect_timeout=5.0, request_timeout=30.0, client_cls=None,
+                 auto_batch=False, auto_batch_window=0.0, auto_batch_max_size=100,
+                 single_flight=False, cache=None, strategy="least_outstanding",
+                 max_block_lag=5, eject_time=10.0, bulk_chunk_size=None, bulk_parallelism=4,
+                 bulk_request_timeout=60.0, retry_policy=None, **kwargs):
+        """`url` can be a single url or a list of urls. When given multiple urls
+        requests are spread between them using `strategy` (see
+        JsonRPCEndpointPool for details), failing over to the other nodes when
+        one errors or is more than `max_block_lag` blocks behind the others.
+
+        `auto_batch`, if True, collects the calls made within `auto_batch_window`
+        seconds (or within the same event loop iteration if the window is 0)
+        and sends them to the node as a single batch request, sending the batch
+        early if `auto_batch_max_size` calls are waiting.
+
+        `single_flight`, if True, makes concurrent calls to the same read only
+        method with the same params share a single request to the node.
+
+        `cache` takes a JsonRPCResponseCache (or True to create one with the
+        default settings) used to store results that won't change.
+
+        In bulk mode, `bulk_chunk_size` splits the requests into batches of
+        that size, sending up to `bulk_parallelism` of them at the same time,
+        each with a timeout of `bulk_request_timeout`.
+
+        `retry_policy` is a RetryPolicy controlling the backoff between
+        retries, the retry budget and the circuit breakers. By default a
+        policy shared by the whole process is used.
+
+        For websocket (ws:// or wss://) and ipc (ipc:// or paths ending in
+        .ipc) urls a single persistent connection to each node is shared by
+        all requests, and `eth_subscribe` can be used"""
         self._max_clients = max_clients
         self._request_timeout = request_timeout
         self._connect_timeout = connect_timeout
+        if not client_cls:
+            client_cls = _persistent_client_cls(url)
         if client_cls:
             self._client_cls = client_cls
             self._httpclient = client_cls(max_clients=self._max_clients,
@@ -73,66 +168,161 @@ class JsonRPCClient:
             self.log = JSONRPC_LOG
         else:
             self.log = log
+        if isinstance(url, JsonRPCEndpointPool):
+            self._endpoints = url
+        else:
+            self._endpoints = JsonRPCEndpointPool(url, strategy=strategy, max_block_lag=max_block_lag,
+                                                  eject_time=eject_time, probe=self._probe_endpoint,
+                                                  log=self.log)
         self.should_retry = should_retry
+        self._retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self._request_ids = itertools.count()
         self._bulk_mode = bulk_mode
-        self._bulk_futures = {}
+        self._bulk_futures = []
         self._bulk_data = []
+        self._bulk_chunk_size = bulk_chunk_size
+        self._bulk_parallelism = bulk_parallelism
+        self._bulk_request_timeout = bulk_request_timeout
+        self._auto_batch = auto_batch
+        self._auto_batch_window = auto_batch_window
+        self._auto_batch_max_size = auto_batch_max_size
+        self._auto_batch_futures = []
+        self._auto_batch_data = []
+        self._auto_batch_handle = None
+        self._single_flight = single_flight
+        self._in_flight = {}
+        if cache is True:
+            cache = JsonRPCResponseCache()
+        elif cache is False:
+            cache = None
+        self._cache = cache
 
     def _fetch(self, method, params=None, result_processor=None, request_timeout=None):
 
         if request_timeout is None:
             request_timeout = self._request_timeout
 
-        id = random.randint(0, 1000000)
-
         if params is None:
             params = []
 
         data = {
             "jsonrpc": JSON_RPC_VERSION,
-            "id": id,
+            "id": None,
             "method": method,
             "params": params
         }
 
         if self._bulk_mode is True:
-            while id in self._bulk_futures:
-                id = random.randint(0, 1000000)
-                data['id'] = id
+            # ids in a batch are the request's position in the batch, so the
+            # responses can be matched up without any lookups
+            data['id'] = len(self._bulk_data)
             self._bulk_data.append(data)
             future = asyncio.get_event_loop().create_future()
-            self._bulk_futures[id] = (future, result_processor)
+            self._bulk_futures.append((future, result_processor))
             return future
 
+        data['id'] = next(self._request_ids)
+
+        if (self._single_flight or self._cache is not None) and method in READ_ONLY_METHODS:
+            return self._fetch_read_only(data, result_processor, request_timeout)
+
+        return self._send(data, result_processor, request_timeout)
+
+    def _send(self, data, result_processor, request_timeout):
+        if self._auto_batch:
+            return self._queue_auto_batch(data, result_processor)
+
         return self._execute_single(data, result_processor, request_timeout=request_timeout)
 
+    async def _fetch_read_only(self, data, result_processor, request_timeout):
+        method = data['method']
+        params = data['params']
+        found = False
+        if self._cache is not None:
+            found, result = self._cache.get(method, params)
+        if not found:
+            if self._single_flight:
+                result = await self._single_flight_send(data, request_timeout)
+            else:
+                result = await self._send(data, None, request_timeout)
+            if self._cache is not None:
+                self._cache.put(method, params, result)
+        if result_processor:
+            return result_processor(result)
+        return result
+
+    async def _single_flight_send(self, data, request_timeout):
+        key = request_key(data['method'], data['params'])
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._send(data, None, request_timeout))
+            self._in_flight[key] = future
+
+            def done(f):
+                if self._in_flight.get(key) is f:
+                    del self._in_flight[key]
+            future.add_done_callback(done)
+        # shield the shared request so a cancelled caller doesn't cancel
+        # it for the others waiting on it
+        return await asyncio.shield(future)
+
+    def _queue_auto_batch(self, data, result_processor):
+        data['id'] = len(self._auto_batch_data)
+        future = asyncio.get_event_loop().create_future()
+        self._auto_batch_data.append(data)
+        self._auto_batch_futures.append((future, result_processor))
+        if len(self._auto_batch_data) >= self._auto_batch_max_size:
+            self._flush_auto_batch()
+        elif self._auto_batch_handle is None:
+            loop = asyncio.get_event_loop()
+            if self._auto_batch_window:
+                self._auto_batch_handle = loop.call_later(self._auto_batch_window, self._flush_auto_batch)
+            else:
+                self._auto_batch_handle = loop.call_soon(self._flush_auto_batch)
+        return future
+
+    def _flush_auto_batch(self):
+        if self._auto_batch_handle is not None:
+            self._auto_batch_handle.cancel()
+            self._auto_batch_handle = None
+        data = self._auto_batch_data
+        futures = self._auto_batch_futures
+        self._auto_batch_data = []
+        self._auto_batch_futures = []
+        if len(data) == 1:
+            future, result_processor = futures[0]
+            asyncio.ensure_future(self._execute_single_to_future(data[0], future, result_processor))
+        elif data:
+            asyncio.ensure_future(self._execute_auto_batch(data, futures))
+
+    async def _execute_single_to_future(self, data, future, result_processor):
+        try:
+            result = await self._execute_single(data, result_processor)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+    async def _execute_auto_batch(self, data, futures):
+        try:
+            await self._execute_batch(data, futures, request_timeout=self._request_timeout,
+                                      retry_unknown_block_number=True)
+        except Exception:
+            # the error has already been passed on to the futures
+            pass
+
     async def _execute_single(self, data, result_processor, request_timeout=None):
         if request_timeout is None:
             request_timeout = self._request_timeout
         # NOTE: letting errors fall through here for now as it means
         # there is something drastically wrong with the jsonrpc server
         # which means something probably needs to be fixed
-        req_start = time.time()
-        retries = 0
+        retry = _RetryState(request_timeout)
         while True:
-            try:
-                resp = await self._httpclient.fetch(
-                    self._url,
-                    method="POST",
-                    body=data,
-                    request_timeout=request_timeout
-                )
-            except Exception as e:
-                self.log.error("Error in JsonRPCClient._fetch ({}, {}) \"{}\" attempt {}".format(
-                    data['method'], data['params'], str(e), retries))
-                retries += 1
-                if self.should_retry and isinstance(e, HTTPError) and (e.status == 599 or e.status == 502):
-                    # always retry after 599
-                    pass
-                elif not self.should_retry or time.time() - req_start >= request_timeout:
-                    raise
-                await asyncio.sleep(random.random())
-                continue
+            endpoint, resp = await self._post_with_retry(
+                data, request_timeout, retry, "{}, {}".format(data['method'], data['params']))
 
             rval = await resp.json()
 
@@ -145,19 +335,210 @@ class JsonRPCClient:
                 # the nodes haven't all synced to the current block yet
                 # TODO: this is only supported by parity: geth returns "<nil>" when the block number if too high
                 if 'message' in rval['error'] and rval['error']['message'] == "Unknown block number":
-                    retries += 1
-                    if self.should_retry and time.time() - req_start < request_timeout:
-                        await asyncio.sleep(random.random())
+                    if self._can_retry(retry):
+                        # try another node that might have the block
+                        retry.tried.add(endpoint)
                         continue
                 raise JsonRPCError(rval['id'], rval['error']['code'], rval['error']['message'], rval['error']['data'] if 'data' in rval['error'] else None)
 
+            if data['method'] == "eth_blockNumber":
+                self._endpoints.update_block_number(endpoint, parse_int(rval['result']))
+
             if result_processor:
                 return result_processor(rval['result'])
             return rval['result']
 
+    def _can_retry(self, retry):
+        if not self.should_retry or retry.remaining() <= 0:
+            return False
+        if not self._retry_policy.budget.acquire():
+            self.log.warning("JsonRPCClient retry budget exhausted")
+            return False
+        retry.attempts += 1
+        return True
+
+    async def _select_endpoint(self, retry):
+        policy = self._retry_policy
+        # True if endpoints were skipped by their circuit breakers since the
+        # last request, rather than having failed (which already used a retry)
+        skipped = False
+        while True:
+            if all(policy.circuit_breaker(e.url).is_open for e in self._endpoints.endpoints):
+                raise CircuitOpenError("All jsonrpc endpoints are down")
+            endpoint = self._endpoints.select(exclude=retry.tried)
+            if endpoint is None:
+                # all the nodes have been tried (or are waiting on a circuit
+                # breaker's trial request), back off before starting again
+                if retry.remaining() <= 0:
+                    raise HTTPError(599, message="Timeout waiting for an available jsonrpc endpoint")
+                if skipped and not self._can_retry(retry):
+                    raise CircuitOpenError("No jsonrpc endpoints available")
+                skipped = False
+                retry.tried.clear()
+                await asyncio.sleep(min(policy.backoff(retry.rounds), retry.remaining()))
+                retry.rounds += 1
+                continue
+            if policy.circuit_breaker(endpoint.url).allow():
+                return endpoint
+            skipped = True
+            retry.tried.add(endpoint)
+
+    async def _post_with_retry(self, body, request_timeout, retry, description):
+        """sends `body` to one of the endpoints, retrying failures according
+        to the retry policy. Returns a tuple of (endpoint, response)"""
+        while True:
+            endpoint = await self._select_endpoint(retry)
+            breaker = self._retry_policy.circuit_breaker(endpoint.url)
+            try:
+                resp = await self._post(endpoint, body, request_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if isinstance(e, HTTPError) and e.status < 500:
+                    # the endpoint is up, even if it didn't like the request
+                    breaker.record_success()
+                else:
+                    breaker.record_failure()
+                self.log.error("Error in JsonRPCClient ({}) \"{}\" attempt {}".format(
+                    description, str(e), retry.attempts))
+                if not self._can_retry(retry):
+                    raise
+                retry.tried.add(endpoint)
+                continue
+            breaker.record_success()
+            return endpoint, resp
+
+    async def _post(self, endpoint, body, request_timeout):
+        self._endpoints.start(endpoint)
+        req_start = time.time()
+        try:
+            resp = await self._httpclient.fetch(
+                endpoint.url,
+                method="POST",
+                body=body,
+                request_timeout=request_timeout
+            )
+        except Exception as e:
+            self._endpoints.finish(endpoint)
+            if isinstance(e, HTTPError) and e.status >= 500:
+                self._endpoints.eject(endpoint, str(e))
+            raise
+        self._endpoints.finish(endpoint, time.time() - req_start)
+        return resp
+
+    async def _fetch_iter(self, method, params):
+        """streams the elements of a result array from the node. Failures are
+        only retried if they happen before any results have been yielded"""
+
+        if self._bulk_mode:
+            raise ValueError("{} results can't be streamed in bulk mode".format(method))
+        if not hasattr(self._httpclient, 'stream'):
+            # the transport can't stream, so get the result all at once
+            for item in (await self._fetch(method, params)) or []:
+                yield item
+            return
+
+        body = {"jsonrpc": JSON_RPC_VERSION, "id": next(self._request_ids), "method": method, "params": params}
+        retry = _RetryState(self._request_timeout)
+        while True:
+            endpoint = await self._select_endpoint(retry)
+            breaker = self._retry_policy.circuit_breaker(endpoint.url)
+            parser = JsonRPCStreamParser()
+            yielded = False
+            self._endpoints.start(endpoint)
+            req_start = time.time()
+            try:
+                async for chunk in self._httpclient.stream(endpoint.url, method="POST", body=body,
+                                                           request_timeout=self._request_timeout):
+                    items = parser.feed(chunk)
+                    if 'error' in parser.fields:
+                        break
+                    self._check_stream_id(parser, body['id'])
+                    for item in items:
+                        yielded = True
+                        yield item
+                if 'error' not in parser.fields:
+                    items = parser.close()
+                    self._check_stream_id(parser, body['id'])
+                    for item in items:
+                        yielded = True
+                        yield item
+            except HTTPError as e:
+                self._endpoints.finish(endpoint)
+                if e.status >= 500:
+                    self._endpoints.eject(endpoint, str(e))
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                self.log.error("Error in JsonRPCClient.{} \"{}\" attempt {}".format(method, str(e), retry.attempts))
+                if yielded or not self._can_retry(retry):
+                    raise
+                retry.tried.add(endpoint)
+                continue
+            except BaseException:
+                self._endpoints.finish(endpoint)
+                raise
+            self._endpoints.finish(endpoint, time.time() - req_start)
+            breaker.record_success()
+            if 'error' in parser.fields:
+                error = parser.fields['error']
+                raise JsonRPCError(parser.fields.get('id'), error['code'], error['message'], error.get('data'))
+            return
+
+    def _check_stream_id(self, parser, request_id):
+        # verify the id we got back is the same as what we passed
+        if 'id' in parser.fields and parser.fields['id'] != request_id:
+            raise JsonRPCError(parser.fields['id'], -1, "returned id was not the same as the initial request", None)
+
+    async def _probe_endpoint(self, endpoint):
+        """health check used to decide if an ejected node can be used again"""
+        resp = await self._httpclient.fetch(
+            endpoint.url,
+            method="POST",
+            body={"jsonrpc": JSON_RPC_VERSION, "id": 0, "method": "eth_blockNumber", "params": []},
+            request_timeout=self._request_timeout
+        )
+        rval = await resp.json()
+        if "error" in rval:
+            raise JsonRPCError(rval['id'], rval['error']['code'], rval['error']['message'], rval['error'].get('data'))
+        return parse_int(rval['result'])
+
+    @property
+    def retry_policy(self):
+        return self._retry_policy
+
     def close(self):
         return self._httpclient.close()
 
+    async def eth_subscribe(self, subscription_type, *params):
+        """returns a Subscription that can be used as an async iterator over
+        the notifications from the node. Requires a websocket or ipc url"""
+
+        if not hasattr(self._httpclient, 'subscribe'):
+            raise TypeError("subscriptions require a websocket or ipc client")
+        endpoint = self._endpoints.select()
+        return await self._httpclient.subscribe(endpoint.url, [subscription_type] + list(params),
+                                                request_timeout=self._request_timeout)
+
+    def subscribe_new_heads(self):
+
+        return self.eth_subscribe("newHeads")
+
+    def subscribe_logs(self, *, address=None, topics=None):
+
+        kwargs = {}
+        if address:
+            kwargs['address'] = validate_hex(address)
+        if topics:
+            if not isinstance(topics, list):
+                raise TypeError("topics must be an array of DATA")
+            kwargs['topics'] = [None if i is None else validate_hex(i, 32) for i in topics]
+        return self.eth_subscribe("logs", kwargs)
+
+    def subscribe_new_pending_transactions(self):
+
+        return self.eth_subscribe("newPendingTransactions")
+
     def eth_getBalance(self, address, block="latest"):
 
         address = validate_hex(address)
@@ -257,7 +638,7 @@ class JsonRPCClient:
         return self._fetch("eth_getCode", [address, block])
 
     async def _eth_getLogs_with_block_number_validation(self, kwargs):
-        req_start = time.time()
+        retry = _RetryState(self._request_timeout)
         from_block = parse_int(kwargs.get('fromBlock', None))
         to_block = parse_int(kwargs.get('toBlock', None))
         while True:
@@ -267,16 +648,15 @@ class JsonRPCClient:
             await bulk.execute()
             bn = bn_future.result()
             if (from_block and bn < from_block) or (to_block and bn < to_block):
-                if self.should_retry and time.time() - req_start < self._request_timeout:
-                    await asyncio.sleep(random.random())
+                if self._can_retry(retry):
+                    await asyncio.sleep(min(self._retry_policy.backoff(retry.attempts), retry.remaining()))
                     continue
                 raise JsonRPCError(None, -32000, "Unknown block number", None)
             return lg_future.result()
 
-    def eth_getLogs(self, fromBlock=None, toBlock=None, address=None, topics=None, validate_block_number=True):
-        """validate_block_number (default True), if True will also check the node's
-        current blockNumber and make sure it is not lower than either the fromBlock
-        or toBlock arguments"""
+    def get_logs_filter(self, fromBlock=None, toBlock=None, address=None, topics=None):
+        """returns the validated filter object for an eth_getLogs request,
+        which can be used with `fetch_logs`"""
 
         kwargs = {}
         if fromBlock:
@@ -297,12 +677,45 @@ class JsonRPCClient:
                     if not validate_hex(topic):
                         raise TypeError("topics must be an array of DATA")
             kwargs['topics'] = topics
+        return kwargs
+
+    def fetch_logs(self, log_filter):
+        """runs eth_getLogs with a filter object from `get_logs_filter`. The
+        block numbers are not validated"""
+
+        return self._fetch("eth_getLogs", [log_filter])
+
+    def eth_getLogs(self, fromBlock=None, toBlock=None, address=None, topics=None, validate_block_number=True):
+        """validate_block_number (default True), if True will also check the node's
+        current blockNumber and make sure it is not lower than either the fromBlock
+        or toBlock arguments"""
 
+        kwargs = self.get_logs_filter(fromBlock, toBlock, address, topics)
         if validate_block_number and (fromBlock or toBlock):
             return self._eth_getLogs_with_block_number_validation(kwargs)
         else:
             return self._fetch("eth_getLogs", [kwargs])
 
+    async def eth_getLogs_iter(self, fromBlock=None, toBlock=None, address=None, topics=None):
+        """async generator version of eth_getLogs that decodes the response as
+        it's received, yielding each log without building the whole result in
+        memory. The block numbers are not validated"""
+
+        kwargs = self.get_logs_filter(fromBlock, toBlock, address, topics)
+        async for log in self._fetch_iter("eth_getLogs", [kwargs]):
+            yield log
+
+    def scan_logs(self, fromBlock, toBlock=None, address=None, topics=None, **kwargs):
+        """returns a LogScanner, which can be used as an async iterator over
+        all the logs from `fromBlock` to `toBlock` (or the node's current
+        block if not given or "latest"). See LogScanner for the other options"""
+
+        if toBlock == "latest":
+            # the scanner finds the node's current block itself
+            toBlock = None
+        return LogScanner(self, parse_int(fromBlock), parse_int(toBlock),
+                          address=address, topics=topics, **kwargs)
+
     def eth_call(self, *, to_address, from_address=None, gas=None, gasprice=None, value=None, data=None, block="latest"):
 
         to_address = validate_hex(to_address)
@@ -370,72 +783,149 @@ class JsonRPCClient:
 
         return self._fetch("net_version", [])
 
-    def bulk(self, should_retry=None):
+    def bulk(self, should_retry=None, *, chunk_size=None, parallelism=4, request_timeout=60.0):
+        """starts a bulk request. `chunk_size`, if given, splits the requests
+        into multiple batches sent concurrently, up to `parallelism` at a time,
+        so that a failure only requires the failed chunk to be retried"""
         if should_retry is None:
             should_retry = self.should_retry
-        return JsonRPCClient(self._url, should_retry, self.log, max_clients=self._max_clients,
+        return JsonRPCClient(self._endpoints, should_retry, self.log, max_clients=self._max_clients,
                              bulk_mode=True, request_timeout=self._request_timeout,
                              connect_timeout=self._connect_timeout,
-                             client_cls=self._client_cls, **self._client_kwargs)
+                             client_cls=self._client_cls, bulk_chunk_size=chunk_size,
+                             bulk_parallelism=parallelism, bulk_request_timeout=request_timeout,
+                             retry_policy=self._retry_policy,
+                             **self._client_kwargs)
 
-    async def execute(self):
+    def _take_bulk_requests(self):
         if not self._bulk_mode:
             raise Exception("No Bulk request started")
-        if len(self._bulk_data) == 0:
-            return []
-
-        data = self._bulk_data[:]
+        data = self._bulk_data
         self._bulk_data = []
-        futures = self._bulk_futures.copy()
-        self._bulk_futures = {}
-        req_start = time.time()
+        futures = self._bulk_futures
+        self._bulk_futures = []
+        return data, futures
 
-        retries = 0
-        while True:
-            try:
-                resp = await self._httpclient.fetch(
-                    self._url,
-                    method="POST",
-                    body=data,
-                    request_timeout=60.0 # higher request timeout than other operations
-                )
-            except Exception as e:
-                self.log.error("Error in JsonRPCClient.execute: retry {}".format(retries))
-                retries += 1
-                if self.should_retry and isinstance(e, HTTPError) and (e.status == 599 or e.status == 502):
-                    # always retry after 599
-                    pass
-                elif not self.should_retry or time.time() - req_start >= self._request_timeout:
-                    # give up after the request timeout
-                    raise
-                await asyncio.sleep(random.random())
-                continue
-            break
+    async def execute(self):
+        data, futures = self._take_bulk_requests()
+        if len(data) == 0:
+            return []
 
-        rvals = await resp.json()
+        results = [None] * len(data)
+        async for offset, chunk_results in self._execute_chunks(data, futures):
+            results[offset:offset + len(chunk_results)] = chunk_results
+        return results
 
-        results = []
+    async def execute_iter(self):
+        """like `execute`, but yields a tuple of (offset, results) for each
+        chunk as soon as it completes, where offset is the position of the
+        chunk's first request in the bulk request"""
+        data, futures = self._take_bulk_requests()
+        if len(data) == 0:
+            return
+        async for chunk in self._execute_chunks(data, futures):
+            yield chunk
+
+    async def _execute_chunks(self, data, futures):
+        chunk_size = self._bulk_chunk_size or len(data)
+        semaphore = asyncio.Semaphore(self._bulk_parallelism or 1)
+
+        async def execute_chunk(offset):
+            async with semaphore:
+                results = await self._execute_batch(data[offset:offset + chunk_size],
+                                                    futures[offset:offset + chunk_size],
+                                                    request_timeout=self._bulk_request_timeout)
+            return offset, results
+
+        tasks = [asyncio.ensure_future(execute_chunk(offset))
+                 for offset in range(0, len(data), chunk_size)]
+        error = None
+        try:
+            for task in asyncio.as_completed(tasks):
+                try:
+                    chunk = await task
+                except Exception as e:
+                    # the chunk's futures have already been given the error,
+                    # let the other chunks complete before raising
+                    if error is None:
+                        error = e
+                    continue
+                yield chunk
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        if error is not None:
+            raise error
+
+    async def _execute_batch(self, data, futures, *, request_timeout, retry_unknown_block_number=False):
+        """sends the list of requests in `data` as a single batch, passing the
+        results (or errors) on to the (future, result_processor) at the same
+        position in the `futures` list, and returning the results in the same
+        order as the requests (with None for errors). The request ids must be
+        consecutive. If `retry_unknown_block_number` is True, requests that
+        fail because the node hasn't synced the requested block yet are retried
+        individually"""
+        try:
+            endpoint, resp = await self._post_with_retry(
+                data, request_timeout, _RetryState(self._request_timeout), "bulk request")
+        except Exception as e:
+            _set_futures_exception(futures, e)
+            raise
+
+        try:
+            rvals = await resp.json()
+        except Exception as e:
+            _set_futures_exception(futures, e)
+            raise
+
+        if isinstance(rvals, dict):
+            # the whole batch was rejected
+            if "error" in rvals:
+                error = JsonRPCError(rvals.get('id'), rvals['error']['code'], rvals['error']['message'], rvals['error'].get('data'))
+            else:
+                error = JsonRPCError(None, -1, "Expected a list of results from jsonrpc bulk request", None)
+            _set_futures_exception(futures, error)
+            raise error
+
+        first_id = data[0]['id']
+        results = [None] * len(data)
+        resolved = [False] * len(data)
+        remaining = len(data)
         for rval in rvals:
-            if 'id' not in rval:
-                continue
-            future, result_processor = futures.pop(rval['id'], (None, None))
-            if future is None:
+            rid = rval.get('id')
+            idx = rid - first_id if isinstance(rid, int) else -1
+            if idx < 0 or idx >= len(data):
                 self.log.warning("Got unexpected id in jsonrpc bulk response")
                 continue
+            if resolved[idx]:
+                self.log.warning("Got duplicate id in jsonrpc bulk response")
+                continue
+            resolved[idx] = True
+            remaining -= 1
+            future, result_processor = futures[idx]
             if "error" in rval:
-                future.set_exception(JsonRPCError(rval['id'], rval['error']['code'], rval['error']['message'], rval['error']['data'] if 'data' in rval['error'] else None))
-                result = None
+                if retry_unknown_block_number and self.should_retry and \
+                   rval['error'].get('message') == "Unknown block number":
+                    asyncio.ensure_future(self._execute_single_to_future(data[idx], future, result_processor))
+                elif not future.done():
+                    # the caller may have cancelled the future
+                    future.set_exception(JsonRPCError(rval['id'], rval['error']['code'], rval['error']['message'], rval['error']['data'] if 'data' in rval['error'] else None))
             else:
+                if data[idx]['method'] == "eth_blockNumber":
+                    self._endpoints.update_block_number(endpoint, parse_int(rval['result']))
                 if result_processor:
                     result = result_processor(rval['result'])
                 else:
                     result = rval['result']
-                future.set_result(result)
-            results.append(result)
+                if not future.done():
+                    future.set_result(result)
+                results[idx] = result
 
-        if len(futures):
+        if remaining:
             self.log.warning("Found some unprocessed requests in bulk jsonrpc request")
-            for future, result_processor in futures:
-                future.set_exception(Exception("Unexpectedly missing result"))
+            for idx, done in enumerate(resolved):
+                if not done and not futures[idx][0].done():
+                    futures[idx][0].set_exception(Exception("Unexpectedly missing result"))
 
         return results
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import random
+import time
+
+ENDPOINTS_LOG = logging.getLogger("toshi.jsonrpc.endpoints")
+
+class JsonRPCEndpoint:
+
+    __slots__ = ('url', 'outstanding', 'latency', 'block_number', 'ejected_until', 'probing')
+
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.latency = None
+        self.block_number = None
+        self.ejected_until = None
+        self.probing = False
+
+    @property
+    def healthy(self):
+        return self.ejected_until is None
+
+    def __repr__(self):
+        return "<JsonRPCEndpoint {} outstanding={} latency={} block_number={} healthy={}>".format(
+            self.url, self.outstanding, self.latency, self.block_number, self.healthy)
+
+class JsonRPCEndpointPool:
+    """Tracks the state of a set of jsonrpc nodes, selecting which node to use
+    for each request.
+
+    `strategy` is either "least_outstanding", which picks the node with the
+    fewest requests in progress, or "latency", which picks the node with the
+    lowest average response time.
+
+    Nodes are ejected if they return a server error or if their block number
+    is more than `max_block_lag` behind the highest block number seen. After
+    `eject_time` seconds an ejected node is sent a health probe (using the
+    `probe` coroutine function, which should return the node's block number)
+    and is re-admitted if it responds and has caught up."""
+
+    def __init__(self, urls, *, strategy="least_outstanding", max_block_lag=5,
+                 eject_time=10.0, latency_decay=0.3, probe=None, log=None):
+        if isinstance(urls, str):
+            urls = [urls]
+        if not urls:
+            raise ValueError("at least one url is required")
+        if strategy not in ("least_outstanding", "latency"):
+            raise ValueError("unknown strategy: {}".format(strategy))
+        self.endpoints = [JsonRPCEndpoint(url) for url in urls]
+        self.strategy = strategy
+        self.max_block_lag = max_block_lag
+        self.eject_time = eject_time
+        self.latency_decay = latency_decay
+        self.probe = probe
+        self.highest_block_number = None
+        self.log = log or ENDPOINTS_LOG
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def select(self, exclude=None):
+        """returns the best healthy endpoint not in `exclude`. If all the
+        endpoints not in `exclude` are ejected None is returned, unless
+        `exclude` is empty in which case the endpoint that will be
+        re-admitted the soonest is returned"""
+
+        now = time.time()
+        candidates = []
+        for endpoint in self.endpoints:
+            if not endpoint.healthy and endpoint.ejected_until <= now and not endpoint.probing:
+                self._readmit(endpoint)
+            if endpoint.healthy and (not exclude or endpoint not in exclude):
+                candidates.append(endpoint)
+
+        if not candidates:
+            if exclude:
+                return None
+            return min(self.endpoints, key=lambda e: e.ejected_until)
+
+        if len(candidates) == 1:
+            return candidates[0]
+        if self.strategy == "latency":
+            # untested endpoints get tried first
+            key = lambda e: e.latency or 0.0
+        else:
+            key = lambda e: e.outstanding
+        best = key(min(candidates, key=key))
+        return random.choice([e for e in candidates if key(e) == best])
+
+    def start(self, endpoint):
+        endpoint.outstanding += 1
+
+    def finish(self, endpoint, latency=None):
+        endpoint.outstanding -= 1
+        if latency is not None:
+            if endpoint.latency is None:
+                endpoint.latency = latency
+            else:
+                endpoint.latency += self.latency_decay * (latency - endpoint.latency)
+
+    def eject(self, endpoint, reason=None):
+        if endpoint.healthy and len(self.endpoints) > 1:
+            self.log.warning("Ejecting jsonrpc endpoint {}: {}".format(endpoint.url, reason))
+        endpoint.ejected_until = time.time() + self.eject_time
+
+    def update_block_number(self, endpoint, block_number):
+        if block_number is None:
+            return
+        if endpoint.block_number is None or block_number > endpoint.block_number:
+            endpoint.block_number = block_number
+        if self.highest_block_number is None or block_number > self.highest_block_number:
+            self.highest_block_number = block_number
+        if self.is_lagging(endpoint):
+            self.eject(endpoint, "block number {} is behind {}".format(
+                endpoint.block_number, self.highest_block_number))
+
+    def is_lagging(self, endpoint):
+        return endpoint.block_number is not None and self.highest_block_number is not None and \
+            endpoint.block_number < self.highest_block_number - self.max_block_lag
+
+    def _readmit(self, endpoint):
+        if self.probe is None:
+            endpoint.ejected_until = None
+            return
+        endpoint.probing = True
+        asyncio.ensure_future(self._probe(endpoint))
+
+    async def _probe(self, endpoint):
+        try:
+            block_number = await self.probe(endpoint)
+        except Exception as e:
+            self.eject(endpoint, "health probe failed: {}".format(e))
+        else:
+            endpoint.ejected_until = None
+            self.update_block_number(endpoint, block_number)
+            if endpoint.healthy:
+                self.log.info("Re-admitted jsonrpc endpoint {}".format(endpoint.url))
+        finally:
+            endpoint.probing = False
@@ -9,6 +9,12 @@ class HTTPError(Exception):
     def __str__(self):
         return "HTTP %d: %s" % (self.status, self.message)
 
+class CircuitOpenError(HTTPError):
+    """Raised without sending a request when all the endpoints are known
+    to be down"""
+    def __init__(self, message=None):
+        super().__init__(503, message=message or "Circuit breaker open")
+
 class JsonRPCError(Exception):
     def __init__(self, request_id, code, message, data, is_notification=False):
         super().__init__(message)
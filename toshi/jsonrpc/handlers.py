@@ -1,4 +1,5 @@
 import asyncio
+import inspect
 import json
 from tornado.escape import json_decode
 
@@ -46,9 +47,99 @@ def map_jsonrpc_arguments(map):
         return fn
     return wrap
 
+class _JsonRPCMethod:
+    """Resolved jsonrpc method, holding everything needed to validate the
+    params and call the method without further introspection"""
+
+    __slots__ = ('descriptor', 'fn', 'is_coroutine', 'keyword_map', 'signature')
+
+    def __init__(self, descriptor, fn, signature):
+        self.descriptor = descriptor
+        self.fn = fn
+        self.is_coroutine = asyncio.iscoroutinefunction(fn)
+        self.keyword_map = getattr(fn, 'keyword_map', None)
+        self.signature = signature
+
+    @classmethod
+    def from_class_attribute(cls, attr):
+        """returns None if `attr` isn't a plain, static or class method"""
+        if isinstance(attr, staticmethod):
+            fn = attr.__func__
+            drop_first = False
+        elif isinstance(attr, classmethod):
+            fn = attr.__func__
+            drop_first = True
+        elif inspect.isfunction(attr):
+            fn = attr
+            drop_first = True
+        else:
+            return None
+        try:
+            signature = inspect.signature(fn)
+        except (TypeError, ValueError):
+            signature = None
+        else:
+            if drop_first:
+                params = list(signature.parameters.values())
+                if params and params[0].kind in (inspect.Parameter.POSITIONAL_ONLY,
+                                                 inspect.Parameter.POSITIONAL_OR_KEYWORD):
+                    signature = signature.replace(parameters=params[1:])
+        return cls(attr, fn, signature)
+
+    @classmethod
+    def from_callable(cls, fn):
+        try:
+            signature = inspect.signature(fn)
+        except (TypeError, ValueError):
+            signature = None
+        return cls(None, fn, signature)
+
+    def bind(self, instance, params):
+        """returns the callable and arguments for the given params,
+        raising TypeError if the params don't match the method's signature"""
+
+        if self.descriptor is None:
+            fn = self.fn
+        else:
+            fn = self.descriptor.__get__(instance, type(instance))
+
+        if isinstance(params, list):
+            args = params
+            kwargs = {}
+        elif isinstance(params, dict):
+            args = []
+            if self.keyword_map:
+                kwargs = {}
+                for key, value in params.items():
+                    if key in self.keyword_map:
+                        kwargs[self.keyword_map[key]] = value
+                    else:
+                        kwargs[key] = value
+            else:
+                kwargs = params
+        else:
+            args = []
+            kwargs = {}
+
+        if self.signature is not None:
+            self.signature.bind(*args, **kwargs)
+
+        return fn, args, kwargs
+
 class JsonRPCBase:
 
-    """Base class for building jsonrpc apis"""
+    """Base class for building jsonrpc apis
+
+    `batch_concurrency` sets how many requests from a batch request are
+    processed at the same time. The default of 1 handles them one after
+    another, which is required when the methods share state (e.g. a single
+    database connection). Setting it to None removes the limit.
+
+    The methods available on a class are resolved once, the first time
+    the class handles a request, so methods added to the class after
+    that point will not be found."""
+
+    batch_concurrency = 1
 
     async def __call__(self, request):
 
@@ -60,11 +151,13 @@ class JsonRPCBase:
 
         # check batch request
         if isinstance(request, list):
-            resp = []
-            for r in request:
-                result = await self._handle_single_request(r)
-                if result:
-                    resp.append(result)
+            if self.batch_concurrency == 1:
+                results = []
+                for r in request:
+                    results.append(await self._handle_single_request(r))
+            else:
+                results = await self._handle_batch_request(request)
+            resp = [result for result in results if result]
             # if all were notifications
             if not resp:
                 return None
@@ -72,43 +165,74 @@ class JsonRPCBase:
         # standard single request
         return await self._handle_single_request(request)
 
+    async def _handle_batch_request(self, requests):
+        """processes the requests concurrently, limited by `batch_concurrency`,
+        returning the results in the same order as the requests"""
+
+        if self.batch_concurrency:
+            semaphore = asyncio.Semaphore(self.batch_concurrency)
+
+            async def handle(request):
+                async with semaphore:
+                    return await self._handle_single_request(request)
+        else:
+            handle = self._handle_single_request
+
+        return await asyncio.gather(*[handle(r) for r in requests])
+
+    @classmethod
+    def _get_dispatch_table(cls):
+        # look in the class's own __dict__ so subclasses don't share
+        # their parent's table
+        table = cls.__dict__.get('_jsonrpc_dispatch_table')
+        if table is None:
+            table = {}
+            for name in dir(cls):
+                if name.startswith('_'):
+                    continue
+                entry = _JsonRPCMethod.from_class_attribute(inspect.getattr_static(cls, name))
+                if entry is not None:
+                    table[name] = entry
+            cls._jsonrpc_dispatch_table = table
+        return table
+
+    def _get_method(self, method):
+        if not isinstance(method, str) or method.startswith('.') or method.startswith('_'):
+            return None
+        entry = self._get_dispatch_table().get(method)
+        if entry is None:
+            # fall back to attributes that aren't plain methods on the
+            # class (e.g. callables set on the instance or properties)
+            fn = getattr(self, method, None)
+            if fn is None or not callable(fn):
+                return None
+            entry = _JsonRPCMethod.from_callable(fn)
+        return entry
+
     async def _handle_single_request(self, request):
         # check for invalid request
         if 'method' not in request or 'jsonrpc' not in request or request['jsonrpc'] != "2.0":
             return _invalid_request(request)
 
         method = request['method']
-        if method.startswith('.') or method.startswith('_') or not hasattr(self, method) or not callable(getattr(self, method)):
+        entry = self._get_method(method)
+        if entry is None:
             return _method_not_found(request)
-        fn = getattr(self, method)
 
         params = request.get('params')
 
-        if isinstance(params, list):
-            args = params
-            kwargs = {}
-        elif isinstance(params, dict):
-            args = []
-            if hasattr(fn, 'keyword_map'):
-                kwargs = {}
-                for key, value in params.items():
-                    if key in fn.keyword_map:
-                        kwargs[fn.keyword_map[key]] = value
-                    else:
-                        kwargs[key] = value
-            else:
-                kwargs = params
-
-        else:
-            args = []
-            kwargs = {}
-
         try:
-            result = fn(*args, **kwargs)
-            if asyncio.iscoroutine(result):
-                result = await result
+            fn, args, kwargs = entry.bind(self, params)
         except TypeError:
             return JsonRPCInvalidParamsError(request=request, data={'id': 'bad_arguments', 'message': "Bad Arguments"}).format()
+
+        try:
+            if entry.is_coroutine:
+                result = await fn(*args, **kwargs)
+            else:
+                result = fn(*args, **kwargs)
+                if asyncio.iscoroutine(result):
+                    result = await result
         except JsonRPCError as e:
             return e.format(request)
         except:
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+
+from toshi.jsonrpc.errors import JsonRPCError, HTTPError, CircuitOpenError
+
+SCANNER_LOG = logging.getLogger("toshi.jsonrpc.log_scanner")
+
+class _LogRange:
+
+    __slots__ = ('start', 'end', 'task', 'adapted')
+
+    def __init__(self, start, end, task):
+        self.start = start
+        self.end = end
+        self.task = task
+        self.adapted = False
+
+class LogScanner:
+    """Fetches the logs for a large range of blocks by splitting it into
+    sub-ranges that are requested concurrently, yielding the logs in order.
+
+    The size of the sub-ranges adapts to the number of logs returned,
+    growing (up to `max_range`) while fewer than half of `target_logs` are
+    returned and shrinking when more are returned. Ranges that fail (e.g.
+    because the node refused to return that many results, or timed out) are
+    split in half and retried.
+
+    The node's block number is only requested once per scan, to find the
+    end of the range when `to_block` isn't given and to check the node has
+    seen `to_block`."""
+
+    def __init__(self, client, from_block, to_block=None, *, address=None, topics=None,
+                 initial_range=1000, min_range=1, max_range=100000, target_logs=5000,
+                 parallelism=4, head_timeout=30.0, log=None):
+        if parallelism < 1:
+            raise ValueError("parallelism must be at least 1")
+        self.client = client
+        self.from_block = from_block
+        self.to_block = to_block
+        self.filter = client.get_logs_filter(address=address, topics=topics)
+        self.range_size = initial_range
+        self.min_range = min_range
+        self.max_range = max_range
+        self.target_logs = target_logs
+        self.parallelism = parallelism
+        self.head_timeout = head_timeout
+        self.head = None
+        self.log = log or SCANNER_LOG
+
+    def __aiter__(self):
+        return self.logs()
+
+    async def logs(self):
+        async for start, end, logs in self.ranges():
+            for log in logs:
+                yield log
+
+    async def _get_head(self, to_block):
+        deadline = time.time() + self.head_timeout
+        attempt = 0
+        while True:
+            self.head = await self.client.eth_blockNumber()
+            if to_block is None or self.head >= to_block:
+                return self.head
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise JsonRPCError(None, -32000, "Unknown block number", None)
+            # wait for the node to catch up
+            await asyncio.sleep(min(self.client.retry_policy.backoff(attempt), remaining))
+            attempt += 1
+
+    async def _fetch(self, start, end):
+        kwargs = dict(self.filter)
+        kwargs['fromBlock'] = hex(start)
+        kwargs['toBlock'] = hex(end)
+        return await self.client.fetch_logs(kwargs)
+
+    def _start(self, start, end):
+        return _LogRange(start, end, asyncio.ensure_future(self._fetch(start, end)))
+
+    def _adapt(self, log_range, logs):
+        size = log_range.end - log_range.start + 1
+        if len(logs) > self.target_logs:
+            self.range_size = max(self.min_range, min(self.range_size, size // 2))
+        elif len(logs) < self.target_logs // 2 and size >= self.range_size:
+            self.range_size = min(self.max_range, self.range_size * 2)
+
+    async def ranges(self):
+        """async generator yielding a tuple of (from_block, to_block, logs) for
+        each sub-range in order, which can be used to track progress through
+        ranges with no logs"""
+
+        to_block = self.to_block
+        await self._get_head(to_block)
+        if to_block is None:
+            to_block = self.head
+
+        next_block = self.from_block
+        pending = []
+        try:
+            while pending or next_block <= to_block:
+                # keep at most `parallelism` ranges in progress, including
+                # those that have finished but are waiting to be yielded, so
+                # a slow range doesn't cause unbounded results to be buffered
+                while len(pending) < self.parallelism and next_block <= to_block:
+                    end = min(next_block + self.range_size - 1, to_block)
+                    pending.append(self._start(next_block, end))
+                    next_block = end + 1
+
+                await asyncio.wait([r.task for r in pending if not r.task.done()] or [pending[0].task],
+                                   return_when=asyncio.FIRST_COMPLETED)
+
+                idx = 0
+                while idx < len(pending):
+                    log_range = pending[idx]
+                    if not log_range.task.done():
+                        idx += 1
+                        continue
+                    error = log_range.task.exception()
+                    if error is None:
+                        if not log_range.adapted:
+                            self._adapt(log_range, log_range.task.result() or [])
+                            log_range.adapted = True
+                        idx += 1
+                        continue
+                    if isinstance(error, CircuitOpenError) or not isinstance(error, (JsonRPCError, HTTPError)) \
+                       or log_range.start == log_range.end:
+                        raise error
+                    # split the range in half and try again
+                    mid = (log_range.start + log_range.end) // 2
+                    self.log.info("Splitting eth_getLogs range {}-{}: {}".format(
+                        log_range.start, log_range.end, error))
+                    self.range_size = max(self.min_range, min(self.range_size, (mid - log_range.start + 1)))
+                    pending[idx:idx + 1] = [self._start(log_range.start, mid),
+                                            self._start(mid + 1, log_range.end)]
+                    idx += 2
+
+                # yield the results that are ready in order
+                while pending and pending[0].task.done() and pending[0].task.exception() is None:
+                    log_range = pending.pop(0)
+                    yield log_range.start, log_range.end, log_range.task.result() or []
+        finally:
+            for log_range in pending:
+                if not log_range.task.done():
+                    log_range.task.cancel()
+                else:
+                    # make sure unretrieved exceptions aren't logged
+                    log_range.task.exception()
@@ -0,0 +1,104 @@
+import random
+import time
+
+class RetryBudget:
+    """Token bucket limiting how many retries can be made, refilling at
+    `rate` tokens per second up to `capacity`"""
+
+    def __init__(self, rate=10.0, capacity=100.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._last = time.time()
+
+    def acquire(self):
+        """returns True if there was a token available for a retry"""
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class CircuitBreaker:
+    """Stops requests being sent to an endpoint after `failure_threshold`
+    consecutive failures. After `reset_timeout` seconds a single trial
+    request is allowed through, closing the circuit again if it succeeds"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.state = CircuitBreaker.CLOSED
+        self.opened_at = None
+
+    @property
+    def is_open(self):
+        """True while requests are being rejected without a trial request"""
+        return self.state == CircuitBreaker.OPEN and time.time() - self.opened_at < self.reset_timeout
+
+    def allow(self):
+        if self.state == CircuitBreaker.CLOSED:
+            return True
+        if time.time() - self.opened_at >= self.reset_timeout:
+            # let a single request through to test the endpoint. resetting
+            # the time means another trial is allowed if this one never
+            # completes
+            self.state = CircuitBreaker.HALF_OPEN
+            self.opened_at = time.time()
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.state = CircuitBreaker.CLOSED
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == CircuitBreaker.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = CircuitBreaker.OPEN
+            self.opened_at = time.time()
+
+class RetryPolicy:
+    """Controls how JsonRPCClient retries failed requests.
+
+    The delay between attempts grows exponentially from `base_delay` by
+    `multiplier`, capped at `max_delay`, with "full jitter" applied (a
+    random delay between 0 and the calculated value) so that clients don't
+    retry in lock step. Each retry takes a token from `budget`, and a
+    circuit breaker is kept for each url so requests fail fast while an
+    endpoint is known to be down."""
+
+    def __init__(self, *, base_delay=0.1, max_delay=5.0, multiplier=2.0, jitter=True,
+                 budget=None, failure_threshold=5, reset_timeout=10.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.budget = budget or RetryBudget()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._circuit_breakers = {}
+
+    def backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (self.multiplier ** attempt))
+        if self.jitter:
+            return random.uniform(0, delay)
+        return delay
+
+    def circuit_breaker(self, url):
+        breaker = self._circuit_breakers.get(url)
+        if breaker is None:
+            breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            self._circuit_breakers[url] = breaker
+        return breaker
+
+# shared between all clients that aren't given their own policy, so the
+# retry budget and circuit breakers apply to the whole process
+DEFAULT_RETRY_POLICY = RetryPolicy()
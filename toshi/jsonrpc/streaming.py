@@ -0,0 +1,128 @@
+import codecs
+import json
+
+_WHITESPACE = ' \t\n\r'
+
+# parser states
+_START = 0
+_KEY = 1
+_COLON = 2
+_VALUE = 3
+_ARRAY = 4
+_DONE = 5
+
+class JsonRPCStreamParser:
+    """Incremental parser for a single jsonrpc response whose result is an
+    array. Data is passed to `feed` as it's received, which returns the
+    elements of the result array that have been completely received so far,
+    so only a single element needs to be held in memory at a time.
+
+    The other members of the response object (e.g. "id" and "error") are
+    stored in `fields`. If the result isn't an array it's also stored there."""
+
+    def __init__(self, key="result"):
+        self.key = key
+        self.fields = {}
+        self._buffer = ""
+        self._pos = 0
+        self._state = _START
+        self._current_key = None
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+
+    @property
+    def done(self):
+        return self._state == _DONE
+
+    def _skip_whitespace(self):
+        buf = self._buffer
+        pos = self._pos
+        end = len(buf)
+        while pos < end and buf[pos] in _WHITESPACE:
+            pos += 1
+        self._pos = pos
+        return pos < end
+
+    def _decode_value(self, final):
+        """decodes the value at the current position, returning None if
+        more data is needed"""
+        try:
+            value, end = self._decoder.raw_decode(self._buffer, self._pos)
+        except ValueError:
+            if final:
+                raise
+            return None
+        if not final and end == len(self._buffer) and \
+           isinstance(value, (int, float)) and not isinstance(value, bool):
+            # the number could continue in the next chunk
+            return None
+        self._pos = end
+        return (value,)
+
+    def feed(self, data, final=False):
+        if isinstance(data, bytes):
+            data = self._text_decoder.decode(data, final)
+        # drop the data that's already been parsed
+        self._buffer = self._buffer[self._pos:] + data
+        self._pos = 0
+
+        items = []
+        while self._skip_whitespace():
+            char = self._buffer[self._pos]
+            state = self._state
+            if state == _START:
+                if char != '{':
+                    raise ValueError("Expected a json object")
+                self._pos += 1
+                self._state = _KEY
+            elif state == _KEY:
+                if char == '}':
+                    self._pos += 1
+                    self._state = _DONE
+                elif char == ',':
+                    self._pos += 1
+                else:
+                    key = self._decode_value(final)
+                    if key is None:
+                        break
+                    if not isinstance(key[0], str):
+                        raise ValueError("Expected an object key")
+                    self._current_key = key[0]
+                    self._state = _COLON
+            elif state == _COLON:
+                if char != ':':
+                    raise ValueError("Expected ':'")
+                self._pos += 1
+                self._state = _VALUE
+            elif state == _VALUE:
+                if char == '[' and self._current_key == self.key:
+                    self._pos += 1
+                    self._state = _ARRAY
+                else:
+                    value = self._decode_value(final)
+                    if value is None:
+                        break
+                    self.fields[self._current_key] = value[0]
+                    self._state = _KEY
+            elif state == _ARRAY:
+                if char == ']':
+                    self._pos += 1
+                    self._state = _KEY
+                elif char == ',':
+                    self._pos += 1
+                else:
+                    item = self._decode_value(final)
+                    if item is None:
+                        break
+                    items.append(item[0])
+            else:
+                raise ValueError("Unexpected data after the end of the response")
+        return items
+
+    def close(self):
+        """called once all the data has been received, returning any
+        remaining items"""
+        items = self.feed(b"", final=True)
+        if self._state != _DONE:
+            raise ValueError("Incomplete jsonrpc response")
+        return items
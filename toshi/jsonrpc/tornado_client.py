@@ -1,4 +1,6 @@
+import asyncio
 import tornado.escape
+import tornado.httputil
 
 try:
     # prefer curl if pycurl is available
@@ -24,13 +26,17 @@ class HTTPClient:
         self._connect_timeout = connect_timeout
         self._verify_ssl = verify_ssl
 
-    async def fetch(self, url, *, method="GET", headers=None, body=None, request_timeout=30.0):
+    def _prepare_body(self, headers, body):
         if isinstance(body, (dict, list)):
             if headers is None:
                 headers = {'Content-Type': "application/json"}
             elif 'Content-Type' not in headers:
                 headers['Content-Type'] = "application/json"
             body = tornado.escape.json_encode(body)
+        return headers, body
+
+    async def fetch(self, url, *, method="GET", headers=None, body=None, request_timeout=30.0):
+        headers, body = self._prepare_body(headers, body)
         resp = await self._httpclient.fetch(url,
                                             method=method,
                                             headers=headers,
@@ -43,5 +49,53 @@ class HTTPClient:
             raise HTTPError(resp.code, message=resp.reason)
         return HTTPResponse(resp.code, resp.body)
 
+    async def stream(self, url, *, method="GET", headers=None, body=None, request_timeout=30.0):
+        """async generator yielding the response body in chunks as it's received.
+
+        tornado's streaming_callback can't pause reading the response, so
+        there's no backpressure: chunks that arrive faster than they are
+        consumed are buffered in memory. If the consumer stops early the
+        fetch is cancelled and any further chunks are dropped"""
+        headers, body = self._prepare_body(headers, body)
+        chunks = asyncio.Queue()
+        status = []
+        closed = False
+
+        def header_callback(line):
+            if not status and line.startswith("HTTP/"):
+                status.append(tornado.httputil.parse_response_start_line(line.strip()))
+
+        def streaming_callback(chunk):
+            if not closed:
+                chunks.put_nowait(chunk)
+
+        fut = asyncio.ensure_future(self._httpclient.fetch(url,
+                                                           method=method,
+                                                           headers=headers,
+                                                           body=body,
+                                                           validate_cert=self._verify_ssl,
+                                                           request_timeout=request_timeout,
+                                                           connect_timeout=self._connect_timeout,
+                                                           header_callback=header_callback,
+                                                           streaming_callback=streaming_callback,
+                                                           raise_error=False))
+        fut.add_done_callback(lambda f: chunks.put_nowait(None))
+        try:
+            while True:
+                chunk = await chunks.get()
+                if chunk is None:
+                    break
+                if status and (status[0].code < 200 or status[0].code >= 300):
+                    # ignore the error body, and let the response below raise
+                    continue
+                yield chunk
+            resp = fut.result()
+            if resp.code < 200 or resp.code >= 300:
+                raise HTTPError(resp.code, message=resp.reason)
+        finally:
+            closed = True
+            if not fut.done():
+                fut.cancel()
+
     async def close(self):
         self._httpclient.close()
@@ -0,0 +1,405 @@
+import asyncio
+import codecs
+import itertools
+import json
+import logging
+import re
+import weakref
+
+import tornado.escape
+import tornado.websocket
+
+from toshi.jsonrpc.errors import HTTPError, JsonRPCError
+
+PERSISTENT_LOG = logging.getLogger("toshi.jsonrpc.websocket_client")
+
+_END = object()
+
+# the characters that matter when finding the end of a json object or array
+_FRAMING_CHARS = re.compile(r'[{}\[\]"\\]')
+
+class Response:
+    def __init__(self, body):
+        self.status = 200
+        self.body = body
+
+    async def json(self, **kwargs):
+        return self.body
+
+class Subscription:
+    """Async iterator over the notifications for an `eth_subscribe` call.
+    Iteration stops when `unsubscribe` is called, and raises HTTPError if
+    the connection to the node is lost"""
+
+    def __init__(self, connection):
+        self.id = None
+        self._connection = connection
+        self._queue = asyncio.Queue()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self._queue.get()
+        if item is _END:
+            # make sure anything else waiting also stops
+            self._queue.put_nowait(_END)
+            raise StopAsyncIteration
+        if isinstance(item, Exception):
+            self._queue.put_nowait(item)
+            raise item
+        return item
+
+    def _push(self, item):
+        self._queue.put_nowait(item)
+
+    async def unsubscribe(self):
+        if self.id is None:
+            return
+        sub_id, self.id = self.id, None
+        self._connection.subscriptions.pop(sub_id, None)
+        self._push(_END)
+        try:
+            await self._connection.request({"jsonrpc": "2.0", "id": 0, "method": "eth_unsubscribe",
+                                            "params": [sub_id]}, None)
+        except HTTPError:
+            # the subscription is gone with the connection anyway
+            pass
+
+class _PendingRequest:
+
+    __slots__ = ('future', 'ids', 'subscription')
+
+    def __init__(self, future, ids, subscription=None):
+        self.future = future
+        self.ids = ids
+        self.subscription = subscription
+
+class PersistentConnection:
+    """A single connection to a node multiplexing many jsonrpc requests.
+
+    Request ids are rewritten to ids unique to the connection, so requests
+    from different JsonRPCClients can't clash, and restored in the
+    responses. Subclasses implement `_open`, `_write`, `_read` and `_close`
+    for the underlying transport"""
+
+    def __init__(self, url, *, connect_timeout=None, log=None):
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.log = log or PERSISTENT_LOG
+        self.pending = {}
+        self.subscriptions = {}
+        self._ids = itertools.count(1)
+        self._connected = None
+        self._reader = None
+
+    async def connect(self):
+        if self._connected is None:
+            self._connected = asyncio.ensure_future(self._connect())
+        try:
+            await asyncio.shield(self._connected)
+        except Exception:
+            self._connected = None
+            raise
+
+    async def _connect(self):
+        try:
+            if self.connect_timeout:
+                await asyncio.wait_for(self._open(), self.connect_timeout)
+            else:
+                await self._open()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            raise HTTPError(599, message="Unable to connect to {}: {}".format(self.url, e))
+        self._reader = asyncio.ensure_future(self._read_loop())
+
+    async def request(self, body, timeout, subscription=None):
+        await self.connect()
+        future = asyncio.get_event_loop().create_future()
+        if isinstance(body, list):
+            ids = {}
+            message = []
+            for request in body:
+                request = dict(request)
+                if 'id' in request:
+                    new_id = next(self._ids)
+                    ids[new_id] = request['id']
+                    request['id'] = new_id
+                message.append(request)
+            pending = _PendingRequest(future, ids)
+            for new_id in ids:
+                self.pending[new_id] = pending
+        else:
+            message = dict(body)
+            new_id = next(self._ids)
+            pending = _PendingRequest(future, {new_id: message['id']}, subscription)
+            message['id'] = new_id
+            self.pending[new_id] = pending
+
+        try:
+            await self._write(tornado.escape.json_encode(message))
+            if timeout:
+                return await asyncio.wait_for(asyncio.shield(future), timeout)
+            return await future
+        except asyncio.TimeoutError:
+            raise HTTPError(599, message="Timeout")
+        finally:
+            for new_id in pending.ids:
+                self.pending.pop(new_id, None)
+
+    async def subscribe(self, params, timeout):
+        subscription = Subscription(self)
+        resp = await self.request({"jsonrpc": "2.0", "id": 0, "method": "eth_subscribe", "params": params},
+                                  timeout, subscription=subscription)
+        if "error" in resp:
+            raise JsonRPCError(None, resp['error']['code'], resp['error']['message'], resp['error'].get('data'))
+        return subscription
+
+    async def _read_loop(self):
+        error = None
+        try:
+            while True:
+                message = await self._read()
+                if message is None:
+                    break
+                self._dispatch(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = e
+            self.log.exception("Error reading from jsonrpc connection {}".format(self.url))
+        finally:
+            self._connection_lost(error)
+
+    def _dispatch(self, message):
+        if isinstance(message, list):
+            for rval in message:
+                if rval.get('id') in self.pending:
+                    pending = self.pending[rval['id']]
+                    break
+            else:
+                self.log.warning("Got unexpected batch response from {}".format(self.url))
+                return
+            for rval in message:
+                if rval.get('id') in pending.ids:
+                    rval['id'] = pending.ids[rval['id']]
+            if not pending.future.done():
+                pending.future.set_result(message)
+        elif message.get('method') == "eth_subscription":
+            params = message.get('params', {})
+            subscription = self.subscriptions.get(params.get('subscription'))
+            if subscription is not None:
+                subscription._push(params.get('result'))
+        elif message.get('id') in self.pending:
+            pending = self.pending[message['id']]
+            message['id'] = pending.ids[message['id']]
+            if pending.subscription is not None and 'result' in message:
+                # register the subscription before any more messages are read
+                # so that notifications that follow aren't lost
+                pending.subscription.id = message['result']
+                self.subscriptions[message['result']] = pending.subscription
+            if not pending.future.done():
+                pending.future.set_result(message)
+        else:
+            self.log.warning("Got unexpected message from {}".format(self.url))
+
+    def _connection_lost(self, error):
+        self._connected = None
+        self._reader = None
+        exc = HTTPError(599, message="Connection to {} lost{}".format(
+            self.url, ": {}".format(error) if error else ""))
+        pending, self.pending = self.pending, {}
+        for request in pending.values():
+            if not request.future.done():
+                request.future.set_exception(exc)
+        subscriptions, self.subscriptions = self.subscriptions, {}
+        for subscription in subscriptions.values():
+            subscription.id = None
+            subscription._push(exc)
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        await self._close()
+        self._connection_lost(None)
+
+class WebSocketConnection(PersistentConnection):
+
+    def __init__(self, url, *, max_message_size=None, **kwargs):
+        super().__init__(url, **kwargs)
+        self.max_message_size = max_message_size
+        self._ws = None
+
+    async def _open(self):
+        kwargs = {}
+        if self.max_message_size:
+            kwargs['max_message_size'] = self.max_message_size
+        self._ws = await tornado.websocket.websocket_connect(self.url, **kwargs)
+
+    async def _write(self, message):
+        if self._ws is None:
+            raise HTTPError(599, message="Not connected")
+        try:
+            await self._ws.write_message(message)
+        except tornado.websocket.WebSocketClosedError:
+            raise HTTPError(599, message="Connection to {} closed".format(self.url))
+
+    async def _read(self):
+        message = await self._ws.read_message()
+        if message is None:
+            return None
+        return tornado.escape.json_decode(message)
+
+    async def _close(self):
+        if self._ws is not None:
+            self._ws.close()
+            self._ws = None
+
+class IPCConnection(PersistentConnection):
+    """Connection to a node's unix domain socket. The node sends json
+    objects (or arrays for batches) back to back, so they are split by
+    tracking the nesting depth of the data received so far, and each
+    message is only decoded once it's complete"""
+
+    def __init__(self, url, **kwargs):
+        super().__init__(url, **kwargs)
+        if url.startswith("ipc://"):
+            self.path = url[6:]
+        else:
+            self.path = url
+        self._reader_stream = None
+        self._writer_stream = None
+        self._buffer = ""
+        self._scan_pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = None
+        self._messages = []
+
+    async def _open(self):
+        self._reader_stream, self._writer_stream = await asyncio.open_unix_connection(self.path)
+        self._buffer = ""
+        self._scan_pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+
+    async def _write(self, message):
+        if self._writer_stream is None:
+            raise HTTPError(599, message="Not connected")
+        self._writer_stream.write(message.encode('utf-8'))
+        await self._writer_stream.drain()
+
+    def _split_messages(self):
+        """decodes the complete messages in the buffer. The scan position
+        and state are kept between calls, so data is only scanned once"""
+        buf = self._buffer
+        start = 0
+        pos = self._scan_pos
+        depth = self._depth
+        in_string = self._in_string
+        while True:
+            match = _FRAMING_CHARS.search(buf, pos)
+            if match is None:
+                # pos can be past the end if the buffer ended in an escape
+                pos = max(pos, len(buf))
+                break
+            char = match.group()
+            pos = match.end()
+            if in_string:
+                if char == '\\':
+                    pos += 1
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char in '{[':
+                depth += 1
+            elif char in '}]':
+                depth -= 1
+                if depth == 0:
+                    self._messages.append(self._decoder.decode(buf[start:pos]))
+                    start = pos
+        self._buffer = buf[start:]
+        self._scan_pos = pos - start
+        self._depth = depth
+        self._in_string = in_string
+
+    async def _read(self):
+        while not self._messages:
+            data = await self._reader_stream.read(65536)
+            if not data:
+                return None
+            self._buffer += self._text_decoder.decode(data)
+            self._split_messages()
+        return self._messages.pop(0)
+
+    async def _close(self):
+        if self._writer_stream is not None:
+            self._writer_stream.close()
+            self._writer_stream = None
+            self._reader_stream = None
+
+class PersistentClient:
+    """Drop in replacement for the HTTPClients used by JsonRPCClient that
+    keeps a single connection open to each url (per event loop), sending
+    all the requests over it"""
+
+    CONNECTION_CLASS = None
+
+    @classmethod
+    def _async_clients(cls):
+        attr_name = '_async_client_dict_' + cls.__name__
+        if not hasattr(cls, attr_name):
+            setattr(cls, attr_name, weakref.WeakKeyDictionary())
+        return getattr(cls, attr_name)
+
+    def __new__(cls, force_instance=False, **kwargs):
+        loop = asyncio.get_event_loop()
+        if force_instance:
+            instance_cache = None
+        else:
+            instance_cache = cls._async_clients()
+        if instance_cache is not None and loop in instance_cache:
+            return instance_cache[loop]
+        instance = super().__new__(cls)
+        instance._loop = loop
+        instance._instance_cache = instance_cache
+        if instance_cache is not None:
+            instance_cache[instance._loop] = instance
+        instance.initialise(**kwargs)
+        return instance
+
+    def initialise(self, *, max_clients=None, connect_timeout=None, **kwargs):
+        self._connect_timeout = connect_timeout
+        self._connection_kwargs = kwargs
+        self._connections = {}
+
+    def _connection(self, url):
+        connection = self._connections.get(url)
+        if connection is None:
+            connection = self.CONNECTION_CLASS(url, connect_timeout=self._connect_timeout,
+                                               **self._connection_kwargs)
+            self._connections[url] = connection
+        return connection
+
+    async def fetch(self, url, *, method="POST", headers=None, body=None, request_timeout=None):
+        return Response(await self._connection(url).request(body, request_timeout))
+
+    async def subscribe(self, url, params, request_timeout=None):
+        return await self._connection(url).subscribe(params, request_timeout)
+
+    async def close(self):
+        connections, self._connections = self._connections, {}
+        for connection in connections.values():
+            await connection.close()
+        if self._instance_cache is not None:
+            del self._instance_cache[self._loop]
+
+class WebSocketClient(PersistentClient):
+    CONNECTION_CLASS = WebSocketConnection
+
+class IPCClient(PersistentClient):
+    CONNECTION_CLASS = IPCConnection
@@ -17,7 +17,18 @@ def generate_request_signature_data_string(method, path, timestamp, data):
         data = json.dumps(data).encode('utf-8')
 
     if data is not None and data != b"":
-        datahash = base64.b64encode(sha3(data)).decode('utf-8')
+        datahash = sha3(data)
+    else:
+        datahash = None
+
+    return generate_request_signature_data_string_from_hash(method, path, timestamp, datahash)
+
+def generate_request_signature_data_string_from_hash(method, path, timestamp, datahash):
+    """same as `generate_request_signature_data_string` but takes the keccak
+    digest of the body, or None if the body is empty"""
+
+    if datahash is not None:
+        datahash = base64.b64encode(datahash).decode('utf-8')
     else:
         datahash = ""
 
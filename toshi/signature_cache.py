@@ -0,0 +1,95 @@
+import hashlib
+import time
+
+from collections import OrderedDict
+
+def signature_cache_key(method, path, timestamp, body, signature, address):
+    """key identifying a signed request. sha256 is used rather than keccak as
+    it's much faster, and only needs to be unique. The address is used as
+    given, since verification compares it exactly"""
+    h = hashlib.sha256()
+    h.update(signature)
+    h.update(address.encode('utf-8'))
+    h.update("{}\n{}\n{}\n".format(method.upper(), path, timestamp).encode('utf-8'))
+    if body:
+        h.update(body if isinstance(body, bytes) else body.encode('utf-8'))
+    return h.hexdigest()
+
+class SignatureCache:
+    """Bounded in process cache of signed requests that have been verified.
+
+    Entries are only kept until the request's timestamp falls outside of the
+    `expiry` window (by default `TIMESTAMP_EXPIRY`), after which the request
+    would be rejected anyway. If `reject_replays` is True a request that has
+    already been seen is rejected instead of being accepted from the cache"""
+
+    is_async = False
+
+    def __init__(self, max_size=10000, expiry=None, reject_replays=False):
+        if expiry is None:
+            from toshi.handlers import TIMESTAMP_EXPIRY
+            expiry = TIMESTAMP_EXPIRY
+        self.max_size = max_size
+        self.expiry = expiry
+        self.reject_replays = reject_replays
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """returns True if the request has been verified"""
+        expires = self._entries.get(key)
+        if expires is None:
+            return False
+        if expires < time.time():
+            del self._entries[key]
+            return False
+        return True
+
+    def add(self, key, timestamp):
+        """returns False if the request was already in the cache"""
+        added = not self.get(key)
+        self._entries[key] = timestamp + self.expiry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return added
+
+class RedisSignatureCache:
+    """SignatureCache backed by redis, so that it's shared between processes.
+    Uses the global connection from `toshi.redis` if `redis` isn't given"""
+
+    is_async = True
+
+    def __init__(self, redis=None, *, prefix="toshi:verified_signature:", expiry=None, reject_replays=False):
+        if expiry is None:
+            from toshi.handlers import TIMESTAMP_EXPIRY
+            expiry = TIMESTAMP_EXPIRY
+        self._redis = redis
+        self.prefix = prefix
+        self.expiry = expiry
+        self.reject_replays = reject_replays
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            from toshi.redis import get_redis_connection
+            return get_redis_connection()
+        return self._redis
+
+    async def get(self, key):
+        return bool(await self.redis.exists(self.prefix + key))
+
+    async def add(self, key, timestamp):
+        """returns False if the request was already in the cache. When
+        rejecting replays the key is only set if it doesn't exist, so only
+        one of two concurrent identical requests is accepted"""
+        ttl = int(timestamp + self.expiry - time.time())
+        if ttl <= 0:
+            return True
+        redis = self.redis
+        if self.reject_replays:
+            return bool(await redis.set(self.prefix + key, b"1", expire=ttl, exist=redis.SET_IF_NOT_EXIST))
+        await redis.set(self.prefix + key, b"1", expire=ttl)
+        return True
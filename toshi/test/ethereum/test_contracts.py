@@ -5,7 +5,7 @@ from toshi.test.base import AsyncHandlerTest
 from tornado.testing import gen_test
 from testing.common.database import get_path_of
 
-from toshi.ethereum.contract import Contract
+from toshi.ethereum.contract import Contract, get_contract_translator
 
 from toshi.test.ethereum.parity import requires_parity
 from toshi.test.ethereum.faucet import FaucetMixin, FAUCET_PRIVATE_KEY
@@ -240,3 +240,22 @@ class ContractTest(FaucetMixin, AsyncHandlerTest):
             pass
         else:
             self.fail("expected error")
+
+TOKEN_ABI = [
+    {"type": "function", "name": "transfer", "constant": False,
+     "inputs": [{"name": "to", "type": "address"}, {"name": "value", "type": "uint256"}],
+     "outputs": [{"name": "", "type": "bool"}]},
+    {"type": "event", "name": "Transfer", "anonymous": False,
+     "inputs": [{"name": "from", "type": "address", "indexed": True},
+                {"name": "to", "type": "address", "indexed": True},
+                {"name": "value", "type": "uint256", "indexed": False}]}
+]
+
+class ContractTranslatorRegistryTest(unittest.TestCase):
+
+    def test_translators_are_shared(self):
+        a = Contract(abi=TOKEN_ABI, address="0x" + "11" * 20)
+        b = Contract(abi=[dict(part) for part in TOKEN_ABI], address="0x" + "22" * 20)
+        self.assertIs(a.translator, b.translator)
+        self.assertIs(get_contract_translator(TOKEN_ABI), a.translator)
+        self.assertIsNot(get_contract_translator(TOKEN_ABI[:1]), a.translator)
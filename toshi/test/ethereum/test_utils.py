@@ -1,6 +1,12 @@
+import os
 import unittest
 
-from toshi.ethereum.utils import checksum_encode_address, checksum_validate_address
+from ethereum.abi import encode_abi
+from ethereum.utils import sha3
+from toshi.ethereum.utils import (
+    checksum_encode_address, checksum_validate_address, checksum_encode_addresses, validate_addresses,
+    decode_event_data, decode_events_data, EventDecoder, data_decoder, data_encoder, encode_topic,
+    function_selector, keccak_256)
 
 class TestAddressChecksumEncoding(unittest.TestCase):
 
@@ -45,3 +51,67 @@ class TestAddressChecksumEncoding(unittest.TestCase):
         for address in invalid_test_cases:
 
             self.assertFalse(checksum_validate_address(address))
+
+        self.assertEqual(checksum_encode_addresses([a.lower() for a in valid_test_cases]), valid_test_cases)
+        self.assertEqual(checksum_encode_addresses([data_decoder(a) for a in valid_test_cases]), valid_test_cases)
+        self.assertEqual(validate_addresses(valid_test_cases), [True] * len(valid_test_cases))
+        self.assertEqual(validate_addresses(invalid_test_cases + ["0x1234", None, "0x" + "zz" * 20]),
+                         [False] * (len(invalid_test_cases) + 3))
+
+    def test_keccak_256(self):
+
+        data = os.urandom(1000)
+        h = keccak_256()
+        for i in range(0, len(data), 64):
+            h.update(data[i:i + 64])
+        self.assertEqual(h.digest(), sha3(data))
+
+class TestEventDecoding(unittest.TestCase):
+
+    def test_decode_static_events(self):
+        decoder = EventDecoder("Transfer(address indexed from,uint256,int8,bool,bytes4)")
+        # the fast path is used for static types
+        self.assertIsNotNone(decoder._converters)
+        values = [
+            ["0x" + "11" * 20, 2 ** 256 - 1, -5, True, b"\x01\x02\x03\x04"],
+            ["0x" + "00" * 20, 0, 127, False, b"\x00\x00\x00\x00"],
+            ["0x" + "ab" * 20, 12345, -128, True, b"\xff\xff\xff\xff"],
+        ]
+        datas = [encode_abi(['address', 'uint256', 'int8', 'bool', 'bytes4'], v) for v in values]
+        expected = [[v[0], hex(v[1]), hex(v[2]), v[3], data_encoder(v[4])] for v in values]
+        self.assertEqual(decoder.decode_many(datas), expected)
+        self.assertEqual(decoder.decode_many([data_encoder(d) for d in datas]), expected)
+        self.assertEqual(decode_events_data("Transfer(address,uint256,int8,bool,bytes4)", datas), expected)
+        self.assertEqual(decode_event_data("Transfer(address,uint256,int8,bool,bytes4)", datas[1]), expected[1])
+
+    def test_decode_dynamic_events(self):
+        decoder = EventDecoder("Message(uint256,string,uint8[2],bytes)")
+        self.assertIsNone(decoder._converters)
+        data = encode_abi(['uint256', 'string', 'uint8[2]', 'bytes'], [1, b"hello", [3, 4], b"\xaa"])
+        self.assertEqual(decode_event_data("Message(uint256,string,uint8[2],bytes)", data),
+                         ["0x1", b"hello", ["0x3", "0x4"], "0xaa"])
+
+    def test_decode_irregular_data(self):
+        data = encode_abi(['uint256'], [7])
+        # trailing data is ignored, like decode_abi does
+        self.assertEqual(decode_events_data("Value(uint256)", [data, data + b"\x00" * 32]),
+                         [["0x7"], ["0x7"]])
+
+class TestSignatureEncoding(unittest.TestCase):
+
+    def test_function_selector(self):
+        self.assertEqual(function_selector("transfer(address,uint256)"), "0xa9059cbb")
+        self.assertEqual(function_selector("transfer(address to, uint value)"), "0xa9059cbb")
+        self.assertEqual(function_selector("balanceOf(address)"), "0x70a08231")
+        with self.assertRaises(ValueError):
+            function_selector("transfer")
+
+    def test_encode_topic(self):
+        topic = "Transfer(address indexed _from, address indexed _to, uint _value)"
+        self.assertEqual(encode_topic(topic),
+                         ("0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef",
+                          "Transfer(address,address,uint256)"))
+        # results are cached
+        self.assertIs(encode_topic(topic), encode_topic(topic))
+        with self.assertRaises(ValueError):
+            encode_topic("Transfer(uint7)")
@@ -1,5 +1,8 @@
 import unittest
-from toshi.ethereum.utils import ecrecover, data_decoder
+from concurrent.futures import ThreadPoolExecutor
+from tornado.testing import AsyncTestCase, gen_test
+from toshi.ethereum.utils import (
+    ecrecover, data_decoder, ecrecover_many, ecrecover_batch, sign_payload, private_key_to_address)
 
 class TestEcrecover(unittest.TestCase):
     def test_valid_recovery(self):
@@ -28,3 +31,27 @@ class TestEcrecover(unittest.TestCase):
             data_decoder('0x5301'),
             '0x5249dc212cd9c16f107c50b6c893952d617c011e'
         ))
+
+class TestEcrecoverBatch(AsyncTestCase):
+
+    @gen_test
+    async def test_batch_recovery(self):
+        pairs = [
+            ('{"custom":{"about":"about ","location":"location "},"timestamp":1483968938,"username":"Colin"}',
+             '0xbd5c9009cc87c6d4ebb3ef8223fc036726bc311678890890619c787aa914d3b636aee82d885c6fb668233b5cc70ab09eea7051648f989e758ee09234f5340d9100'),
+            ('{"custom":{"about":"æ","location":""},"timestamp":1483964545,"username":"Col"}',
+             '0x5301'),
+            ('{"custom":{"about":"æ","location":""},"timestamp":1483964545,"username":"Col"}',
+             '0xb3c61812e1e73f1a75cc9a2f5e748099378b7af2dd8bc3c1b4f0c067e6e9a4012d0c411b77bab63708b350742d41de574add6b06a3d06a5ae10fc9c63c18405301'),
+        ]
+        expected = ['0x5249dc212cd9c16f107c50b6c893952d617c011e', None, '0x5249dc212cd9c16f107c50b6c893952d617c011e']
+        self.assertEqual(ecrecover_many(pairs), expected)
+        self.assertEqual(await ecrecover_batch(pairs * 10, chunk_size=4), expected * 10)
+        with ThreadPoolExecutor(2) as executor:
+            self.assertEqual(await ecrecover_batch(pairs, executor=executor, chunk_size=1), expected)
+        self.assertEqual(await ecrecover_batch([]), [])
+
+    def test_signed_payload_recovery(self):
+        private_key = "0x0164f7c7399f4bb1eafeaae699ebbb12050bc6a50b2836b9ca766068a9d000c0"
+        signature = sign_payload(private_key, "hello")
+        self.assertEqual(ecrecover_many([("hello", signature)]), [private_key_to_address(private_key)])
@@ -0,0 +1,585 @@
+import asyncio
+import time
+from tornado.testing import AsyncTestCase, gen_test
+
+from toshi.jsonrpc.cache import JsonRPCResponseCache
+from toshi.jsonrpc.client import JsonRPCClient
+from toshi.jsonrpc.errors import JsonRPCError, HTTPError, CircuitOpenError
+from toshi.jsonrpc.retry import RetryPolicy, RetryBudget, CircuitBreaker
+
+class MockResponse:
+    def __init__(self, body):
+        self.status = 200
+        self.body = body
+
+    async def json(self):
+        return self.body
+
+class MockHTTPClient:
+    """Fake http client that answers jsonrpc requests using the `methods`
+    dict, recording each request body sent to it"""
+
+    def __init__(self, **kwargs):
+        self.requests = []
+        self.urls = []
+        self.failing_urls = set()
+        self.methods = {
+            "eth_blockNumber": lambda: "0x10",
+            "eth_getBalance": lambda address, block: "0x" + address[-2:],
+            "eth_getTransactionCount": lambda address, block: "0x1",
+            "eth_sendRawTransaction": lambda tx: "0x" + "00" * 32,
+            "eth_getTransactionReceipt": lambda tx: {"transactionHash": tx, "blockNumber": "0x5"},
+            "eth_getCode": lambda address, block: "0x6060",
+        }
+
+    def _handle(self, request):
+        if request['method'] not in self.methods:
+            return {"jsonrpc": "2.0", "id": request['id'],
+                    "error": {"code": -32601, "message": "Method not found"}}
+        try:
+            result = self.methods[request['method']](*request['params'])
+        except JsonRPCError as e:
+            return {"jsonrpc": "2.0", "id": request['id'],
+                    "error": {"code": e.code, "message": e.message}}
+        return {"jsonrpc": "2.0", "id": request['id'], "result": result}
+
+    async def fetch(self, url, *, method="GET", headers=None, body=None, request_timeout=None):
+        self.requests.append(body)
+        self.urls.append(url)
+        await asyncio.sleep(0)
+        if url in self.failing_urls:
+            raise HTTPError(599)
+        if isinstance(body, list):
+            return MockResponse([self._handle(r) for r in body])
+        return MockResponse(self._handle(body))
+
+    async def close(self):
+        pass
+
+class JsonRPCClientAutoBatchTest(AsyncTestCase):
+
+    @gen_test
+    async def test_auto_batch(self):
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient, auto_batch=True)
+        results = await asyncio.gather(
+            client.eth_blockNumber(),
+            client.eth_getBalance("0x00000000000000000000000000000000000000aa"),
+            client.eth_getTransactionCount("0x00000000000000000000000000000000000000aa"),
+            client.eth_getBalance("0x00000000000000000000000000000000000000bb"))
+        self.assertEqual(results, [16, 0xaa, 1, 0xbb])
+        self.assertEqual(len(client._httpclient.requests), 1)
+        self.assertEqual(len(client._httpclient.requests[0]), 4)
+
+    @gen_test
+    async def test_auto_batch_max_size(self):
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient,
+                               auto_batch=True, auto_batch_max_size=2)
+        results = await asyncio.gather(*[client.eth_blockNumber() for _ in range(5)])
+        self.assertEqual(results, [16] * 5)
+        self.assertEqual([len(r) if isinstance(r, list) else 1 for r in client._httpclient.requests], [2, 2, 1])
+
+    @gen_test
+    async def test_auto_batch_errors(self):
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient, auto_batch=True)
+        f1 = client.eth_blockNumber()
+        f2 = client.eth_gasPrice()
+        self.assertEqual(await f1, 16)
+        with self.assertRaises(JsonRPCError):
+            await f2
+
+    @gen_test
+    async def test_auto_batch_cancelled_future(self):
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient, auto_batch=True)
+        f1 = client.eth_blockNumber()
+        f2 = client.eth_getBalance("0x00000000000000000000000000000000000000aa")
+        f3 = client.eth_gasPrice()
+        f4 = client.eth_getBalance("0x00000000000000000000000000000000000000bb")
+        f2.cancel()
+        f3.cancel()
+        self.assertEqual(await asyncio.wait_for(f1, 1), 16)
+        self.assertEqual(await asyncio.wait_for(f4, 1), 0xbb)
+        self.assertEqual(len(client._httpclient.requests), 1)
+
+class JsonRPCClientSingleFlightTest(AsyncTestCase):
+
+    @gen_test
+    async def test_single_flight(self):
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient, single_flight=True)
+        results = await asyncio.gather(
+            client.eth_getBalance("0x00000000000000000000000000000000000000aa"),
+            client.eth_getBalance("0x00000000000000000000000000000000000000AA"),
+            client.eth_getBalance("0x00000000000000000000000000000000000000aa", block="latest"),
+            client.eth_getBalance("0x00000000000000000000000000000000000000bb"))
+        self.assertEqual(results, [0xaa, 0xaa, 0xaa, 0xbb])
+        self.assertEqual(len(client._httpclient.requests), 2)
+        self.assertEqual(client._in_flight, {})
+
+        # once complete, new calls go to the node again
+        await client.eth_getBalance("0x00000000000000000000000000000000000000aa")
+        self.assertEqual(len(client._httpclient.requests), 3)
+
+    @gen_test
+    async def test_single_flight_ignores_write_methods(self):
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient, single_flight=True)
+        await asyncio.gather(*[client.eth_sendRawTransaction("0x1234") for _ in range(3)])
+        self.assertEqual(len(client._httpclient.requests), 3)
+
+class JsonRPCClientCacheTest(AsyncTestCase):
+
+    @gen_test
+    async def test_immutable_results(self):
+        cache = JsonRPCResponseCache(confirmations=10)
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient, cache=cache)
+        client._httpclient.methods['eth_blockNumber'] = lambda: "0x20"
+        self.assertEqual(await client.eth_blockNumber(), 0x20)
+        self.assertEqual(cache.head, 0x20)
+
+        tx_hash = "0x" + "ab" * 32
+        receipt = await client.eth_getTransactionReceipt(tx_hash)
+        self.assertEqual(await client.eth_getTransactionReceipt(tx_hash), receipt)
+        self.assertEqual(await client.eth_getBalance("0x00000000000000000000000000000000000000aa", block=5), 0xaa)
+        self.assertEqual(await client.eth_getBalance("0x00000000000000000000000000000000000000AA", block=5), 0xaa)
+        # eth_blockNumber + receipt + balance
+        self.assertEqual(len(client._httpclient.requests), 3)
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(cache.misses, 2)
+
+        # immutable results survive new blocks
+        client._httpclient.methods['eth_blockNumber'] = lambda: "0x21"
+        await client.eth_blockNumber()
+        await client.eth_getTransactionReceipt(tx_hash)
+        self.assertEqual(len(client._httpclient.requests), 4)
+
+    @gen_test
+    async def test_latest_results(self):
+        cache = JsonRPCResponseCache()
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient, cache=cache)
+        address = "0x00000000000000000000000000000000000000aa"
+        await client.eth_blockNumber()
+        await client.eth_getBalance(address)
+        await client.eth_getBalance(address)
+        self.assertEqual(len(client._httpclient.requests), 2)
+
+        # same block number doesn't invalidate the cache
+        await client.eth_blockNumber()
+        await client.eth_getBalance(address)
+        self.assertEqual(len(client._httpclient.requests), 3)
+
+        # new block invalidates the cache
+        client._httpclient.methods['eth_blockNumber'] = lambda: "0x11"
+        await client.eth_blockNumber()
+        await client.eth_getBalance(address)
+        self.assertEqual(len(client._httpclient.requests), 5)
+
+        # pending results are never cached
+        await client.eth_getBalance(address, block="pending")
+        await client.eth_getBalance(address, block="pending")
+        self.assertEqual(len(client._httpclient.requests), 7)
+
+    def test_results_are_copied(self):
+        cache = JsonRPCResponseCache(confirmations=10)
+        cache.set_head(0x20)
+        tx_hash = "0x" + "ab" * 32
+        receipt = {"transactionHash": tx_hash, "blockNumber": "0x5", "logs": [{"logIndex": "0x0"}]}
+        cache.put("eth_getTransactionReceipt", [tx_hash], receipt)
+        receipt['logs'].append({"logIndex": "0x1"})
+
+        found, cached = cache.get("eth_getTransactionReceipt", [tx_hash])
+        self.assertTrue(found)
+        self.assertEqual(len(cached['logs']), 1)
+        cached['logs'][0]['logIndex'] = "0x2"
+        cached['blockNumber'] = None
+        self.assertEqual(cache.get("eth_getTransactionReceipt", [tx_hash]),
+                         (True, {"transactionHash": tx_hash, "blockNumber": "0x5", "logs": [{"logIndex": "0x0"}]}))
+
+    def test_code_results(self):
+        cache = JsonRPCResponseCache(confirmations=10)
+        address = "0x00000000000000000000000000000000000000aa"
+        cache.set_head(0x20)
+        cache.put("eth_getCode", [address, "latest"], "0x60")
+        cache.put("eth_getCode", [address, "0x16"], "0x60")
+        cache.put("eth_getCode", [address, "0x17"], "0x60")
+        self.assertEqual(cache.get("eth_getCode", [address, "latest"]), (True, "0x60"))
+
+        # code can change (e.g. after a selfdestruct), so only the results
+        # for confirmed blocks survive new blocks
+        cache.set_head(0x21)
+        self.assertEqual(cache.get("eth_getCode", [address, "latest"]), (False, None))
+        self.assertEqual(cache.get("eth_getCode", [address, "0x16"]), (True, "0x60"))
+        self.assertEqual(cache.get("eth_getCode", [address, "0x17"]), (False, None))
+
+    def test_lru_eviction(self):
+        cache = JsonRPCResponseCache(max_size=2, confirmations=10)
+        cache.set_head(0x20)
+        for i in range(3):
+            cache.put("eth_getCode", ["0x{:040x}".format(i), "0x10"], "0x60")
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("eth_getCode", ["0x{:040x}".format(0), "0x10"]), (False, None))
+        self.assertEqual(cache.get("eth_getCode", ["0x{:040x}".format(2), "0x10"]), (True, "0x60"))
+
+class JsonRPCClientEndpointsTest(AsyncTestCase):
+
+    @gen_test
+    async def test_load_balancing(self):
+        client = JsonRPCClient(["http://node1", "http://node2"], client_cls=MockHTTPClient)
+        await asyncio.gather(*[client.eth_getTransactionCount("0x00000000000000000000000000000000000000aa")
+                               for _ in range(10)])
+        self.assertEqual(client._httpclient.urls.count("http://node1"), 5)
+        self.assertEqual(client._httpclient.urls.count("http://node2"), 5)
+
+    @gen_test
+    async def test_failover(self):
+        client = JsonRPCClient(["http://node1", "http://node2"], client_cls=MockHTTPClient, eject_time=60,
+                               retry_policy=RetryPolicy())
+        client._httpclient.failing_urls.add("http://node1")
+        for _ in range(20):
+            self.assertEqual(await client.eth_blockNumber(), 16)
+        # node1 should only have been tried once before being ejected
+        self.assertLessEqual(client._httpclient.urls.count("http://node1"), 1)
+        self.assertFalse(client._endpoints.endpoints[0].healthy)
+        self.assertTrue(client._endpoints.endpoints[1].healthy)
+
+    @gen_test
+    async def test_lagging_node_ejected_and_readmitted(self):
+        client = JsonRPCClient(["http://node1", "http://node2"], client_cls=MockHTTPClient,
+                               eject_time=0, max_block_lag=2)
+        node1, node2 = client._endpoints.endpoints
+        client._endpoints.update_block_number(node1, 100)
+        client._endpoints.update_block_number(node2, 90)
+        self.assertTrue(node1.healthy)
+        self.assertFalse(node2.healthy)
+
+        # the probe returns a block number close to the head so the node is re-admitted
+        client._httpclient.methods['eth_blockNumber'] = lambda: hex(99)
+        self.assertIs(client._endpoints.select(), node1)
+        await asyncio.sleep(0.01)
+        self.assertTrue(node2.healthy)
+        self.assertEqual(node2.block_number, 99)
+
+    @gen_test
+    async def test_unknown_block_number_tries_other_node(self):
+        client = JsonRPCClient(["http://node1", "http://node2"], client_cls=MockHTTPClient)
+        mock = client._httpclient
+        handle = mock._handle
+
+        def handle_unknown_block(request):
+            if mock.urls[-1] == "http://node1":
+                return {"jsonrpc": "2.0", "id": request['id'],
+                        "error": {"code": -32000, "message": "Unknown block number"}}
+            return handle(request)
+        mock._handle = handle_unknown_block
+        for _ in range(4):
+            self.assertEqual(await client.eth_getBalance("0x00000000000000000000000000000000000000aa", block=10), 0xaa)
+
+class JsonRPCClientBulkTest(AsyncTestCase):
+
+    @gen_test
+    async def test_request_ids(self):
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient)
+        await client.eth_blockNumber()
+        await client.eth_blockNumber()
+        self.assertEqual([r['id'] for r in client._httpclient.requests], [0, 1])
+
+        bulk = client.bulk()
+        for _ in range(3):
+            bulk.eth_blockNumber()
+        await bulk.execute()
+        self.assertEqual([r['id'] for r in bulk._httpclient.requests[-1]], [0, 1, 2])
+
+    @gen_test
+    async def test_bulk_results_in_request_order(self):
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient)
+        bulk = client.bulk()
+        mock = bulk._httpclient
+        fetch = mock.fetch
+
+        async def reversed_fetch(url, **kwargs):
+            resp = await fetch(url, **kwargs)
+            resp.body.reverse()
+            return resp
+        mock.fetch = reversed_fetch
+
+        f1 = bulk.eth_blockNumber()
+        f2 = bulk.eth_getBalance("0x00000000000000000000000000000000000000aa")
+        f3 = bulk.eth_gasPrice()
+        results = await bulk.execute()
+        self.assertEqual(results, [16, 0xaa, None])
+        self.assertEqual(f1.result(), 16)
+        self.assertEqual(f2.result(), 0xaa)
+        self.assertIsInstance(f3.exception(), JsonRPCError)
+
+    @gen_test
+    async def test_bulk_missing_and_duplicate_results(self):
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient)
+        bulk = client.bulk()
+        mock = bulk._httpclient
+        fetch = mock.fetch
+
+        async def broken_fetch(url, **kwargs):
+            resp = await fetch(url, **kwargs)
+            # drop the last result, and duplicate the first with a different value
+            resp.body = resp.body[:-1] + [dict(resp.body[0], result="0x1"), {"jsonrpc": "2.0", "id": 99, "result": "0x0"}]
+            return resp
+        mock.fetch = broken_fetch
+
+        f1 = bulk.eth_blockNumber()
+        f2 = bulk.eth_blockNumber()
+        results = await bulk.execute()
+        self.assertEqual(results, [16, None])
+        self.assertEqual(f1.result(), 16)
+        self.assertIsNotNone(f2.exception())
+
+    @gen_test
+    async def test_bulk_cancelled_futures(self):
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient)
+        bulk = client.bulk()
+        mock = bulk._httpclient
+        fetch = mock.fetch
+
+        async def truncated_fetch(url, **kwargs):
+            resp = await fetch(url, **kwargs)
+            # drop the last two results
+            resp.body = resp.body[:-2]
+            return resp
+        mock.fetch = truncated_fetch
+
+        futures = [bulk.eth_blockNumber(), bulk.eth_gasPrice(), bulk.eth_blockNumber(),
+                   bulk.eth_blockNumber(), bulk.eth_blockNumber()]
+        # a result, an error and a missing result for cancelled futures
+        for idx in (0, 1, 3):
+            futures[idx].cancel()
+        results = await bulk.execute()
+        self.assertEqual(results, [16, None, 16, None, None])
+        self.assertEqual(futures[2].result(), 16)
+        self.assertIsNotNone(futures[4].exception())
+
+    @gen_test
+    async def test_chunked_bulk(self):
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient)
+        bulk = client.bulk(chunk_size=3, parallelism=2)
+        futures = [bulk.eth_getBalance("0x{:040x}".format(i)) for i in range(10)]
+        results = await bulk.execute()
+        self.assertEqual(results, list(range(10)))
+        self.assertEqual([f.result() for f in futures], list(range(10)))
+        self.assertEqual([len(r) for r in bulk._httpclient.requests], [3, 3, 3, 1])
+        self.assertEqual([r[0]['id'] for r in bulk._httpclient.requests], [0, 3, 6, 9])
+
+    @gen_test
+    async def test_chunked_bulk_only_retries_failed_chunk(self):
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient)
+        bulk = client.bulk(chunk_size=2)
+        mock = bulk._httpclient
+        fetch = mock.fetch
+        failures = []
+
+        async def flaky_fetch(url, *, body, **kwargs):
+            if body[0]['id'] == 2 and not failures:
+                failures.append(body)
+                raise HTTPError(502)
+            return await fetch(url, body=body, **kwargs)
+        mock.fetch = flaky_fetch
+
+        for i in range(6):
+            bulk.eth_getBalance("0x{:040x}".format(i))
+        self.assertEqual(await bulk.execute(), list(range(6)))
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(sorted(r[0]['id'] for r in mock.requests), [0, 2, 4])
+
+    @gen_test
+    async def test_execute_iter(self):
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient)
+        bulk = client.bulk(chunk_size=4)
+        for i in range(10):
+            bulk.eth_getBalance("0x{:040x}".format(i))
+        chunks = []
+        async for offset, results in bulk.execute_iter():
+            chunks.append((offset, results))
+        self.assertEqual(sorted(chunks), [(0, [0, 1, 2, 3]), (4, [4, 5, 6, 7]), (8, [8, 9])])
+
+class JsonRPCClientRetryTest(AsyncTestCase):
+
+    def test_backoff(self):
+        policy = RetryPolicy(base_delay=0.1, max_delay=1.0, jitter=False)
+        self.assertEqual([policy.backoff(i) for i in range(6)], [0.1, 0.2, 0.4, 0.8, 1.0, 1.0])
+        policy = RetryPolicy(base_delay=0.1, max_delay=1.0)
+        for i in range(10):
+            self.assertTrue(0 <= policy.backoff(i) <= 1.0)
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        # reset timeout of 0 lets a trial through straight away
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    @gen_test
+    async def test_retry_until_success(self):
+        policy = RetryPolicy(base_delay=0.001)
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient, retry_policy=policy)
+        mock = client._httpclient
+        fetch = mock.fetch
+        failures = []
+
+        async def flaky_fetch(url, **kwargs):
+            if len(failures) < 3:
+                failures.append(url)
+                raise HTTPError(502)
+            return await fetch(url, **kwargs)
+        mock.fetch = flaky_fetch
+        self.assertEqual(await client.eth_blockNumber(), 16)
+        self.assertEqual(len(failures), 3)
+
+    @gen_test
+    async def test_retry_budget(self):
+        policy = RetryPolicy(base_delay=0.001, budget=RetryBudget(rate=0.0, capacity=2))
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient, retry_policy=policy)
+        client._httpclient.failing_urls.add("http://localhost")
+        with self.assertRaises(HTTPError):
+            await client.eth_blockNumber()
+        # the first attempt plus the two retries from the budget
+        self.assertEqual(len(client._httpclient.requests), 3)
+
+    @gen_test
+    async def test_circuit_breaker_fails_fast(self):
+        policy = RetryPolicy(base_delay=0.001, failure_threshold=3, reset_timeout=60)
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient, retry_policy=policy)
+        client._httpclient.failing_urls.add("http://localhost")
+        with self.assertRaises(HTTPError):
+            await client.eth_blockNumber()
+        self.assertEqual(len(client._httpclient.requests), 3)
+        # other clients using the same policy don't send anything
+        client2 = JsonRPCClient("http://localhost", client_cls=MockHTTPClient, retry_policy=policy)
+        with self.assertRaises(CircuitOpenError):
+            await client2.eth_blockNumber()
+        self.assertEqual(len(client2._httpclient.requests), 0)
+
+    @gen_test
+    async def test_half_open_circuits_give_up(self):
+        policy = RetryPolicy(base_delay=0.001, reset_timeout=60)
+        breaker = policy.circuit_breaker("http://localhost")
+        # a trial request from another client is in flight
+        breaker.state = CircuitBreaker.HALF_OPEN
+        breaker.opened_at = time.time()
+
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient, retry_policy=policy,
+                               request_timeout=0.1)
+        with self.assertRaises(HTTPError):
+            await asyncio.wait_for(client.eth_blockNumber(), 5)
+        self.assertEqual(len(client._httpclient.requests), 0)
+
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient, retry_policy=policy,
+                               should_retry=False)
+        with self.assertRaises(CircuitOpenError):
+            await client.eth_blockNumber()
+
+    @gen_test
+    async def test_non_http_errors_are_failures(self):
+        policy = RetryPolicy(base_delay=0.001)
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient, retry_policy=policy,
+                               should_retry=False)
+
+        async def broken_fetch(url, **kwargs):
+            raise ConnectionResetError()
+        client._httpclient.fetch = broken_fetch
+        with self.assertRaises(ConnectionResetError):
+            await client.eth_blockNumber()
+        self.assertEqual(policy.circuit_breaker("http://localhost").failures, 1)
+
+class JsonRPCClientLogScannerTest(AsyncTestCase):
+
+    def get_client(self, max_results=None):
+        client = JsonRPCClient("http://localhost", client_cls=MockHTTPClient,
+                               retry_policy=RetryPolicy(base_delay=0.001))
+        mock = client._httpclient
+        mock.ranges = []
+
+        def eth_getLogs(kwargs):
+            start, end = int(kwargs['fromBlock'], 16), int(kwargs['toBlock'], 16)
+            mock.ranges.append((start, end))
+            # two logs in every even block
+            logs = [{"blockNumber": hex(b), "logIndex": hex(i)}
+                    for b in range(start, end + 1) if b % 2 == 0 for i in range(2)]
+            if max_results is not None and len(logs) > max_results:
+                raise JsonRPCError(None, -32005, "query returned more than {} results".format(max_results), None)
+            return logs
+        mock.methods['eth_getLogs'] = eth_getLogs
+        mock.methods['eth_blockNumber'] = lambda: hex(1000)
+        return client
+
+    def expected_logs(self, start, end):
+        return [(b, i) for b in range(start, end + 1) if b % 2 == 0 for i in range(2)]
+
+    def log_keys(self, logs):
+        return [(int(log['blockNumber'], 16), int(log['logIndex'], 16)) for log in logs]
+
+    @gen_test
+    async def test_scan_in_order(self):
+        client = self.get_client()
+        logs = []
+        async for log in client.scan_logs(0, 999, initial_range=10, parallelism=4):
+            logs.append(log)
+        self.assertEqual(self.log_keys(logs), self.expected_logs(0, 999))
+        # the range size grows when there are few logs per range
+        self.assertLess(len(client._httpclient.ranges), 100)
+        # the block number is only checked once
+        self.assertEqual(sum(1 for r in client._httpclient.requests
+                             if not isinstance(r, list) and r['method'] == "eth_blockNumber"), 1)
+
+    @gen_test
+    async def test_slow_range_limits_buffering(self):
+        client = self.get_client()
+        mock = client._httpclient
+        fetch = mock.fetch
+
+        async def slow_fetch(url, *, body, **kwargs):
+            if body['method'] == "eth_getLogs" and body['params'][0]['fromBlock'] == hex(0):
+                await asyncio.sleep(0.05)
+            return await fetch(url, body=body, **kwargs)
+        mock.fetch = slow_fetch
+
+        requested = None
+        logs = []
+        async for log in client.scan_logs(0, 999, initial_range=10, parallelism=4):
+            if requested is None:
+                requested = len(mock.ranges)
+            logs.append(log)
+        # only `parallelism` ranges are fetched while the first is outstanding
+        self.assertEqual(requested, 4)
+        self.assertEqual(self.log_keys(logs), self.expected_logs(0, 999))
+
+    @gen_test
+    async def test_scan_to_head(self):
+        client = self.get_client()
+        scanner = client.scan_logs(900)
+        logs = [log async for log in scanner]
+        self.assertEqual(scanner.head, 1000)
+        self.assertEqual(self.log_keys(logs), self.expected_logs(900, 1000))
+
+        scanner = client.scan_logs(950, "latest")
+        logs = [log async for log in scanner]
+        self.assertEqual(self.log_keys(logs), self.expected_logs(950, 1000))
+
+    @gen_test
+    async def test_split_on_error(self):
+        client = self.get_client(max_results=20)
+        scanner = client.scan_logs(0, 199, initial_range=100, target_logs=10)
+        ranges = [(start, end) async for start, end, logs in scanner.ranges()]
+        # the ranges are contiguous and cover the whole range
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], 199)
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(start, end + 1)
+        logs = [log async for log in client.scan_logs(0, 199, initial_range=100, target_logs=10)]
+        self.assertEqual(self.log_keys(logs), self.expected_logs(0, 199))
+
+    @gen_test
+    async def test_unknown_block_number(self):
+        client = self.get_client()
+        with self.assertRaises(JsonRPCError):
+            async for log in client.scan_logs(0, 2000, head_timeout=0.01):
+                pass
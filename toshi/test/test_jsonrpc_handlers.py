@@ -0,0 +1,128 @@
+import asyncio
+from tornado.testing import AsyncTestCase, gen_test
+
+from toshi.jsonrpc.handlers import JsonRPCBase, map_jsonrpc_arguments
+
+class SlowJsonRPC(JsonRPCBase):
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+
+    async def wait(self, delay):
+        self.active += 1
+        self.max_active = max(self.active, self.max_active)
+        await asyncio.sleep(delay)
+        self.active -= 1
+        return delay
+
+class DispatchJsonRPC(JsonRPCBase):
+
+    def add(self, a, b=1):
+        return a + b
+
+    async def async_add(self, a, b=1):
+        return a + b
+
+    @map_jsonrpc_arguments({'from': 'from_address'})
+    def mapped(self, from_address):
+        return from_address
+
+    @staticmethod
+    def static():
+        return "static"
+
+    def broken(self):
+        return len(None)
+
+    def _private(self):
+        return "private"
+
+class JsonRPCBatchTest(AsyncTestCase):
+
+    def batch(self, delays):
+        return [{"jsonrpc": "2.0", "id": i, "method": "wait", "params": [delay]}
+                for i, delay in enumerate(delays)]
+
+    @gen_test
+    async def test_sequential_batch(self):
+        rpc = SlowJsonRPC()
+        resp = await rpc(self.batch([0.02, 0.01, 0.0]))
+        self.assertEqual([r['id'] for r in resp], [0, 1, 2])
+        self.assertEqual([r['result'] for r in resp], [0.02, 0.01, 0.0])
+        self.assertEqual(rpc.max_active, 1)
+
+    @gen_test
+    async def test_concurrent_batch(self):
+        rpc = SlowJsonRPC()
+        rpc.batch_concurrency = 3
+        requests = self.batch([0.05, 0.04, 0.03, 0.02, 0.01, 0.0])
+        # notifications should still be dropped from the response
+        del requests[2]['id']
+        resp = await rpc(requests)
+        self.assertEqual([r['id'] for r in resp], [0, 1, 3, 4, 5])
+        self.assertEqual([r['result'] for r in resp], [0.05, 0.04, 0.02, 0.01, 0.0])
+        self.assertEqual(rpc.max_active, 3)
+
+    @gen_test
+    async def test_unlimited_concurrent_batch(self):
+        rpc = SlowJsonRPC()
+        rpc.batch_concurrency = None
+        resp = await rpc(self.batch([0.01] * 10))
+        self.assertEqual(len(resp), 10)
+        self.assertEqual(rpc.max_active, 10)
+
+    @gen_test
+    async def test_concurrent_batch_all_notifications(self):
+        rpc = SlowJsonRPC()
+        rpc.batch_concurrency = 2
+        requests = self.batch([0.0, 0.0])
+        for r in requests:
+            del r['id']
+        self.assertIsNone(await rpc(requests))
+
+class JsonRPCDispatchTest(AsyncTestCase):
+
+    def call(self, rpc, method, params=None):
+        request = {"jsonrpc": "2.0", "id": 1, "method": method}
+        if params is not None:
+            request['params'] = params
+        return rpc(request)
+
+    @gen_test
+    async def test_dispatch(self):
+        rpc = DispatchJsonRPC()
+        self.assertEqual((await self.call(rpc, 'add', [1, 2]))['result'], 3)
+        self.assertEqual((await self.call(rpc, 'add', {'a': 1}))['result'], 2)
+        self.assertEqual((await self.call(rpc, 'async_add', [2]))['result'], 3)
+        self.assertEqual((await self.call(rpc, 'mapped', {'from': '0x1'}))['result'], '0x1')
+        self.assertEqual((await self.call(rpc, 'static'))['result'], 'static')
+
+    @gen_test
+    async def test_dispatch_table_is_per_class(self):
+
+        class SubJsonRPC(DispatchJsonRPC):
+            def sub(self):
+                return "sub"
+
+        await self.call(DispatchJsonRPC(), 'add', [1])
+        self.assertEqual((await self.call(SubJsonRPC(), 'sub'))['result'], 'sub')
+        self.assertEqual((await self.call(DispatchJsonRPC(), 'sub'))['error']['code'], -32601)
+
+    @gen_test
+    async def test_method_not_found(self):
+        rpc = DispatchJsonRPC()
+        self.assertEqual((await self.call(rpc, 'missing'))['error']['code'], -32601)
+        self.assertEqual((await self.call(rpc, '_private'))['error']['code'], -32601)
+
+    @gen_test
+    async def test_bad_params(self):
+        rpc = DispatchJsonRPC()
+        self.assertEqual((await self.call(rpc, 'add'))['error']['code'], -32602)
+        self.assertEqual((await self.call(rpc, 'add', [1, 2, 3]))['error']['code'], -32602)
+        self.assertEqual((await self.call(rpc, 'async_add', {'c': 1}))['error']['code'], -32602)
+
+    @gen_test
+    async def test_type_error_in_method_is_internal_error(self):
+        rpc = DispatchJsonRPC()
+        self.assertEqual((await self.call(rpc, 'broken'))['error']['code'], -32603)
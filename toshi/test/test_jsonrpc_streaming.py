@@ -0,0 +1,153 @@
+import json
+import tornado.web
+
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from unittest import TestCase
+
+from toshi.jsonrpc.client import JsonRPCClient
+from toshi.jsonrpc.errors import HTTPError, JsonRPCError
+from toshi.jsonrpc.retry import RetryPolicy
+from toshi.jsonrpc.streaming import JsonRPCStreamParser
+from toshi.jsonrpc.tornado_client import HTTPClient as TornadoHTTPClient
+
+LOGS = [{"blockNumber": hex(i), "data": "0x" + "ab" * 64, "topics": ["0x" + "00" * 32], "logIndex": i}
+        for i in range(50)]
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+class JsonRPCStreamParserTest(TestCase):
+
+    def parse(self, data, size):
+        parser = JsonRPCStreamParser()
+        items = []
+        for chunk in chunked(data, size):
+            items.extend(parser.feed(chunk))
+        items.extend(parser.close())
+        return parser, items
+
+    def test_parse_chunks(self):
+        data = json.dumps({"jsonrpc": "2.0", "id": 1234567, "result": LOGS}).encode('utf-8')
+        for size in [1, 7, 100, len(data)]:
+            parser, items = self.parse(data, size)
+            self.assertEqual(items, LOGS)
+            self.assertEqual(parser.fields, {"jsonrpc": "2.0", "id": 1234567})
+
+    def test_numbers_split_between_chunks(self):
+        data = json.dumps({"id": 1234, "result": [1234, 5678, 9.5]}).encode('utf-8')
+        parser, items = self.parse(data, 3)
+        self.assertEqual(items, [1234, 5678, 9.5])
+        self.assertEqual(parser.fields['id'], 1234)
+
+    def test_multibyte_characters(self):
+        data = json.dumps({"id": 1, "result": ["é中", "\U0001f600"]}, ensure_ascii=False).encode('utf-8')
+        parser, items = self.parse(data, 1)
+        self.assertEqual(items, ["é中", "\U0001f600"])
+
+    def test_error_and_non_array_results(self):
+        parser, items = self.parse(b'{"id": 1, "error": {"code": -32000, "message": "oops"}}', 5)
+        self.assertEqual(items, [])
+        self.assertEqual(parser.fields['error']['code'], -32000)
+        parser, items = self.parse(b'{"id": 1, "result": null}', 5)
+        self.assertEqual(items, [])
+        self.assertIsNone(parser.fields['result'])
+
+    def test_incomplete_response(self):
+        parser = JsonRPCStreamParser()
+        parser.feed(b'{"id": 1, "result": [{"a": 1}, {"b"')
+        with self.assertRaises(ValueError):
+            parser.close()
+
+class StreamingJsonRPCHandler(tornado.web.RequestHandler):
+
+    def post(self):
+        data = json.loads(self.request.body.decode('utf-8'))
+        self.application.requests.append(data)
+        if self.application.fail:
+            self.application.fail -= 1
+            self.set_status(502)
+            self.write("bad gateway")
+            return
+        if data['params'][0].get('address') == "0x0000000000000000000000000000000000000001":
+            self.write({"jsonrpc": "2.0", "id": data['id'], "error": {"code": -32005, "message": "too many"}})
+            return
+        body = json.dumps({"jsonrpc": "2.0", "id": data['id'] + self.application.id_offset, "result": LOGS})
+        for chunk in chunked(body, 100):
+            self.write(chunk)
+            self.flush()
+
+class JsonRPCStreamingTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        app = tornado.web.Application([("/", StreamingJsonRPCHandler)])
+        app.requests = []
+        app.fail = 0
+        app.id_offset = 0
+        return app
+
+    def get_client(self, client_cls):
+        return JsonRPCClient(self.get_url("/"), client_cls=client_cls,
+                             retry_policy=RetryPolicy(base_delay=0.001))
+
+    async def check_stream(self, client):
+        logs = []
+        async for log in client.eth_getLogs_iter(fromBlock=0, toBlock=100):
+            logs.append(log)
+        self.assertEqual(logs, LOGS)
+        self.assertEqual(self._app.requests[-1]['method'], "eth_getLogs")
+
+    @gen_test
+    async def test_tornado_stream(self):
+        client = self.get_client(TornadoHTTPClient)
+        await self.check_stream(client)
+
+    @gen_test
+    async def test_aiohttp_stream(self):
+        client = self.get_client(None)
+        await self.check_stream(client)
+        await client.close()
+
+    @gen_test
+    async def test_retry_before_first_result(self):
+        self._app.fail = 2
+        client = self.get_client(TornadoHTTPClient)
+        await self.check_stream(client)
+        self.assertEqual(len(self._app.requests), 3)
+
+    @gen_test
+    async def test_jsonrpc_error(self):
+        client = self.get_client(TornadoHTTPClient)
+        with self.assertRaises(JsonRPCError):
+            async for log in client.eth_getLogs_iter(address="0x0000000000000000000000000000000000000001"):
+                pass
+
+    @gen_test
+    async def test_http_error(self):
+        self._app.fail = 10
+        client = JsonRPCClient(self.get_url("/"), client_cls=TornadoHTTPClient, should_retry=False)
+        with self.assertRaises(HTTPError):
+            async for log in client.eth_getLogs_iter():
+                pass
+
+    @gen_test
+    async def test_mismatched_id(self):
+        self._app.id_offset = 1
+        client = self.get_client(TornadoHTTPClient)
+        with self.assertRaises(JsonRPCError):
+            async for log in client.eth_getLogs_iter():
+                self.fail("logs from a response to a different request were yielded")
+
+    @gen_test
+    async def test_bulk_mode(self):
+        client = self.get_client(TornadoHTTPClient).bulk()
+        with self.assertRaises(ValueError):
+            async for log in client.eth_getLogs_iter():
+                pass
+
+    @gen_test
+    async def test_stop_early(self):
+        client = TornadoHTTPClient()
+        body = {"jsonrpc": "2.0", "id": 1, "method": "eth_getLogs", "params": [{}]}
+        stream = client.stream(self.get_url("/"), method="POST", body=body)
+        self.assertTrue(await stream.__anext__())
+        await stream.aclose()
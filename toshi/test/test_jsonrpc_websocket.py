@@ -0,0 +1,166 @@
+import asyncio
+import json
+import os
+import tempfile
+import tornado.web
+import tornado.websocket
+
+from tornado.testing import AsyncHTTPTestCase, AsyncTestCase, gen_test
+
+from toshi.jsonrpc.client import JsonRPCClient
+from toshi.jsonrpc.websocket_client import WebSocketClient, IPCClient, IPCConnection
+
+def handle_jsonrpc(request):
+    if request['method'] == "eth_blockNumber":
+        return {"jsonrpc": "2.0", "id": request['id'], "result": "0x10"}
+    if request['method'] == "eth_getBalance":
+        return {"jsonrpc": "2.0", "id": request['id'], "result": "0x" + request['params'][0][-2:]}
+    if request['method'] == "eth_subscribe":
+        return {"jsonrpc": "2.0", "id": request['id'], "result": "0xabc"}
+    if request['method'] == "eth_unsubscribe":
+        return {"jsonrpc": "2.0", "id": request['id'], "result": True}
+    return {"jsonrpc": "2.0", "id": request['id'], "error": {"code": -32601, "message": "Method not found"}}
+
+def notifications(count):
+    return [{"jsonrpc": "2.0", "method": "eth_subscription",
+             "params": {"subscription": "0xabc", "result": {"number": hex(i)}}}
+            for i in range(count)]
+
+class JsonRPCWebSocketHandler(tornado.websocket.WebSocketHandler):
+
+    def on_message(self, message):
+        data = json.loads(message)
+        self.application.received.append(data)
+        if isinstance(data, list):
+            self.write_message(json.dumps([handle_jsonrpc(r) for r in data]))
+        else:
+            self.write_message(json.dumps(handle_jsonrpc(data)))
+            if data['method'] == "eth_subscribe":
+                # sent straight after the response to make sure none are lost
+                for notification in notifications(3):
+                    self.write_message(json.dumps(notification))
+
+class JsonRPCWebSocketTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        app = tornado.web.Application([("/", JsonRPCWebSocketHandler)])
+        app.received = []
+        return app
+
+    def get_client(self, **kwargs):
+        return JsonRPCClient("ws://127.0.0.1:{}/".format(self.get_http_port()), **kwargs)
+
+    @gen_test
+    async def test_multiplexed_requests(self):
+        client = self.get_client()
+        self.assertIsInstance(client._httpclient, WebSocketClient)
+        results = await asyncio.gather(
+            client.eth_blockNumber(),
+            client.eth_getBalance("0x00000000000000000000000000000000000000aa"),
+            client.eth_getBalance("0x00000000000000000000000000000000000000bb"))
+        self.assertEqual(results, [16, 0xaa, 0xbb])
+        # ids are unique on the connection
+        ids = [r['id'] for r in self._app.received]
+        self.assertEqual(len(set(ids)), 3)
+        self.assertEqual(len(client._httpclient._connections), 1)
+        await client.close()
+
+    @gen_test
+    async def test_bulk(self):
+        client = self.get_client()
+        bulk = client.bulk()
+        f1 = bulk.eth_blockNumber()
+        f2 = bulk.eth_getBalance("0x00000000000000000000000000000000000000cc")
+        await bulk.execute()
+        self.assertEqual(f1.result(), 16)
+        self.assertEqual(f2.result(), 0xcc)
+        # bulk clients share the connection
+        self.assertIs(bulk._httpclient, client._httpclient)
+        await client.close()
+
+    @gen_test
+    async def test_subscribe(self):
+        client = self.get_client()
+        subscription = await client.subscribe_new_heads()
+        self.assertEqual(subscription.id, "0xabc")
+        heads = []
+        async for head in subscription:
+            heads.append(head['number'])
+            if len(heads) == 3:
+                await subscription.unsubscribe()
+        self.assertEqual(heads, ["0x0", "0x1", "0x2"])
+        self.assertEqual(self._app.received[-1]['method'], "eth_unsubscribe")
+        self.assertEqual(self._app.received[-1]['params'], ["0xabc"])
+        await client.close()
+
+    @gen_test
+    async def test_subscribe_requires_persistent_connection(self):
+        client = JsonRPCClient("http://127.0.0.1:{}/".format(self.get_http_port()))
+        with self.assertRaises(TypeError):
+            await client.subscribe_new_heads()
+        await client.close()
+
+class JsonRPCIPCTest(AsyncTestCase):
+
+    @gen_test
+    async def test_ipc(self):
+        received = []
+
+        async def handle(reader, writer):
+            decoder = json.JSONDecoder()
+            buf = ""
+            while True:
+                data = await reader.read(1024)
+                if not data:
+                    break
+                buf += data.decode('utf-8')
+                while buf:
+                    try:
+                        request, end = decoder.raw_decode(buf)
+                    except ValueError:
+                        break
+                    buf = buf[end:]
+                    received.append(request)
+                    response = json.dumps(handle_jsonrpc(request))
+                    if request['method'] == "eth_subscribe":
+                        response += "".join(json.dumps(n) for n in notifications(2))
+                    # split the messages to test incremental decoding
+                    mid = len(response) // 2
+                    writer.write(response[:mid].encode('utf-8'))
+                    await writer.drain()
+                    await asyncio.sleep(0.01)
+                    writer.write(response[mid:].encode('utf-8'))
+                    await writer.drain()
+            writer.close()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "geth.ipc")
+            server = await asyncio.start_unix_server(handle, path)
+            try:
+                client = JsonRPCClient(path)
+                self.assertIsInstance(client._httpclient, IPCClient)
+                results = await asyncio.gather(client.eth_blockNumber(), client.eth_blockNumber())
+                self.assertEqual(results, [16, 16])
+                subscription = await client.subscribe_new_heads()
+                heads = []
+                async for head in subscription:
+                    heads.append(head['number'])
+                    if len(heads) == 2:
+                        await subscription.unsubscribe()
+                self.assertEqual(heads, ["0x0", "0x1"])
+                await client.close()
+            finally:
+                server.close()
+                await server.wait_closed()
+
+    def test_split_messages(self):
+        messages = [{"id": 1, "result": "}{ [\\\" ]"}, [{"id": 2, "result": []}, {"id": 3, "result": "\u00e9"}],
+                    {"id": 4, "result": {"logs": [{"data": "\\"}]}}]
+        data = " ".join(json.dumps(m, ensure_ascii=False) for m in messages) + "\n"
+        for size in (1, 2, 7, len(data)):
+            connection = IPCConnection("ipc://geth.ipc")
+            for i in range(0, len(data), size):
+                connection._buffer += data[i:i + size]
+                connection._split_messages()
+            self.assertEqual(connection._messages, messages)
+            self.assertEqual(connection._buffer.strip(), "")
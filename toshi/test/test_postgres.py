@@ -1,8 +1,15 @@
+import asyncio
+import asyncpg
 from toshi.test.base import AsyncHandlerTest
 from toshi.test.database import requires_database
 
 from toshi.handlers import BaseHandler
-from toshi.database import DatabaseMixin
+from toshi.config import config
+from toshi.database import (
+    DatabaseMixin, with_database, create_pool, HandlerDatabasePoolContext, ReplicaRouter,
+    StatementRegistry)
+from toshi.errors import DatabaseError
+from tornado.escape import json_decode
 from tornado.testing import gen_test
 
 class Handler(DatabaseMixin, BaseHandler):
@@ -19,10 +26,30 @@ class Handler(DatabaseMixin, BaseHandler):
         self.set_status(204)
         self.finish()
 
+class ReadOnlyHandler(DatabaseMixin, BaseHandler):
+
+    @with_database(readonly=True)
+    async def get(self):
+
+        value = await self.db.fetchval("SELECT value FROM store WHERE key = $1", self.get_query_argument('key'))
+        try:
+            await self.db.execute("DELETE FROM store")
+            raise Exception("expected DatabaseError")
+        except DatabaseError:
+            pass
+        self.write({"value": value, "in_transaction": self.db.connection.is_in_transaction()})
+
+class UnusedDatabaseHandler(DatabaseMixin, BaseHandler):
+
+    @with_database
+    async def get(self):
+
+        self.write({"connection": self.db.connection is not None})
+
 class DatabaseTest(AsyncHandlerTest):
 
     def get_urls(self):
-        return [(r'^/$', Handler)]
+        return [(r'^/$', Handler), (r'^/readonly$', ReadOnlyHandler), (r'^/unused$', UnusedDatabaseHandler)]
 
     @gen_test
     @requires_database
@@ -36,3 +63,148 @@ class DatabaseTest(AsyncHandlerTest):
         async with self.pool.acquire() as con:
             row = await con.fetchrow("SELECT * FROM store WHERE key = $1", "TESTKEY")
             self.assertEqual(row['value'], '1')
+
+    @gen_test
+    @requires_database
+    async def test_readonly_context(self):
+
+        async with self.pool.acquire() as con:
+            await con.execute("CREATE TABLE store (key VARCHAR PRIMARY KEY, value VARCHAR)")
+            await con.execute("INSERT INTO store VALUES ($1, $2)", "TESTKEY", "1")
+
+        resp = await self.fetch('/readonly?key=TESTKEY')
+        self.assertResponseCodeEqual(resp, 200)
+        self.assertEqual(json_decode(resp.body), {"value": "1", "in_transaction": False})
+
+        # readonly transactions reject writes
+        async with DatabaseMixin().db.acquire(readonly=True, readonly_transaction=True) as db:
+            self.assertTrue(db.connection.is_in_transaction())
+            with self.assertRaises(asyncpg.exceptions.ReadOnlySQLTransactionError):
+                await db.execute("DELETE FROM store")
+
+    @gen_test
+    @requires_database
+    async def test_lazy_connection(self):
+
+        resp = await self.fetch('/unused')
+        self.assertResponseCodeEqual(resp, 200)
+        self.assertEqual(json_decode(resp.body), {"connection": False})
+
+        db = DatabaseMixin().db
+        async with db:
+            self.assertIsNone(db.connection)
+            self.assertEqual(await db.fetchval("SELECT 1"), 1)
+            self.assertTrue(db.connection.is_in_transaction())
+        self.assertIsNone(db.connection)
+
+        # concurrent first queries share the same connection
+        async with db:
+            first, second = await asyncio.gather(db.acquire_connection(), db.acquire_connection())
+            self.assertIs(first, second)
+            self.assertTrue(first.is_in_transaction())
+            self.assertEqual(self.pool.get_size() - self.pool.get_idle_size(), 1)
+        self.assertEqual(self.pool.get_size() - self.pool.get_idle_size(), 0)
+
+        # the connection can be used directly once acquired
+        async with db:
+            con = await db.acquire_connection()
+            self.assertIs(db.connection, con)
+            stmt = await con.prepare("SELECT $1::int")
+            self.assertEqual(await stmt.fetchval(2), 2)
+
+    @gen_test
+    @requires_database
+    async def test_replica_routing(self):
+
+        # use a second pool to the same database as the replica
+        dbconfig = dict(config['database'])
+        dbconfig.pop('ssl', None)
+        replica = await create_pool(**dbconfig)
+        router = ReplicaRouter([replica], max_lag=10)
+        try:
+            await router.check_lag()
+            self.assertEqual(router.lags, [0.0])
+
+            db = HandlerDatabasePoolContext(self.pool, replicas=router)
+            async with db.acquire(readonly=True) as rodb:
+                self.assertEqual(await rodb.fetchval("SELECT 1"), 1)
+                self.assertIs(rodb.connection_pool, replica)
+                self.assertEqual(router.in_use[replica], 1)
+            self.assertEqual(router.in_use[replica], 0)
+            async with db:
+                await db.execute("SELECT 1")
+                self.assertIs(db.connection_pool, self.pool)
+
+            # replicas that are too far behind aren't used
+            router.lags = [60.0]
+            router._last_lag_check = float('inf')
+            self.assertIsNone(router.get_pool())
+        finally:
+            await router.close()
+
+    @gen_test
+    @requires_database
+    async def test_statement_registry(self):
+
+        async with self.pool.acquire() as con:
+            await con.execute("CREATE TABLE store (key VARCHAR PRIMARY KEY, value VARCHAR)")
+
+        registry = StatementRegistry()
+        insert = registry.register("insert_store", "INSERT INTO store VALUES ($1, $2)")
+        select = registry.register("select_store", "SELECT value FROM store WHERE key = $1")
+        self.assertIs(registry.register("insert_store", "INSERT INTO store VALUES ($1, $2)"), insert)
+        with self.assertRaises(ValueError):
+            registry.register("insert_store", "INSERT INTO store VALUES ($2, $1)")
+        self.assertEqual(registry.statement_cache_size(), 102)
+        self.assertEqual(registry.statement_cache_size(ad_hoc=10), 12)
+
+        for i in range(5):
+            async with DatabaseMixin().db as db:
+                self.assertEqual(await db.execute(insert, str(i), str(i)), "INSERT 0 1")
+                self.assertEqual(await db.fetchval(select, str(i)), str(i))
+                await db.commit()
+
+        async with DatabaseMixin().db as db:
+            with self.assertRaises(asyncpg.exceptions.UniqueViolationError):
+                await db.execute(insert, "0", "0")
+
+        metrics = registry.metrics()
+        self.assertEqual(metrics['insert_store']['calls'], 6)
+        self.assertEqual(metrics['insert_store']['errors'], 1)
+        self.assertEqual(metrics['select_store']['errors'], 0)
+        self.assertEqual(sum(metrics['select_store']['histogram'].values()), 5)
+
+    @gen_test
+    @requires_database
+    async def test_bulk_helpers(self):
+
+        async with self.pool.acquire() as con:
+            await con.execute("CREATE TABLE balances (address VARCHAR PRIMARY KEY, balance INTEGER, updated INTEGER DEFAULT 0)")
+
+        async def rows():
+            for i in range(25):
+                yield ("0x{:040x}".format(i), i)
+
+        # nothing is kept if the context isn't committed
+        async with DatabaseMixin().db as db:
+            self.assertEqual(await db.bulk_insert("balances", ["address", "balance"], rows(), chunk_size=10), 25)
+        async with self.pool.acquire() as con:
+            self.assertEqual(await con.fetchval("SELECT COUNT(*) FROM balances"), 0)
+
+        async with DatabaseMixin().db as db:
+            await db.bulk_insert("balances", ["address", "balance"], rows(), chunk_size=10)
+            upserts = [{"address": "0x{:040x}".format(i), "balance": i * 2, "updated": 1} for i in range(20, 30)]
+            # the last row for a key is used
+            upserts.append({"address": "0x{:040x}".format(29), "balance": 1000, "updated": 2})
+            self.assertEqual(await db.bulk_upsert("balances", upserts, ["address"], chunk_size=4), 10)
+            self.assertEqual(await db.bulk_upsert("balances", [("0x{:040x}".format(0), 1)], ["address"], [],
+                                                  columns=["address", "balance"]), 0)
+            await db.commit()
+
+        async with self.pool.acquire() as con:
+            self.assertEqual(await con.fetchval("SELECT COUNT(*) FROM balances"), 30)
+            self.assertEqual(await con.fetchval("SELECT COUNT(*) FROM balances WHERE updated > 0"), 10)
+            row = await con.fetchrow("SELECT * FROM balances WHERE address = $1", "0x{:040x}".format(29))
+            self.assertEqual((row['balance'], row['updated']), (1000, 2))
+            self.assertEqual(await con.fetchval("SELECT balance FROM balances WHERE address = $1",
+                                                "0x{:040x}".format(0)), 0)
@@ -1,14 +1,18 @@
 import time
 import os
 import mimetypes
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from toshi.handlers import BaseHandler, RequestVerificationMixin
-from tornado.escape import json_encode
+from unittest.mock import patch
+from toshi.handlers import BaseHandler, RequestVerificationMixin, SignedStreamingRequestHandler, verify_request_signature
+from toshi.signature_cache import SignatureCache, RedisSignatureCache
+from tornado.escape import json_encode, json_decode
 from tornado.testing import gen_test
 from toshi.request import sign_request
 from toshi.handlers import TIMESTAMP_EXPIRY
 
 from .base import AsyncHandlerTest
+from .redis import requires_redis
 
 FAUCET_PRIVATE_KEY = "0x0164f7c7399f4bb1eafeaae699ebbb12050bc6a50b2836b9ca766068a9d000c0"
 FAUCET_ADDRESS = "0xde3d2d9dd52ea80f7799ef4791063a5458d13913"
@@ -177,3 +181,253 @@ class RequestVerificationTest(AsyncHandlerTest):
             address=TEST_ADDRESS, timestamp=timestamp, signature=signature)
 
         self.assertResponseCodeEqual(resp, 400)
+
+class AsyncVerificationHandler(RequestVerificationMixin, BaseHandler):
+
+    async def get(self):
+
+        address = await self.verify_request_async()
+        self.write({"address": address})
+
+    async def post(self):
+
+        address = await self.verify_request_async()
+        self.write({"address": address})
+
+class AsyncRequestVerificationTest(AsyncHandlerTest):
+
+    def get_urls(self):
+        return [
+            (r"^/?$", AsyncVerificationHandler),
+        ]
+
+    @gen_test
+    async def test_valid_request(self):
+
+        resp = await self.fetch_signed("/", method="POST", signing_key=TEST_PRIVATE_KEY,
+                                       body={"registration_id": "1234567890"})
+        self.assertResponseCodeEqual(resp, 200)
+        self.assertEqual(json_decode(resp.body)['address'], TEST_ADDRESS)
+
+        resp = await self.fetch_signed("/", signing_key=TEST_PRIVATE_KEY)
+        self.assertResponseCodeEqual(resp, 200)
+
+    @gen_test
+    async def test_invalid_signature(self):
+
+        body = {"registration_id": "1234567890"}
+        timestamp = int(time.time())
+        signature = sign_request(FAUCET_PRIVATE_KEY, "POST", "/", timestamp, json_encode(body).encode('utf-8'))
+
+        resp = await self.fetch_signed("/", method="POST", body=body,
+                                       address=TEST_ADDRESS, timestamp=timestamp, signature=signature)
+        self.assertResponseCodeEqual(resp, 400)
+        self.assertEqual(json_decode(resp.body)['errors'][0]['id'], 'invalid_signature')
+
+    @gen_test
+    async def test_expired_timestamp_checked_first(self):
+
+        timestamp = int(time.time() - (TIMESTAMP_EXPIRY + 60))
+        signature = sign_request(FAUCET_PRIVATE_KEY, "GET", "/", timestamp, None)
+
+        with patch('toshi.handlers.verify_request_signature') as verify:
+            resp = await self.fetch_signed("/", address=TEST_ADDRESS, timestamp=timestamp, signature=signature)
+            verify.assert_not_called()
+        self.assertResponseCodeEqual(resp, 400)
+        self.assertEqual(json_decode(resp.body)['errors'][0]['id'], 'invalid_timestamp')
+
+    @gen_test
+    async def test_verification_executor(self):
+
+        executor = ThreadPoolExecutor(1)
+        self._app.verification_executor = executor
+        try:
+            with patch.object(executor, 'submit', wraps=executor.submit) as submit:
+                resp = await self.fetch_signed("/", signing_key=TEST_PRIVATE_KEY)
+                self.assertEqual(submit.call_count, 1)
+            self.assertResponseCodeEqual(resp, 200)
+        finally:
+            executor.shutdown()
+
+class CachedVerificationHandler(SimpleHandler):
+
+    signature_cache = SignatureCache()
+
+class ReplayRejectingHandler(AsyncVerificationHandler):
+
+    signature_cache = SignatureCache(reject_replays=True)
+
+class RedisCachedHandler(AsyncVerificationHandler):
+
+    signature_cache = RedisSignatureCache(reject_replays=True)
+
+class SyncRedisCachedHandler(SimpleHandler):
+
+    signature_cache = RedisSignatureCache(reject_replays=True)
+
+class SignatureCacheTest(AsyncHandlerTest):
+
+    def get_urls(self):
+        return [
+            (r"^/cached/?$", CachedVerificationHandler),
+            (r"^/replay/?$", ReplayRejectingHandler),
+            (r"^/redis/?$", RedisCachedHandler),
+            (r"^/sync_redis/?$", SyncRedisCachedHandler),
+        ]
+
+    def test_cache_expiry(self):
+
+        cache = SignatureCache(max_size=2, expiry=10)
+        now = int(time.time())
+        self.assertTrue(cache.add("a", now))
+        self.assertFalse(cache.add("a", now))
+        self.assertTrue(cache.get("a"))
+        cache.add("b", now - 20)
+        self.assertFalse(cache.get("b"))
+        cache.add("c", now)
+        cache.add("d", now)
+        self.assertEqual(len(cache), 2)
+        self.assertFalse(cache.get("a"))
+
+    @gen_test
+    async def test_cached_verification(self):
+
+        timestamp = int(time.time())
+        signature = sign_request(TEST_PRIVATE_KEY, "GET", "/cached", timestamp, None)
+
+        with patch('toshi.handlers.verify_request_signature', wraps=verify_request_signature) as verify:
+            for _ in range(3):
+                resp = await self.fetch_signed("/cached", address=TEST_ADDRESS, timestamp=timestamp, signature=signature)
+                self.assertResponseCodeEqual(resp, 204)
+            self.assertEqual(verify.call_count, 1)
+
+            # the address has to match exactly to use the cache
+            resp = await self.fetch_signed("/cached", address=TEST_ADDRESS.upper(), timestamp=timestamp, signature=signature)
+            self.assertResponseCodeEqual(resp, 400)
+            self.assertEqual(verify.call_count, 2)
+
+            # invalid signatures aren't cached
+            signature = sign_request(FAUCET_PRIVATE_KEY, "GET", "/cached", timestamp, None)
+            for _ in range(2):
+                resp = await self.fetch_signed("/cached", address=TEST_ADDRESS, timestamp=timestamp, signature=signature)
+                self.assertResponseCodeEqual(resp, 400)
+            self.assertEqual(verify.call_count, 4)
+
+    @gen_test
+    async def test_reject_replays(self):
+
+        timestamp = int(time.time())
+        signature = sign_request(TEST_PRIVATE_KEY, "GET", "/replay", timestamp, None)
+
+        resp = await self.fetch_signed("/replay", address=TEST_ADDRESS, timestamp=timestamp, signature=signature)
+        self.assertResponseCodeEqual(resp, 200)
+        resp = await self.fetch_signed("/replay", address=TEST_ADDRESS, timestamp=timestamp, signature=signature)
+        self.assertResponseCodeEqual(resp, 400)
+        self.assertEqual(json_decode(resp.body)['errors'][0]['id'], 'replayed_request')
+
+    @gen_test
+    @requires_redis
+    async def test_redis_reject_replays(self):
+
+        timestamp = int(time.time())
+        signature = sign_request(TEST_PRIVATE_KEY, "GET", "/redis", timestamp, None)
+
+        resp = await self.fetch_signed("/redis", address=TEST_ADDRESS, timestamp=timestamp, signature=signature)
+        self.assertResponseCodeEqual(resp, 200)
+        resp = await self.fetch_signed("/redis", address=TEST_ADDRESS, timestamp=timestamp, signature=signature)
+        self.assertResponseCodeEqual(resp, 400)
+        self.assertEqual(json_decode(resp.body)['errors'][0]['id'], 'replayed_request')
+
+    @gen_test
+    async def test_async_cache_requires_async_verification(self):
+
+        # rather than silently skipping the cache (and replay protection)
+        with patch('toshi.handlers.verify_request_signature', wraps=verify_request_signature) as verify:
+            resp = await self.fetch_signed("/sync_redis", signing_key=TEST_PRIVATE_KEY)
+            self.assertResponseCodeEqual(resp, 500)
+            self.assertEqual(verify.call_count, 0)
+
+class StreamingHandler(SignedStreamingRequestHandler):
+
+    def prepare(self):
+        self.chunks = []
+        super().prepare()
+
+    def body_chunk_received(self, chunk):
+        self.chunks.append(chunk)
+
+    def put(self):
+
+        address = self.verify_request()
+        self.write({"address": address, "length": self.body_length, "chunks": len(self.chunks)})
+
+    async def post(self):
+
+        address = await self.verify_request_async()
+        self.write({"address": address, "length": sum(len(c) for c in self.chunks)})
+
+class UnsignedStreamingHandler(SignedStreamingRequestHandler):
+
+    def put(self):
+
+        self.write({"length": self.body_length})
+
+class SignedStreamingRequestHandlerTest(AsyncHandlerTest):
+
+    def get_urls(self):
+        return [
+            (r"^/?$", StreamingHandler),
+            (r"^/unsigned/?$", UnsignedStreamingHandler),
+        ]
+
+    @gen_test
+    async def test_large_body(self):
+
+        body = os.urandom(1024 * 1024)
+        for method in ["POST", "PUT"]:
+            resp = await self.fetch_signed("/", method=method, signing_key=TEST_PRIVATE_KEY, body=body)
+            self.assertResponseCodeEqual(resp, 200)
+            data = json_decode(resp.body)
+            self.assertEqual(data['address'], TEST_ADDRESS)
+            self.assertEqual(data['length'], len(body))
+        self.assertGreater(data['chunks'], 1)
+
+    @gen_test
+    async def test_empty_body(self):
+
+        resp = await self.fetch_signed("/", method="POST", signing_key=TEST_PRIVATE_KEY, body=b"")
+        self.assertResponseCodeEqual(resp, 200)
+        self.assertEqual(json_decode(resp.body)['length'], 0)
+
+    @gen_test
+    async def test_invalid_signature(self):
+
+        timestamp = int(time.time())
+        signature = sign_request(TEST_PRIVATE_KEY, "PUT", "/", timestamp, b"1234")
+        resp = await self.fetch_signed("/", method="PUT", body=b"4321",
+                                       address=TEST_ADDRESS, timestamp=timestamp, signature=signature)
+        self.assertResponseCodeEqual(resp, 400)
+        self.assertEqual(json_decode(resp.body)['errors'][0]['id'], 'invalid_signature')
+
+    @gen_test
+    async def test_expired_timestamp_rejected_before_body(self):
+
+        body = os.urandom(1024 * 1024)
+        timestamp = int(time.time() - (TIMESTAMP_EXPIRY + 60))
+        signature = sign_request(TEST_PRIVATE_KEY, "PUT", "/", timestamp, body)
+
+        with patch.object(StreamingHandler, 'body_chunk_received') as received:
+            resp = await self.fetch_signed("/", method="PUT", body=body,
+                                           address=TEST_ADDRESS, timestamp=timestamp, signature=signature)
+            received.assert_not_called()
+        self.assertResponseCodeEqual(resp, 400)
+        self.assertEqual(json_decode(resp.body)['errors'][0]['id'], 'invalid_timestamp')
+
+    @gen_test
+    async def test_without_ethereum_support(self):
+
+        body = os.urandom(1024 * 1024)
+        with patch('toshi.handlers.ETHEREUM_SUPPORTED', False):
+            resp = await self.fetch("/unsigned", method="PUT", body=body)
+        self.assertResponseCodeEqual(resp, 200)
+        self.assertEqual(json_decode(resp.body)['length'], len(body))
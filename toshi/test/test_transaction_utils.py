@@ -3,10 +3,11 @@ from toshi.ethereum.tx import (
     add_signature_to_transaction, encode_transaction, decode_transaction,
     DEFAULT_STARTGAS, DEFAULT_GASPRICE, create_transaction,
     is_transaction_signed, signature_from_transaction,
-    calculate_transaction_hash
+    calculate_transaction_hash, sign_transaction, transaction_to_json,
+    RawTransaction, decode_raw_transactions
 )
 from toshi.ethereum.utils import data_decoder, data_encoder
-from ethereum.transactions import Transaction, UnsignedTransaction
+from ethereum.transactions import Transaction, UnsignedTransaction, InvalidTransaction
 import rlp
 
 class TestTransactionUtils(unittest.TestCase):
@@ -97,3 +98,50 @@ class TestTransactionUtils(unittest.TestCase):
             self.assertEqual(data_encoder(tx_obj.sender), sender_address)
 
             self.assertEqual(encode_transaction(tx_obj), expected_signed_tx)
+
+class TestRawTransaction(unittest.TestCase):
+
+    def test_decode_signed_transaction(self):
+        raw = "0xf86c808504a817c80082520894db089a4f9a8c5f17040b4fc51647e942b5fc601d880de0b6b3a7640000801ca0f5a43adea07d366ae420a5c75a5cae6c60d3e4aaa0b72c2f37fc387efd43d7fda030c4327f2dbd959f654857f58912129b09763329459d08e25547d895ae90fa0f"
+        tx = RawTransaction.decode(raw)
+        expected = decode_transaction(raw)
+        self.assertTrue(tx.is_signed)
+        for field in ['nonce', 'gasprice', 'startgas', 'to', 'value', 'data', 'v', 'r', 's']:
+            self.assertEqual(getattr(tx, field), getattr(expected, field))
+        self.assertEqual(data_encoder(tx.encode()), raw)
+        self.assertEqual(data_encoder(tx.hash), calculate_transaction_hash(raw))
+        self.assertEqual(tx.sender, expected.sender)
+        self.assertEqual(transaction_to_json(raw), transaction_to_json(expected))
+
+    def test_decode_unsigned_transaction(self):
+        raw = "0xe9808504a817c80082520894db089a4f9a8c5f17040b4fc51647e942b5fc601d880de0b6b3a764000080"
+        tx = RawTransaction.decode(raw)
+        self.assertFalse(tx.is_signed)
+        self.assertEqual(data_encoder(tx.encode()), raw)
+        self.assertEqual(data_encoder(tx.hash), calculate_transaction_hash(raw))
+        self.assertIsInstance(decode_transaction(raw), UnsignedTransaction)
+
+    def test_network_id_transaction(self):
+        tx = create_transaction(nonce=9, gasprice=20 * 10**9, startgas=21000,
+                                to="0x3535353535353535353535353535353535353535",
+                                value=10**18, data=b'', network_id=1)
+        unsigned = encode_transaction(tx)
+        self.assertEqual(RawTransaction.decode(unsigned).network_id, 1)
+        signed = sign_transaction(unsigned, "0x4646464646464646464646464646464646464646464646464646464646464646")
+        raw_tx = RawTransaction.decode(signed)
+        self.assertEqual(raw_tx.network_id, 1)
+        self.assertEqual(raw_tx.sender, decode_transaction(signed).sender)
+        self.assertEqual(data_encoder(raw_tx.hash), calculate_transaction_hash(signed))
+
+    def test_decode_batch(self):
+        raws = [
+            "0xe9808504a817c80082520894db089a4f9a8c5f17040b4fc51647e942b5fc601d880de0b6b3a764000080",
+            data_decoder("0xf86c808504a817c80082520894db089a4f9a8c5f17040b4fc51647e942b5fc601d880de0b6b3a7640000801ca0f5a43adea07d366ae420a5c75a5cae6c60d3e4aaa0b72c2f37fc387efd43d7fda030c4327f2dbd959f654857f58912129b09763329459d08e25547d895ae90fa0f")
+        ]
+        txs = decode_raw_transactions(raws)
+        self.assertEqual([tx.is_signed for tx in txs], [False, True])
+
+    def test_invalid_transactions(self):
+        for raw in ["0xc3808001", "0x01", rlp.encode([b'', b'', b'', b'\x01' * 19, b'', b''])]:
+            with self.assertRaises(InvalidTransaction):
+                RawTransaction.decode(raw)
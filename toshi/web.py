@@ -26,6 +26,16 @@ class Application(tornado.web.Application):
 
         self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
 
+        # used by `verify_request_async` to check signatures. If not configured
+        # the general executor is used
+        self.verification_executor = None
+        if 'verification' in config:
+            max_workers = config['verification'].getint('max_workers', None)
+            if config['verification'].get('executor', 'thread') == 'process':
+                self.verification_executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+            else:
+                self.verification_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
         if 'mixpanel' in config and 'token' in config['mixpanel']:
             try:
                 from toshi.analytics import TornadoMixpanelConsumer